@@ -49,6 +49,10 @@ config['urls']['movie.search'] = "http://api.themoviedb.org/2.1/Movie.search/en/
 config['urls']['movie.getInfo'] = "http://api.themoviedb.org/2.1/Movie.getInfo/en/xml/%(apikey)s/%%s" % (config)
 config['urls']['media.getInfo'] = "http://api.themoviedb.org/2.1/Media.getInfo/en/xml/%(apikey)s/%%s/%%s" % (config)
 
+# the urllib2 opener used to make requests (e.g. one that keeps connections
+# open between requests). If None, urllib2.urlopen is used.
+config['urlopener'] = None
+
 
 import os
 import struct
@@ -121,7 +125,10 @@ class XmlHandler:
 
     def _grabUrl(self, url):
         try:
-            urlhandle = urllib2.urlopen(url)
+            if config['urlopener'] is None:
+                urlhandle = urllib2.urlopen(url)
+            else:
+                urlhandle = config['urlopener'].open(url)
         except IOError, errormsg:
             raise TmdHttpError(errormsg)
         if urlhandle.code >= 400:
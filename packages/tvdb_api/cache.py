@@ -8,85 +8,542 @@
 """
 urllib2 caching handler
 Modified from http://code.activestate.com/recipes/491261/
+
+Responses are kept in a single SQLite database in the cache directory (rather
+than two files per URL), with the bodies compressed. Several processes can
+read from the same cache at once.
+
+Once a cached response is too old, the server is asked whether it has changed
+using the ETag or Last-Modified header it was sent with; if it hasn't (304 Not
+Modified), the cached response is used again without downloading it.
+
+How long a response is fresh for can depend on its URL; see TTLPolicy.
 """
 from __future__ import with_statement
 
 __author__ = "dbr/Ben"
-__version__ = "1.5"
+__version__ = "1.6"
 
 import os
+import re
 import time
+import atexit
+import zlib
+import marshal
 import errno
+import sqlite3
 import httplib
 import urllib2
 import StringIO
-from hashlib import md5
-from threading import RLock
+import threading
+
+# the names of the database files in the cache directory
+CACHE_FILE_NAME = "cache.sqlite"
+SHOW_CACHE_FILE_NAME = "shows.sqlite"
+NAME_TABLE_FILE_NAME = "names.sqlite"
+
+# the counts kept by a CacheStore; see CacheStore.get_stats
+STAT_NAMES = ("hits", "stale", "misses", "revalidations", "evictions")
+
+# how many responses can be used before the times they were used are written
+# out, and how many can be stored before the size limits are checked
+FLUSH_EVERY = 100
+CHECK_LIMITS_EVERY = 50
+
+# how long to wait (in seconds) for another process to finish writing
+BUSY_TIMEOUT = 30
+
+# the max_age of responses that never go stale
+FOREVER = float("inf")
 
-cache_lock = RLock()
+# the response headers that identify a version of a response, and the request
+# headers used to ask whether the server still has that version
+VALIDATOR_HEADERS = (
+    ("ETag", "If-None-Match"),
+    ("Last-Modified", "If-Modified-Since"),
+)
 
-def locked_function(origfunc):
-    """Decorator to execute function under lock"""
-    def wrapped(*args, **kwargs):
-        cache_lock.acquire()
+class SQLiteStore(object):
+    """Base class for stores kept in an SQLite database at the given path.
+    Subclasses set SCHEMA_VERSION and implement _create, which creates the
+    tables; a database with a different version is created again.
+
+    Each thread gets its own connection to the database, so a store can be
+    shared between threads.
+    """
+    SCHEMA_VERSION = None
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout = BUSY_TIMEOUT,
+            isolation_level = None)
+        conn.text_factory = str
         try:
-            return origfunc(*args, **kwargs)
-        finally:
-            cache_lock.release()
-    return wrapped
+            # lets readers carry on while another process is writing
+            conn.execute("PRAGMA journal_mode = WAL")
+        except sqlite3.DatabaseError:
+            # e.g. the file system doesn't support it; the default still works
+            pass
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+        if self._get_version(conn) != self.SCHEMA_VERSION:
+            # check again once no one else can be creating it
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._get_version(conn) != self.SCHEMA_VERSION:
+                    self._create(conn)
+                    conn.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
 
-def calculate_cache_path(cache_location, url):
-    """Checks if [cache_location]/[hash_of_url].headers and .body exist
+        self._local.conn = conn
+        return conn
+
+    def _get_version(self, conn):
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _create(self, conn):
+        raise NotImplementedError()
+
+    def _transaction(self, func, *args):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+class CacheStore(SQLiteStore):
+    """The cached responses, in an SQLite database at the given path.
+
+    If max_size (in bytes) or max_entries is given, the least recently used
+    responses are removed whenever the cache grows past them. Hits, misses
+    and so on are counted (see get_stats); the counts and the times responses
+    were last used are kept in memory and written out every so often, so a
+    cache hit doesn't need a write.
     """
-    thumb = md5(url).hexdigest()
-    header = os.path.join(cache_location, thumb + ".headers")
-    body = os.path.join(cache_location, thumb + ".body")
-    return header, body
-
-def check_cache_time(path, max_age):
-    """Checks if a file has been created/modified in the [last max_age] seconds.
-    False means the file is too old (or doesn't exist), True means it is
-    up-to-date and valid"""
-    if not os.path.isfile(path):
-        return False
-    cache_modified_time = os.stat(path).st_mtime
-    time_now = time.time()
-    if cache_modified_time < time_now - max_age:
-        # Cache is old
-        return False
-    else:
-        return True
-
-@locked_function
-def exists_in_cache(cache_location, url, max_age):
-    """Returns if header AND body cache file exist (and are up-to-date)"""
-    hpath, bpath = calculate_cache_path(cache_location, url)
-    if os.path.exists(hpath) and os.path.exists(bpath):
-        return(
-            check_cache_time(hpath, max_age)
-            and check_cache_time(bpath, max_age)
-        )
-    else:
-        # File does not exist
-        return False
-
-@locked_function
-def store_in_cache(cache_location, url, response):
-    """Tries to store response in cache."""
-    hpath, bpath = calculate_cache_path(cache_location, url)
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, max_size = None, max_entries = None):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._accessed = {} # url -> time last used, not yet written
+        self._counts = {} # stat name -> count, not yet written
+        self._stores = 0 # responses stored since the limits were checked
+        SQLiteStore.__init__(self, path)
+        atexit.register(self._flush_quietly)
+
+    def _create(self, conn):
+        conn.execute("DROP TABLE IF EXISTS responses")
+        conn.execute("DROP TABLE IF EXISTS stats")
+        conn.execute("""CREATE TABLE responses (
+            url TEXT PRIMARY KEY,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stored REAL NOT NULL,
+            accessed REAL NOT NULL)""")
+        conn.execute("CREATE INDEX responses_accessed ON responses (accessed)")
+        conn.execute("""CREATE TABLE stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL)""")
+
+    def lookup(self, url):
+        """Returns the (headers, body, time stored) of the cached response for
+        the URL, or None if it isn't cached
+        """
+        row = self._connect().execute(
+            "SELECT headers, body, stored FROM responses WHERE url = ?",
+            (url, )).fetchone()
+        if row is None:
+            return None
+        headers, body, stored = row
+        return headers, zlib.decompress(str(body)), stored
+
+    def lookup_headers(self, url):
+        """Returns the (headers, time stored) of the cached response for the
+        URL without reading its body, or None if it isn't cached
+        """
+        return self._connect().execute(
+            "SELECT headers, stored FROM responses WHERE url = ?",
+            (url, )).fetchone()
+
+    def store(self, url, headers, body):
+        """Stores (or replaces) the response for the URL
+        """
+        body = zlib.compress(body)
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO responses "
+            "(url, headers, body, size, stored, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, headers, sqlite3.Binary(body), len(headers) + len(body),
+                now, now))
+
+        with self._lock:
+            self._stores += 1
+            check_limits = self._stores >= CHECK_LIMITS_EVERY
+            if check_limits:
+                self._stores = 0
+        if check_limits:
+            self.flush()
+            self.evict()
+
+    def refresh(self, url, headers):
+        """Marks the response for the URL as just stored, with the given
+        headers (e.g. after the server said it hasn't changed)
+        """
+        now = time.time()
+        self._connect().execute(
+            "UPDATE responses SET headers = ?, stored = ?, accessed = ? "
+            "WHERE url = ?",
+            (headers, now, now, url))
+
+    def touch(self, url):
+        """Records that the response for the URL has just been used
+        """
+        with self._lock:
+            self._accessed[url] = time.time()
+            pending = len(self._accessed)
+        if pending >= FLUSH_EVERY:
+            self.flush()
+
+    def count(self, name, n = 1):
+        """Adds n to the named count (e.g. "hits")
+        """
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def flush(self):
+        """Writes out the counts and the times responses were last used
+        """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            counts, self._counts = self._counts, {}
+        if not accessed and not counts:
+            return
+
+        def write(conn):
+            conn.executemany(
+                "UPDATE responses SET accessed = MAX(accessed, ?) WHERE url = ?",
+                [(t, url) for url, t in accessed.items()])
+            for name, n in counts.items():
+                conn.execute("INSERT OR IGNORE INTO stats VALUES (?, 0)", (name, ))
+                conn.execute("UPDATE stats SET value = value + ? WHERE name = ?",
+                    (n, name))
+        self._transaction(write)
+
+    def _flush_quietly(self):
+        # at exit, losing a few counts is better than a traceback
+        try:
+            self.flush()
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        """Removes the least recently used responses until the cache is within
+        max_size and max_entries. Returns the number removed
+        """
+        if self.max_size is None and self.max_entries is None:
+            return 0
+
+        def remove(conn):
+            entries, size = conn.execute(
+                "SELECT COUNT(*), TOTAL(size) FROM responses").fetchone()
+            excess_entries = excess_size = 0
+            if self.max_entries is not None:
+                excess_entries = entries - self.max_entries
+            if self.max_size is not None:
+                excess_size = size - self.max_size
+            if excess_entries <= 0 and excess_size <= 0:
+                return 0
+
+            urls = []
+            for url, url_size in conn.execute(
+                "SELECT url, size FROM responses ORDER BY accessed"):
+                if excess_entries <= 0 and excess_size <= 0:
+                    break
+                urls.append((url, ))
+                excess_entries -= 1
+                excess_size -= url_size
+            conn.executemany("DELETE FROM responses WHERE url = ?", urls)
+            return len(urls)
+
+        removed = self._transaction(remove)
+        if removed:
+            self.count("evictions", removed)
+        return removed
+
+    def get_stats(self):
+        """Returns a dict of the number of entries, their size in bytes (as
+        stored), the size of the cache file and the counts: hits (fresh
+        responses used), stale (responses too old to use as they are), misses
+        (responses not in the cache), revalidations (stale responses the
+        server said were unchanged) and evictions
+        """
+        self.flush()
+        conn = self._connect()
+        stats = dict.fromkeys(STAT_NAMES, 0)
+        stats.update(conn.execute("SELECT name, value FROM stats").fetchall())
+        stats['entries'], stats['size'] = conn.execute(
+            "SELECT COUNT(*), TOTAL(size) FROM responses").fetchone()
+        stats['size'] = int(stats['size'])
+        stats['file_size'] = sum(os.path.getsize(p)
+            for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        return stats
+
+    def gc(self):
+        """Removes responses to get within the limits and shrinks the cache
+        file to fit. Returns the number of responses removed
+        """
+        self.flush()
+        removed = self.evict()
+        self.flush()
+        conn = self._connect()
+        conn.execute("VACUUM")
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.DatabaseError:
+            pass
+        return removed
+
+class ShowStore(SQLiteStore):
+    """Parsed series data, in an SQLite database at the given path, so it
+    doesn't need to be parsed again while the documents it came from are
+    unchanged. The data for each series is stored along with a validator
+    identifying those documents and the time they need checking for changes
+    again; it is up to the caller to work those out and to turn the data into
+    something marshal can store.
+    """
+    SCHEMA_VERSION = 2
+
+    def _create(self, conn):
+        conn.execute("DROP TABLE IF EXISTS shows")
+        conn.execute("""CREATE TABLE shows (
+            sid INTEGER PRIMARY KEY,
+            validator TEXT NOT NULL,
+            data BLOB NOT NULL,
+            stored REAL NOT NULL,
+            expires REAL NOT NULL)""")
+
+    def load(self, sid, validator):
+        """Returns the (data, time it expires) stored for the series, or None
+        if there isn't any or it was stored with a different validator
+        """
+        row = self._connect().execute(
+            "SELECT data, expires FROM shows WHERE sid = ? AND validator = ?",
+            (sid, validator)).fetchone()
+        if row is None:
+            return None
+        try:
+            return marshal.loads(zlib.decompress(str(row[0]))), row[1]
+        except (ValueError, EOFError, TypeError, zlib.error):
+            # e.g. stored by a different version of Python
+            return None
+
+    def save(self, sid, validator, data, expires = FOREVER):
+        """Stores (or replaces) the data for the series
+        """
+        self._connect().execute(
+            "INSERT OR REPLACE INTO shows "
+            "(sid, validator, data, stored, expires) VALUES (?, ?, ?, ?, ?)",
+            (sid, validator, sqlite3.Binary(zlib.compress(marshal.dumps(data))),
+                time.time(), expires))
+
+def _to_utf8(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+class NameStore(SQLiteStore):
+    """The series id (and language) each series name was resolved to, in an
+    SQLite database at the given path, so names don't need to be searched
+    for again.
+
+    The names can be written to a file and read into another NameStore (see
+    export_names and import_names), so several machines can share them. The
+    file has a line for each name, with the name, series id, language and
+    the time it was resolved separated by tabs.
+    """
+    SCHEMA_VERSION = 1
+
+    def _create(self, conn):
+        conn.execute("DROP TABLE IF EXISTS names")
+        conn.execute("""CREATE TABLE names (
+            name TEXT PRIMARY KEY,
+            sid INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            resolved REAL NOT NULL)""")
+
+    def lookup(self, name):
+        """Returns the (series id, language) the name was resolved to, or
+        None if it hasn't been
+        """
+        row = self._connect().execute(
+            "SELECT sid, language FROM names WHERE name = ?",
+            (_to_utf8(name), )).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1].decode("utf-8")
+
+    def save(self, name, sid, language, resolved = None):
+        """Records what the name was resolved to
+        """
+        if resolved is None:
+            resolved = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO names (name, sid, language, resolved) "
+            "VALUES (?, ?, ?, ?)",
+            (_to_utf8(name), int(sid), _to_utf8(language),
+                resolved))
+
+    def forget(self, name):
+        """Removes the name, e.g. if the series it was resolved to has gone
+        """
+        self._connect().execute("DELETE FROM names WHERE name = ?",
+            (_to_utf8(name), ))
+
+    def export_names(self, f):
+        """Writes all the names to the given file, and returns how many there
+        were
+        """
+        count = 0
+        for name, sid, language, resolved in self._connect().execute(
+            "SELECT name, sid, language, resolved FROM names ORDER BY name"):
+            f.write("%s\t%d\t%s\t%.3f\n" % (name, sid, language, resolved))
+            count += 1
+        return count
+
+    def import_names(self, f):
+        """Reads names written by export_names from the given file. A name
+        that is already here is only replaced if the one being read was
+        resolved more recently. Returns how many names were added or replaced.
+        """
+        names = []
+        for line_no, line in enumerate(f):
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            try:
+                name, sid, language, resolved = line.split("\t")
+                names.append((name, int(sid), language, float(resolved)))
+            except ValueError:
+                raise ValueError("line %d is not a name, series id, language "
+                    "and time separated by tabs" % (line_no + 1))
+        return self._transaction(self._import, names)
+
+    def _import(self, conn, names):
+        count = 0
+        for name, sid, language, resolved in names:
+            row = conn.execute("SELECT resolved FROM names WHERE name = ?",
+                (name, )).fetchone()
+            if row is not None and row[0] >= resolved:
+                continue
+            conn.execute("INSERT OR REPLACE INTO names "
+                "(name, sid, language, resolved) VALUES (?, ?, ?, ?)",
+                (name, sid, language, resolved))
+            count += 1
+        return count
+
+def get_conditional_headers(headers):
+    """Returns the request headers for asking whether the response with the
+    given headers (a string) has changed, as a list of (name, value)
+    """
+    message = httplib.HTTPMessage(StringIO.StringIO(headers))
+    conditional_headers = []
+    for name, request_name in VALIDATOR_HEADERS:
+        value = message.getheader(name)
+        if value:
+            conditional_headers.append((request_name, value))
+    return conditional_headers
+
+def update_validators(headers, new_headers):
+    """Returns the given headers (a string) with the validators replaced by
+    any that are in new_headers (a message, e.g. from a 304 response)
+    """
+    message = httplib.HTTPMessage(StringIO.StringIO(headers))
+    for name, request_name in VALIDATOR_HEADERS:
+        value = new_headers.getheader(name)
+        if value:
+            del message[name]
+            message[name] = value
+    return str(message)
+
+def store_in_cache(store, url, response):
+    """Tries to store response in cache. Returns the (headers, body) of the
+    response, whether or not it could be stored
+    """
+    headers = str(response.info())
+    body = response.read()
     try:
-        outf = open(hpath, "w")
-        headers = str(response.info())
-        outf.write(headers)
-        outf.close()
-
-        outf = open(bpath, "w")
-        outf.write(response.read())
-        outf.close()
-    except IOError:
-        return True
-    else:
-        return False
+        store.store(url, headers, body)
+    except sqlite3.Error:
+        pass
+    return headers, body
+
+class TTLPolicy(object):
+    """Decides how long (in seconds) a cached response is fresh for, using
+    the first rule its URL matches, or default if it matches none.
+
+    Each rule is a (pattern, max_age) pair. pattern is a compiled regexp,
+    which is searched for in the URL, or a URL template with %s placeholders
+    (e.g. Tvdb.config['url_epInfo']). max_age is a number of seconds,
+    FOREVER, or a function taking the cached headers and body and returning
+    one of those (e.g. to cache ended series forever).
+
+    Regexps are tried in the order given; templates are tried after them,
+    those with fewer placeholders first, as they are the more specific.
+    """
+    def __init__(self, rules = (), default = 21600):
+        self.default = default
+        self.regexp_rules = []
+        self.template_rules = []
+        for pattern, max_age in rules:
+            self.add(pattern, max_age)
+
+    def add(self, pattern, max_age):
+        """Adds a rule
+        """
+        if isinstance(pattern, basestring):
+            parts = pattern.split("%s")
+            regexp = re.compile("^%s$" % "[^/?&]+".join(
+                re.escape(part) for part in parts))
+            self.template_rules.append((len(parts), -len(pattern), regexp, max_age))
+            self.template_rules.sort(key = lambda rule: rule[:2])
+        else:
+            self.regexp_rules.append((pattern, max_age))
+
+    def get_max_age(self, url, headers, body):
+        """Returns the max_age for the cached response for the URL
+        """
+        max_age = self.default
+        for regexp, rule_max_age in self.regexp_rules:
+            if regexp.search(url):
+                max_age = rule_max_age
+                break
+        else:
+            for count, length, regexp, rule_max_age in self.template_rules:
+                if regexp.match(url):
+                    max_age = rule_max_age
+                    break
+
+        if callable(max_age):
+            max_age = max_age(headers, body)
+        return max_age
 
 class CacheHandler(urllib2.BaseHandler):
     """Stores responses in a persistant on-disk cache.
@@ -94,9 +551,11 @@ class CacheHandler(urllib2.BaseHandler):
     If a subsequent GET request is made for the same URL, the stored
     response is returned, saving time, resources and bandwidth
     """
-    @locked_function
-    def __init__(self, cache_location, max_age = 21600):
-        """The location of the cache directory"""
+    def __init__(self, cache_location, max_age = 21600, max_size = None,
+        max_entries = None):
+        """The location of the cache directory, how long responses are fresh
+        for (a number of seconds, FOREVER, or a TTLPolicy), and the most
+        bytes and responses to keep (see CacheStore)"""
         self.max_age = max_age
         self.cache_location = cache_location
         if not os.path.exists(self.cache_location):
@@ -111,47 +570,102 @@ class CacheHandler(urllib2.BaseHandler):
                     # Our target dir is already a file, or different error,
                     # relay the error!
                     raise
+        self.store = CacheStore(os.path.join(cache_location, CACHE_FILE_NAME),
+            max_size, max_entries)
+
+    def get_stats(self):
+        """Returns the statistics for the cache; see CacheStore.get_stats
+        """
+        return self.store.get_stats()
+
+    def gc(self):
+        """Removes responses to get the cache within its limits, and any files
+        left in the cache directory by older versions (which kept a .headers
+        and a .body file for each URL). Returns the number of responses and
+        files removed
+        """
+        removed = self.store.gc()
+        for name in os.listdir(self.cache_location):
+            if os.path.splitext(name)[1] in (".headers", ".body"):
+                try:
+                    os.remove(os.path.join(self.cache_location, name))
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                removed += 1
+        return removed
 
     def default_open(self, request):
         """Handles GET requests, if the response is cached it returns it
         """
-        if request.get_method() is not "GET":
+        if request.get_method() != "GET":
             return None # let the next handler try to handle the request
 
-        if exists_in_cache(
-            self.cache_location, request.get_full_url(), self.max_age
-        ):
-            return CachedResponse(
-                self.cache_location,
-                request.get_full_url(),
-                set_cache_header = True
-            )
+        url = request.get_full_url()
+        try:
+            cached = self.store.lookup(url)
+        except sqlite3.Error:
+            cached = None
+        if cached is None:
+            self.store.count("misses")
+            return None
+
+        headers, body, stored = cached
+        if isinstance(self.max_age, TTLPolicy):
+            max_age = self.max_age.get_max_age(url, headers, body)
         else:
+            max_age = self.max_age
+        if stored < time.time() - max_age:
+            # Cache is old, so ask the server if it has changed; see
+            # http_response for the answer
+            self.store.count("stale")
+            conditional_headers = get_conditional_headers(headers)
+            if conditional_headers:
+                for name, value in conditional_headers:
+                    request.add_unredirected_header(name, value)
+                request.stale_cache_entry = (headers, body)
             return None
 
+        self.store.count("hits")
+        try:
+            self.store.touch(url)
+        except sqlite3.Error:
+            pass
+        return CachedResponse(self.store, url, headers, body,
+            set_cache_header = True)
+
     def http_response(self, request, response):
         """Gets a HTTP response, if it was a GET request and the status code
-        starts with 2 (200 OK etc) it caches it and returns a CachedResponse
+        starts with 2 (200 OK etc) it caches it and returns a CachedResponse.
+        If it is a 304 Not Modified for a stale cached response, the cached
+        response is refreshed and returned
         """
+        stale_cache_entry = getattr(request, 'stale_cache_entry', None)
+        if response.code == 304 and stale_cache_entry is not None:
+            response.close()
+            url = request.get_full_url()
+            headers, body = stale_cache_entry
+            headers = update_validators(headers, response.info())
+            self.store.count("revalidations")
+            try:
+                self.store.refresh(url, headers)
+            except sqlite3.Error:
+                pass
+            return CachedResponse(self.store, url, headers, body,
+                set_cache_header = True)
+
         if (request.get_method() == "GET"
             and str(response.code).startswith("2")
         ):
-            if 'x-local-cache' not in response.info():
-                # Response is not cached
-                set_cache_header = store_in_cache(
-                    self.cache_location,
-                    request.get_full_url(),
-                    response
-                )
-            else:
-                set_cache_header = True
-            #end if x-cache in response
-
-            return CachedResponse(
-                self.cache_location,
-                request.get_full_url(),
-                set_cache_header = set_cache_header
-            )
+            if 'x-local-cache' in response.info():
+                # Response came from the cache
+                return response
+
+            # Response is not cached
+            url = request.get_full_url()
+            headers, body = store_in_cache(self.store, url, response)
+            return CachedResponse(self.store, url, headers, body,
+                set_cache_header = False)
         else:
             return response
 
@@ -161,21 +675,16 @@ class CachedResponse(StringIO.StringIO):
     To determine if a response is cached or coming directly from
     the network, check the x-local-cache header rather than the object type.
     """
+    def __init__(self, store, url, headers, body, set_cache_header=True):
+        StringIO.StringIO.__init__(self, body)
 
-    @locked_function
-    def __init__(self, cache_location, url, set_cache_header=True):
-        self.cache_location = cache_location
-        hpath, bpath = calculate_cache_path(cache_location, url)
-
-        StringIO.StringIO.__init__(self, file(bpath).read())
-
+        self.store   = store
         self.url     = url
         self.code    = 200
         self.msg     = "OK"
-        headerbuf = file(hpath).read()
         if set_cache_header:
-            headerbuf += "x-local-cache: %s\r\n" % (bpath)
-        self.headers = httplib.HTTPMessage(StringIO.StringIO(headerbuf))
+            headers += "x-local-cache: %s\r\n" % (store.path)
+        self.headers = httplib.HTTPMessage(StringIO.StringIO(headers))
 
     def info(self):
         """Returns headers
@@ -187,15 +696,15 @@ class CachedResponse(StringIO.StringIO):
         """
         return self.url
 
-    @locked_function
     def recache(self):
         new_request = urllib2.urlopen(self.url)
-        set_cache_header = store_in_cache(
-            self.cache_location,
-            new_request.url,
+        headers, body = store_in_cache(
+            self.store,
+            self.url,
             new_request
         )
-        CachedResponse.__init__(self, self.cache_location, self.url, True)
+        CachedResponse.__init__(self, self.store, self.url, headers, body,
+            True)
 
 
 if __name__ == "__main__":
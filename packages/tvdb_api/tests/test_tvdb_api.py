@@ -9,16 +9,28 @@
 """
 
 import os
+import re
 import sys
+import time
+import urllib
+import urllib2
+import shutil
 import datetime
+import tempfile
 import unittest
+import threading
+import mimetools
+import StringIO
+from hashlib import md5
 
 # Force parent directory onto path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import tvdb_api
 import tvdb_ui
-from tvdb_exceptions import (tvdb_shownotfound, tvdb_seasonnotfound,
+from cache import (CacheHandler, CacheStore, NameStore, CACHE_FILE_NAME,
+    FOREVER)
+from tvdb_exceptions import (tvdb_error, tvdb_shownotfound, tvdb_seasonnotfound,
 tvdb_episodenotfound, tvdb_attributenotfound)
 
 class test_tvdb_basic(unittest.TestCase):
@@ -470,6 +482,476 @@ class test_tvdb_custom_caching(unittest.TestCase):
         else:
             self.fail("Did not use custom opener")
 
+class FakeTvdbHandler(urllib2.BaseHandler):
+    """Serves canned responses for a made up show (id 1, "Fake Show"), so the
+    tests using it don't need a network connection. Counts how many times
+    each URL is requested. If etags is True, responses have an ETag, and
+    requests for a version the client already has are answered with a 304.
+    """
+    # run before the real HTTPHandler
+    handler_order = 100
+
+    responses = {
+        'GetSeries.php': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Series><id>1</id><language>en</language><SeriesName>Fake Show</SeriesName></Series></Data>""",
+        '/series/1/en.xml': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Series><id>1</id><SeriesName>Fake Show</SeriesName><Status>Ended</Status></Series></Data>""",
+        '/series/1/de.xml': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Series><id>1</id><SeriesName>Falsche Serie</SeriesName><Status>Ended</Status></Series></Data>""",
+        '/series/1/all/en.xml': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Series><id>1</id><SeriesName>Fake Show</SeriesName><Status>Ended</Status></Series>
+<Episode><id>11</id><SeasonNumber>1</SeasonNumber><EpisodeNumber>1</EpisodeNumber><EpisodeName>Pilot</EpisodeName></Episode>
+<Episode><id>12</id><SeasonNumber>1</SeasonNumber><EpisodeNumber>2</EpisodeNumber><EpisodeName>Second</EpisodeName></Episode>
+</Data>""",
+        '/series/1/actors.xml': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Actor><id>5</id><Name>Someone</Name><Role>Lead</Role></Actor></Data>""",
+        '/series/1/banners.xml': """<?xml version="1.0" encoding="UTF-8" ?>
+<Data><Banner><id>7</id><BannerPath>posters/1-1.jpg</BannerPath><BannerType>poster</BannerType><BannerType2>680x1000</BannerType2></Banner></Data>""",
+    }
+
+    def __init__(self, delay = 0, etags = False):
+        self.delay = delay
+        self.etags = etags
+        self.requests = {}
+        self.codes = []
+        self.lock = threading.Lock()
+
+    def http_open(self, request):
+        url = request.get_full_url()
+        with self.lock:
+            self.requests[url] = self.requests.get(url, 0) + 1
+        # give other threads a chance to ask for the same thing
+        time.sleep(self.delay)
+        for suffix, body in self.responses.items():
+            if suffix in url:
+                headers = ""
+                code, msg = 200, "OK"
+                if self.etags:
+                    etag = '"%s"' % md5(body).hexdigest()
+                    headers = "ETag: %s\r\n" % etag
+                    if request.get_header("If-none-match") == etag:
+                        code, msg, body = 304, "Not Modified", ""
+                with self.lock:
+                    self.codes.append(code)
+                resp = urllib.addinfourl(StringIO.StringIO(body),
+                    mimetools.Message(StringIO.StringIO(headers)), url)
+                resp.code, resp.msg = code, msg
+                return resp
+        raise urllib2.HTTPError(url, 404, "Not Found", None, None)
+
+
+class FakeTvdbTestCase(unittest.TestCase):
+    """Base class for the tests that talk to FakeTvdbHandler instead of the
+    network. Each test gets its own cache directory.
+    """
+    def setUp(self):
+        self.cache_location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_location)
+
+    def _fakeTvdb(self, handler = None, cached = False, **kwargs):
+        """Returns a Tvdb using the given FakeTvdbHandler (or a new one). If
+        cached is True, responses are cached in the test's cache directory,
+        otherwise nothing is cached.
+        """
+        if handler is None:
+            handler = FakeTvdbHandler()
+        if cached:
+            return tvdb_api.Tvdb(cache = self.cache_location,
+                http_handlers = [handler], **kwargs)
+        return tvdb_api.Tvdb(cache = urllib2.build_opener(handler), **kwargs)
+
+
+class test_tvdb_threads(FakeTvdbTestCase):
+    def test_shared_fetch(self):
+        """Threads asking for the same show at the same time share one fetch,
+        and never see a partly loaded show
+        """
+        handler = FakeTvdbHandler(delay = 0.2)
+        t = self._fakeTvdb(handler)
+
+        results = []
+        def lookup():
+            results.append(t['fake show'][1][2]['episodename'])
+
+        threads = [threading.Thread(target = lookup) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(results, ['Second'] * 8)
+        self.assertEquals(sorted(handler.requests.values()), [1, 1])
+        self.assertEquals(t.corrections, {'fake show': 1})
+
+    def test_shared_failed_fetch(self):
+        """Threads asking for a show that can't be found at the same time
+        share one fetch, and all get its error
+        """
+        handler = FakeTvdbHandler(delay = 0.2)
+        t = self._fakeTvdb(handler)
+
+        errors = []
+        def lookup():
+            try:
+                t[2]
+            except tvdb_error, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target = lookup) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(len(errors), 8)
+        self.assertTrue(all(e is errors[0] for e in errors))
+        self.assertEquals(handler.requests.values(), [1])
+        self.assertEquals(t._fetches, {})
+
+    def test_failed_fetch_not_recorded(self):
+        """A show that can't be found is looked up again next time
+        """
+        handler = FakeTvdbHandler()
+        t = self._fakeTvdb(handler)
+        self.assertRaises(tvdb_error, lambda: t[2])
+        self.assertRaises(tvdb_error, lambda: t[2])
+        self.assertEquals(handler.requests.values(), [2])
+
+
+class test_tvdb_episodes(FakeTvdbTestCase):
+    def test_episode_records(self):
+        """Episodes are parsed into records that behave like dicts, and
+        episodes with the same fields share their field names
+        """
+        season = self._fakeTvdb()['fake show'][1]
+        first, second = season[1], season[2]
+
+        self.assertEquals(type(first), tvdb_api.Episode)
+        self.assertEquals(first['episodename'], 'Pilot')
+        self.assertEquals(first.get('seasonnumber'), '1')
+        self.assertEquals(first.get('missing', 'default'), 'default')
+        self.assertTrue('id' in first)
+        self.assertFalse('missing' in first)
+        self.assertRaises(tvdb_attributenotfound, lambda: first['missing'])
+        self.assertEquals(first.keys(),
+            ['id', 'seasonnumber', 'episodenumber', 'episodename'])
+        self.assertEquals(dict(second), {'id': '12', 'seasonnumber': '1',
+            'episodenumber': '2', 'episodename': 'Second'})
+        self.assertTrue(first._layout is second._layout)
+        self.assertEquals(first.season, season)
+
+        second['rating'] = '9.0'
+        self.assertEquals(second['rating'], '9.0')
+        self.assertEquals(len(second), 5)
+        self.assertFalse('rating' in first)
+
+
+    def test_series_data(self):
+        """The series data comes from the episode list, unless it is wanted
+        in another language than the episodes
+        """
+        handler = FakeTvdbHandler()
+        show = self._fakeTvdb(handler)['fake show']
+        self.assertEquals((show['seriesname'], show['status']),
+            ('Fake Show', 'Ended'))
+        self.assertEquals(sorted(url.split('/series/')[-1]
+            for url in handler.requests if '/series/' in url), ['1/all/en.xml'])
+
+        handler = FakeTvdbHandler()
+        show = self._fakeTvdb(handler, language = 'de')['fake show']
+        self.assertEquals(show['seriesname'], 'Falsche Serie')
+        self.assertEquals(show[1][1]['episodename'], 'Pilot')
+        self.assertEquals(sorted(url.split('/series/')[-1]
+            for url in handler.requests if '/series/' in url),
+            ['1/all/en.xml', '1/de.xml'])
+
+
+class test_tvdb_lazy_data(FakeTvdbTestCase):
+    def test_banners_and_actors_loaded_when_used(self):
+        """Banners and actors are only fetched the first time they are used
+        """
+        handler = FakeTvdbHandler()
+        t = self._fakeTvdb(handler, banners = True, actors = True)
+        show = t['fake show']
+        self.assertEquals(show[1][1]['episodename'], 'Pilot')
+        self.assertEquals(len(handler.requests), 2)
+        self.assertFalse(
+            [url for url in handler.requests if 'banners' in url or 'actors' in url])
+
+        banners = show['_banners']
+        self.assertEquals(banners['poster']['680x1000']['7']['_bannerpath'],
+            'http://www.thetvdb.com/banners/posters/1-1.jpg')
+        self.assertTrue(show['_banners'] is banners)
+        self.assertEquals(show['_actors'][0]['name'], 'Someone')
+        self.assertEquals(len(handler.requests), 4)
+        self.assertEquals(sorted(handler.requests.values()), [1] * 4)
+
+    def test_disabled(self):
+        """Banners and actors can't be asked for unless they are enabled
+        """
+        show = self._fakeTvdb()['fake show']
+        self.assertRaises(tvdb_attributenotfound, lambda: show['_banners'])
+
+
+class test_tvdb_cache(FakeTvdbTestCase):
+    def _open(self, handler, url):
+        opener = urllib2.build_opener(CacheHandler(self.cache_location), handler)
+        resp = opener.open(url)
+        return resp.info(), resp.read()
+
+    def test_single_file(self):
+        """Responses are kept in one database file, and served from it
+        """
+        handler = FakeTvdbHandler()
+        url = "http://thetvdb.com/api/key/series/1/all/en.xml"
+        headers, body = self._open(handler, url)
+        self.assertEquals(body, handler.responses['/series/1/all/en.xml'])
+        self.assertFalse('x-local-cache' in headers)
+
+        headers, body = self._open(handler, url)
+        self.assertEquals(body, handler.responses['/series/1/all/en.xml'])
+        self.assertTrue('x-local-cache' in headers)
+        self.assertEquals(handler.requests.values(), [1])
+        self.assertEquals(os.listdir(self.cache_location)[:1], [CACHE_FILE_NAME])
+
+    def test_expired(self):
+        """Responses older than max_age are fetched again
+        """
+        handler = FakeTvdbHandler()
+        url = "http://thetvdb.com/api/key/series/1/en.xml"
+        opener = urllib2.build_opener(
+            CacheHandler(self.cache_location, max_age = -1), handler)
+        opener.open(url).read()
+        opener.open(url).read()
+        self.assertEquals(handler.requests.values(), [2])
+
+    def test_revalidate(self):
+        """Stale responses are revalidated using their ETag, and a 304 reuses
+        the cached body
+        """
+        class ConditionalHandler(urllib2.BaseHandler):
+            handler_order = 100
+            def __init__(self):
+                self.codes = []
+            def http_open(self, request):
+                headers = "ETag: \"v1\"\r\n"
+                if request.get_header("If-none-match") == "\"v1\"":
+                    code, msg, body = 304, "Not Modified", ""
+                else:
+                    code, msg, body = 200, "OK", "<Data />"
+                self.codes.append(code)
+                resp = urllib.addinfourl(StringIO.StringIO(body),
+                    mimetools.Message(StringIO.StringIO(headers)),
+                    request.get_full_url())
+                resp.code, resp.msg = code, msg
+                return resp
+
+        handler = ConditionalHandler()
+        opener = urllib2.build_opener(
+            CacheHandler(self.cache_location, max_age = -1), handler)
+        url = "http://thetvdb.com/api/key/series/1/en.xml"
+        self.assertEquals(opener.open(url).read(), "<Data />")
+        resp = opener.open(url)
+        self.assertEquals(resp.read(), "<Data />")
+        self.assertTrue('x-local-cache' in resp.info())
+        self.assertEquals(handler.codes, [200, 304])
+
+    def test_ttl_policy(self):
+        """Each kind of URL is cached for its own time, and ended series are
+        cached forever
+        """
+        t = self._fakeTvdb(cached = True,
+            cache_ttl = {re.compile("/banners/"): 60})
+        policy, config = t.cache_policy, t.config
+        ended = FakeTvdbHandler.responses['/series/1/en.xml']
+        running = ended.replace("Ended", "Continuing")
+
+        self.assertEquals(policy.get_max_age(
+            config['url_epInfo'] % (1, 'en'), "", ended), FOREVER)
+        self.assertEquals(policy.get_max_age(
+            config['url_seriesInfo'] % (1, 'en'), "", ended), FOREVER)
+        self.assertEquals(policy.get_max_age(
+            config['url_seriesInfo'] % (1, 'en'), "", running), 6 * 60 * 60)
+        self.assertEquals(policy.get_max_age(
+            config['url_seriesBanner'] % (1, ), "", ""), 24 * 60 * 60)
+        self.assertEquals(policy.get_max_age(
+            config['url_getSeries'] % ("scrubs", ), "", ""), 7 * 24 * 60 * 60)
+        self.assertEquals(policy.get_max_age(
+            config['url_artworkPrefix'] % ("posters/1.jpg", ), "", ""), 60)
+        self.assertEquals(policy.get_max_age(
+            "http://example.com/", "", ""), 21600)
+
+    def test_lru_eviction(self):
+        """The least recently used responses are removed to fit the limits
+        """
+        store = CacheStore(os.path.join(self.cache_location, CACHE_FILE_NAME),
+            max_entries = 3)
+        for url in ("a", "b", "c"):
+            store.store(url, "", url)
+            time.sleep(0.01)
+        store.touch("a")
+        store.flush()
+        store.store("d", "", "d")
+        self.assertEquals(store.evict(), 1)
+        self.assertEquals(store.lookup("b"), None)
+        self.assertEquals(store.lookup("a")[1], "a")
+        self.assertEquals(store.get_stats()['evictions'], 1)
+
+    def test_stats(self):
+        """Hits and misses are counted, and kept between runs
+        """
+        cache = CacheHandler(self.cache_location)
+        opener = urllib2.build_opener(cache, FakeTvdbHandler())
+        url = "http://thetvdb.com/api/key/series/1/en.xml"
+        for i in range(3):
+            opener.open(url).read()
+        # as happens at exit
+        cache.store.flush()
+        stats = CacheHandler(self.cache_location).get_stats()
+        self.assertEquals((stats['entries'], stats['hits'], stats['misses']),
+            (1, 2, 1))
+        self.assertTrue(stats['size'] > 0)
+
+    def _countParses(self, func):
+        """Calls func, and returns what it returns and how many XML documents
+        other than search results were parsed meanwhile
+        """
+        parsed = []
+        fromstring = tvdb_api.ElementTree.fromstring
+        def count(src):
+            # the search results still need parsing
+            if "<Episode>" in src or "<Status>" in src:
+                parsed.append(src)
+            return fromstring(src)
+        iterparse = tvdb_api.ElementTree.iterparse
+        def count_iterparse(source, events = None):
+            parsed.append(source)
+            return iterparse(source, events)
+        tvdb_api.ElementTree.fromstring = count
+        tvdb_api.ElementTree.iterparse = count_iterparse
+        try:
+            return func(), len(parsed)
+        finally:
+            tvdb_api.ElementTree.fromstring = fromstring
+            tvdb_api.ElementTree.iterparse = iterparse
+
+    def test_show_cache(self):
+        """A show whose documents haven't changed is loaded from the show
+        cache without reading or parsing them
+        """
+        def load(handler = None):
+            return self._fakeTvdb(handler, cached = True,
+                actors = True)['fake show']
+
+        show = load()
+        handler = FakeTvdbHandler()
+        lookup = CacheStore.lookup
+        def fail_lookup(store, url):
+            self.fail("%s was read from the cache" % url)
+        CacheStore.lookup = fail_lookup
+        try:
+            cached, parsed = self._countParses(lambda: load(handler))
+        finally:
+            CacheStore.lookup = lookup
+
+        self.assertEquals(parsed, 0)
+        self.assertEquals(handler.requests, {})
+        self.assertEquals(cached.data, show.data)
+        self.assertEquals(cached[1][2]['episodename'], 'Second')
+        self.assertEquals(cached[1][2].season.show, cached)
+        self.assertEquals(type(cached['_actors']), tvdb_api.Actors)
+
+    def test_show_cache_stale(self):
+        """Once its documents are stale, a show is only parsed again if the
+        server says they have changed
+        """
+        def load(handler):
+            t = self._fakeTvdb(handler, cached = True,
+                cache_ttl = {'url_seriesInfo': -1, 'url_epInfo': -1})
+            return self._countParses(lambda: t['fake show'])
+
+        show, parsed = load(FakeTvdbHandler(etags = True))
+        self.assertEquals(parsed, 1)
+
+        handler = FakeTvdbHandler(etags = True)
+        show, parsed = load(handler)
+        self.assertEquals((parsed, handler.codes), (0, [304]))
+        self.assertEquals(show[1][2]['episodename'], 'Second')
+
+        handler = FakeTvdbHandler(etags = True)
+        handler.responses = dict(handler.responses)
+        handler.responses['/series/1/all/en.xml'] = handler.responses[
+            '/series/1/all/en.xml'].replace('Second', 'Changed')
+        show, parsed = load(handler)
+        self.assertEquals((parsed, handler.codes), (1, [200]))
+        self.assertEquals(show[1][2]['episodename'], 'Changed')
+
+        # documents without validators are parsed again whenever they are
+        # fetched again
+        show, parsed = load(FakeTvdbHandler())
+        self.assertEquals(parsed, 1)
+
+    def test_name_table(self):
+        """Resolved names are kept between runs, and can be exported and
+        imported
+        """
+        def load():
+            handler = FakeTvdbHandler()
+            t = self._fakeTvdb(handler, cached = True)
+            self.assertEquals(t['fake show'][1][1]['episodename'], 'Pilot')
+            return t, handler
+
+        t, handler = load()
+        self.assertEquals(len([url for url in handler.requests
+            if 'GetSeries' in url]), 1)
+        t, handler = load()
+        self.assertEquals([url for url in handler.requests
+            if 'GetSeries' in url], [])
+
+        exported = StringIO.StringIO()
+        self.assertEquals(t.name_table.export_names(exported), 1)
+        name, sid, language, resolved = exported.getvalue().rstrip().split("\t")
+        self.assertEquals((name, sid, language), ('fake show', '1', 'en'))
+
+        other = NameStore(os.path.join(self.cache_location, "other.sqlite"))
+        other.save("fake show", 2, "en", float(resolved) + 1)
+        other.save("another show", 3, "de")
+        # only the name resolved earlier is replaced
+        exported = StringIO.StringIO()
+        other.export_names(exported)
+        self.assertEquals(t.name_table.import_names(
+            StringIO.StringIO(exported.getvalue())), 2)
+        self.assertEquals(t.name_table.lookup("another show"), (3, u"de"))
+        self.assertEquals(t.name_table.lookup("fake show"), (2, u"en"))
+        exported.seek(0)
+        self.assertEquals(t.name_table.import_names(exported), 0)
+        self.assertRaises(ValueError, t.name_table.import_names,
+            StringIO.StringIO("fake show\t1\n"))
+
+    def test_shared_between_threads(self):
+        """A store can be used from several threads at once
+        """
+        store = CacheStore(os.path.join(self.cache_location, CACHE_FILE_NAME))
+        errors = []
+        def use(i):
+            try:
+                for j in range(20):
+                    url = "http://example.com/%d/%d" % (i, j)
+                    store.store(url, "Content-Type: text/xml\r\n", url * 100)
+                    self.assertEquals(store.lookup(url)[1], url * 100)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = use, args = (i, )) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(store.lookup("http://example.com/missing"), None)
+
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity = 2)
     unittest.main(testRunner = runner)
@@ -18,13 +18,18 @@ __author__ = "dbr/Ben"
 __version__ = "1.5"
 
 import os
+import re
+import sys
+import time
 import urllib
 import urllib2
 import StringIO
 import tempfile
 import warnings
 import logging
-import datetime
+import threading
+import sqlite3
+from hashlib import md5
 
 try:
     import xml.etree.cElementTree as ElementTree
@@ -37,18 +42,108 @@ except ImportError:
     gzip = None
 
 
-from cache import CacheHandler
+from cache import (CacheHandler, TTLPolicy, ShowStore, NameStore, FOREVER,
+    SHOW_CACHE_FILE_NAME, NAME_TABLE_FILE_NAME, get_conditional_headers)
 
 from tvdb_ui import BaseUI, ConsoleUI
 from tvdb_exceptions import (tvdb_error, tvdb_userabort, tvdb_shownotfound,
     tvdb_seasonnotfound, tvdb_episodenotfound, tvdb_attributenotfound)
 
-lastTimeout = None
+# matches the status of a series that has finished airing, in the series or
+# episode XML
+ENDED_STATUS_REGEXP = re.compile(r"<Status>\s*Ended\s*</Status>", re.IGNORECASE)
+
+def ended_series_ttl(max_age):
+    """Returns a cache max_age function (see cache.TTLPolicy) that caches the
+    data of ended series forever, and the data of other series for max_age
+    seconds
+    """
+    def get_max_age(headers, body):
+        if ENDED_STATUS_REGEXP.search(body):
+            return FOREVER
+        return max_age
+    return get_max_age
+
+# how long each kind of response is cached for, by the config key of its URL;
+# see the cache_ttl argument of Tvdb. Search results and actors rarely change,
+# banners are added every so often, and the series and episode data of shows
+# that are still running changes often (but never once they have ended).
+default_cache_ttl = {
+    'url_getSeries': 7 * 24 * 60 * 60,
+    'url_actorsInfo': 7 * 24 * 60 * 60,
+    'url_seriesBanner': 24 * 60 * 60,
+    'url_seriesInfo': ended_series_ttl(6 * 60 * 60),
+    'url_epInfo': ended_series_ttl(6 * 60 * 60),
+}
+
+# XML tag -> field name, so each field name is only made once, and episodes
+# share the same string for it
+_fieldNames = {}
+
+# bumped whenever the way shows are parsed changes, so shows parsed by an older
+# version aren't loaded from the show cache
+PARSED_SHOW_VERSION = 2
+
+# show data that is loaded the first time it is asked for rather than along
+# with the show (see Tvdb._addLazyData), and so isn't in the show cache
+LAZY_SHOW_DATA = ('_banners', '_actors')
 
 def log():
     return logging.getLogger("tvdb_api")
 
 
+def _makeValidator(entries):
+    """Returns a string identifying the given list of (url, headers, time
+    stored) of the cached documents a show is parsed from, which changes if
+    any of them do. Only their ETag and Last-Modified headers are used, so a
+    document the server says hasn't changed keeps the same validator; one
+    without either is identified by the time it was stored instead
+    """
+    digest = md5(str(PARSED_SHOW_VERSION))
+    for url, headers, stored in entries:
+        version = get_conditional_headers(headers) or stored
+        digest.update("\0%s\0%r" % (url.encode("utf-8"), version))
+    return digest.hexdigest()
+
+
+def _showToData(show):
+    """Returns the contents of a Show as plain dicts and lists, which can be
+    stored using marshal
+    """
+    data = dict((key, value) for key, value in show.data.items()
+        if key not in LAZY_SHOW_DATA)
+    seasons = {}
+    for seas_no, season in show.items():
+        seasons[seas_no] = dict((ep_no, dict(episode))
+            for ep_no, episode in season.items())
+    return data, seasons
+
+
+def _showFromData(stored):
+    """Returns a Show made from what _showToData returned
+    """
+    data, seasons = stored
+    show = Show()
+    show.data = data
+    for seas_no, episodes in seasons.items():
+        season = Season(show = show)
+        for ep_no, episode_data in episodes.items():
+            dict.__setitem__(season, ep_no,
+                Episode(season, episode_data.items()))
+        dict.__setitem__(show, seas_no, season)
+    return show
+
+
+class _Fetch(object):
+    """A fetch in progress, which other threads wanting the same thing can
+    wait for instead of fetching it again
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class ShowContainer(dict):
     """Simple dict that holds a series of Show instances
     """
@@ -61,6 +156,9 @@ class Show(dict):
     def __init__(self):
         dict.__init__(self)
         self.data = {}
+        # show data key -> function returning its value, for data that is
+        # loaded the first time it is asked for
+        self.lazy = {}
 
     def __repr__(self):
         return "<Show %s (containing %s seasons)>" % (
@@ -77,6 +175,14 @@ class Show(dict):
             # Non-numeric request is for show-data
             return dict.__getitem__(self.data, key)
 
+        load = self.lazy.get(key)
+        if load is not None:
+            # Show-data that hasn't been loaded yet
+            value = load()
+            self.data[key] = value
+            self.lazy.pop(key, None)
+            return value
+
         # Data wasn't found, raise appropriate error
         if isinstance(key, int) or key.isdigit():
             # Episode number x was not found
@@ -190,11 +296,53 @@ class Season(dict):
         return results
 
 
-class Episode(dict):
-    def __init__(self, season = None):
-        """The season attribute points to the parent season
+class _FieldLayout(object):
+    """The field names of an Episode, in order, and where each one is kept.
+    Episodes with the same fields share a layout (see _getLayout), so each
+    episode only needs to keep its values.
+    """
+    __slots__ = ('names', 'index', 'extended')
+
+    def __init__(self, names):
+        self.names = names
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.extended = {} # field name -> layout with that field added
+
+
+# tuple of field names -> _FieldLayout
+_layouts = {}
+
+def _getLayout(names):
+    """Returns the shared _FieldLayout for the given tuple of field names
+    """
+    layout = _layouts.get(names)
+    if layout is None:
+        layout = _layouts.setdefault(names, _FieldLayout(names))
+    return layout
+
+
+class Episode(object):
+    """The data for an episode. Behaves like a dict of field name to value,
+    but keeps just a list of values; the field names are kept once for all
+    episodes with the same fields. Episodes of long-running shows number in
+    the thousands, each with dozens of fields.
+    """
+    __slots__ = ('season', '_layout', '_values')
+
+    # never equal to anything but another mapping, so can't be hashed
+    __hash__ = None
+
+    def __init__(self, season = None, items = ()):
+        """The season attribute points to the parent season. items is a list
+        of (field name, value) to start with
         """
         self.season = season
+        names = []
+        self._values = []
+        for name, value in items:
+            names.append(name)
+            self._values.append(value)
+        self._layout = _getLayout(tuple(names))
 
     def __repr__(self):
         seasno = int(self.get(u'seasonnumber', 0))
@@ -206,10 +354,74 @@ class Episode(dict):
             return "<Episode %02dx%02d>" % (seasno, epno)
 
     def __getitem__(self, key):
-        try:
-            return dict.__getitem__(self, key)
-        except KeyError:
+        i = self._layout.index.get(key)
+        if i is None:
             raise tvdb_attributenotfound("Cannot find attribute %s" % (repr(key)))
+        return self._values[i]
+
+    def __setitem__(self, key, value):
+        i = self._layout.index.get(key)
+        if i is not None:
+            self._values[i] = value
+            return
+        layout = self._layout.extended.get(key)
+        if layout is None:
+            layout = _getLayout(self._layout.names + (key, ))
+            self._layout.extended[key] = layout
+        self._layout = layout
+        self._values.append(value)
+
+    def __contains__(self, key):
+        return key in self._layout.index
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._layout.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def get(self, key, default = None):
+        i = self._layout.index.get(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def keys(self):
+        return list(self._layout.names)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._layout.names, self._values)
+
+    def iterkeys(self):
+        return iter(self._layout.names)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def update(self, items):
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            self[key] = value
 
     def search(self, term = None, key = None):
         """Search episode data for term, if it matches, return the Episode (self).
@@ -284,7 +496,9 @@ class Tvdb:
                 language = None,
                 search_all_languages = False,
                 apikey = None,
-                forceConnect=False):
+                forceConnect=False,
+                http_handlers = None,
+                cache_ttl = None):
 
         """interactive (True/False):
             When True, uses built-in console UI is used to select the correct show.
@@ -311,14 +525,16 @@ class Tvdb:
 
         banners (True/False):
             Retrieves the banners for a show. These are accessed
-            via the _banners key of a Show(), for example:
+            via the _banners key of a Show(), and are only fetched the
+            first time they are accessed, for example:
 
             >>> Tvdb(banners=True)['scrubs']['_banners'].keys()
             ['fanart', 'poster', 'series', 'season']
 
         actors (True/False):
             Retrieves a list of the actors for a show. These are accessed
-            via the _actors key of a Show(), for example:
+            via the _actors key of a Show(), and are only fetched the
+            first time they are accessed, for example:
 
             >>> t = Tvdb(actors=True)
             >>> t['scrubs']['_actors'][0]['name']
@@ -347,21 +563,35 @@ class Tvdb:
             See http://thetvdb.com/?tab=apiregister to get your own key
 
         forceConnect (bool):
-            If true it will always try to connect to theTVDB.com even if we
-            recently timed out. By default it will wait one minute before
-            trying again, and any requests within that one minute window will
-            return an exception immediately. 
+            No longer used, as there is no longer a global timeout after which
+            Tvdb refuses to connect for a minute. Retrying failed requests and
+            giving up on thetvdb.com while it is down is left to the
+            http_handlers, e.g. a handler with a circuit breaker for each host.
+
+        http_handlers (list of urllib2 handlers):
+            Extra handlers to build the urllib2 opener with, e.g. one that
+            keeps connections open between requests. Not used if an opener
+            is passed in as the cache argument.
+
+        cache_ttl (dict):
+            How long cached responses are used for before checking for
+            changes, overriding default_cache_ttl. Maps the config key of a
+            URL template (e.g. 'url_epInfo') or a compiled regexp matching
+            URLs to a number of seconds, cache.FOREVER or a function (see
+            cache.TTLPolicy). Other URLs are cached for 6 hours. Not used if
+            an opener is passed in as the cache argument.
         """
         
-        global lastTimeout
-        
-        # if we're given a lastTimeout that is less than 1 min just give up
-        if not forceConnect and lastTimeout != None and datetime.datetime.now() - lastTimeout < datetime.timedelta(minutes=1):
-            raise tvdb_error("We recently timed out, so giving up early this time")
-        
         self.shows = ShowContainer() # Holds all Show classes
         self.corrections = {} # Holds show-name to show_id mapping
 
+        # A Tvdb instance can be shared between threads. _lock guards shows,
+        # corrections, _loaded and _fetches; _fetches holds the fetches in
+        # progress, so a show wanted by several threads is only fetched once.
+        self._lock = threading.RLock()
+        self._loaded = set() # show ids that have been completely loaded
+        self._fetches = {}
+
         self.config = {}
 
         if apikey is not None:
@@ -380,22 +610,42 @@ class Tvdb:
         self.config['search_all_languages'] = search_all_languages
 
 
+        http_handlers = list(http_handlers or [])
+
+        # the rules are added once the URLs are known, below
+        self.cache_policy = TTLPolicy()
+        self.cache_handler = None # set if this Tvdb made the cache
+        self.show_cache = None # parsed shows, kept alongside the cache
+        self.name_table = None # resolved show names, kept alongside the cache
+
         if cache is True:
             self.config['cache_enabled'] = True
             self.config['cache_location'] = self._getTempDir()
+            self.cache_handler = CacheHandler(
+                self.config['cache_location'], self.cache_policy)
+            self.show_cache = ShowStore(os.path.join(
+                self.config['cache_location'], SHOW_CACHE_FILE_NAME))
+            self.name_table = NameStore(os.path.join(
+                self.config['cache_location'], NAME_TABLE_FILE_NAME))
             self.urlopener = urllib2.build_opener(
-                CacheHandler(self.config['cache_location'])
+                self.cache_handler, *http_handlers
             )
 
         elif cache is False:
             self.config['cache_enabled'] = False
-            self.urlopener = urllib2.build_opener() # default opener with no caching
+            self.urlopener = urllib2.build_opener(*http_handlers) # no caching
 
         elif isinstance(cache, basestring):
             self.config['cache_enabled'] = True
             self.config['cache_location'] = cache
+            self.cache_handler = CacheHandler(
+                self.config['cache_location'], self.cache_policy)
+            self.show_cache = ShowStore(os.path.join(
+                self.config['cache_location'], SHOW_CACHE_FILE_NAME))
+            self.name_table = NameStore(os.path.join(
+                self.config['cache_location'], NAME_TABLE_FILE_NAME))
             self.urlopener = urllib2.build_opener(
-                CacheHandler(self.config['cache_location'])
+                self.cache_handler, *http_handlers
             )
 
         elif isinstance(cache, urllib2.OpenerDirector):
@@ -461,6 +711,13 @@ class Tvdb:
         self.config['url_seriesBanner'] = u"%(base_url)s/api/%(apikey)s/series/%%s/banners.xml" % self.config
         self.config['url_artworkPrefix'] = u"%(base_url)s/banners/%%s" % self.config
 
+        ttl = dict(default_cache_ttl)
+        ttl.update(cache_ttl or {})
+        for pattern, max_age in ttl.items():
+            if isinstance(pattern, basestring):
+                pattern = self.config[pattern]
+            self.cache_policy.add(pattern, max_age)
+
     #end __init__
 
     def _getTempDir(self):
@@ -469,7 +726,6 @@ class Tvdb:
         return os.path.join(tempfile.gettempdir(), "tvdb_api")
 
     def _loadUrl(self, url, recache = False):
-        global lastTimeout
         try:
             log().debug("Retrieving URL %s" % url)
             resp = self.urlopener.open(url)
@@ -482,8 +738,6 @@ class Tvdb:
                     log().debug("Attempting to recache %s" % url)
                     resp.recache()
         except (IOError, urllib2.URLError), errormsg:
-            if not str(errormsg).startswith('HTTP Error'):
-                lastTimeout = datetime.datetime.now()
             raise tvdb_error("Could not connect to server: %s" % (errormsg))
         #end try
         
@@ -499,16 +753,20 @@ class Tvdb:
         
         return resp.read()
 
-    def _getetsrc(self, url):
-        """Loads a URL using caching, returns an ElementTree of the source
+    def _getetsrc(self, url, src = None, parse = None):
+        """Loads a URL using caching (unless its source is given), returns an
+        ElementTree of the source, or what parse returns if it is given
         """
-        src = self._loadUrl(url)
+        if parse is None:
+            parse = ElementTree.fromstring
+        if src is None:
+            src = self._loadUrl(url)
         try:
-            return ElementTree.fromstring(src)
+            return parse(src)
         except SyntaxError:
             src = self._loadUrl(url, recache=True)
             try:
-                return ElementTree.fromstring(src)
+                return parse(src)
             except SyntaxError, exceptionmsg:
                 errormsg = "There was an error with the XML retrieved from thetvdb.com:\n%s" % (
                     exceptionmsg
@@ -606,7 +864,7 @@ class Tvdb:
 
     #end _getSeries
 
-    def _parseBanners(self, sid):
+    def _parseBanners(self, sid, src = None):
         """Parses banners XML, from
         http://www.thetvdb.com/api/[APIKEY]/series/[SERIES ID]/banners.xml
 
@@ -625,7 +883,7 @@ class Tvdb:
         This interface will be improved in future versions.
         """
         log().debug('Getting season banners for %s' % (sid))
-        bannersEt = self._getetsrc( self.config['url_seriesBanner'] % (sid) )
+        bannersEt = self._getetsrc( self.config['url_seriesBanner'] % (sid), src )
         banners = {}
         for cur_banner in bannersEt.findall('Banner'):
             bid = cur_banner.find('id').text
@@ -657,8 +915,9 @@ class Tvdb:
                     banners[btype][btype2][bid][new_key] = new_url
 
         self._setShowData(sid, "_banners", banners)
+        return banners
 
-    def _parseActors(self, sid):
+    def _parseActors(self, sid, src = None):
         """Parsers actors XML, from
         http://www.thetvdb.com/api/[APIKEY]/series/[SERIES ID]/actors.xml
 
@@ -683,7 +942,7 @@ class Tvdb:
         data from the XML)
         """
         log().debug("Getting actors for %s" % (sid))
-        actorsEt = self._getetsrc(self.config['url_actorsInfo'] % (sid))
+        actorsEt = self._getetsrc(self.config['url_actorsInfo'] % (sid), src)
 
         cur_actors = Actors()
         for curActorItem in actorsEt.findall("Actor"):
@@ -699,6 +958,7 @@ class Tvdb:
                 curActor[tag] = value
             cur_actors.append(curActor)
         self._setShowData(sid, '_actors', cur_actors)
+        return cur_actors
 
     def _getShowData(self, sid, language):
         """Takes a series ID, gets the epInfo URL and parses the TVDB
@@ -718,12 +978,143 @@ class Tvdb:
             )
             getShowInLanguage = self.config['language']
 
-        # Parse show information
+        # The episode list has the series data in it too, so the series data
+        # is only fetched on its own if it is wanted in another language
+        epsUrl = self.config['url_epInfo'] % (sid, language)
+        urls = [epsUrl]
+        seriesUrl = None
+        if getShowInLanguage != language:
+            seriesUrl = self.config['url_seriesInfo'] % (
+                sid, getShowInLanguage)
+            urls.insert(0, seriesUrl)
+
+        # Use the show parsed last time if the documents it was parsed from
+        # haven't changed. That is told from the headers of the cached
+        # documents, so while they are fresh they aren't read at all
+        validator = stored = None
+        if self.show_cache is not None:
+            entries = self._getCachedEntries(urls)
+            if entries is not None:
+                validator = _makeValidator(entries)
+                stored = self._loadParsedShow(sid, validator)
+            if stored is not None and stored[1] > time.time():
+                log().debug('Using parsed show %s from the show cache' % (sid))
+                self._setParsedShow(sid, stored[0])
+                return
+
+        # Get the documents the show is made from, checking stale ones with
+        # the server
         log().debug('Getting all series data for %s' % (sid))
-        seriesInfoEt = self._getetsrc(
-            self.config['url_seriesInfo'] % (sid, getShowInLanguage)
-        )
-        for curInfo in seriesInfoEt.findall("Series")[0]:
+        sources = dict((url, self._loadUrl(url)) for url in urls)
+
+        if self.show_cache is not None:
+            entries = self._getCachedEntries(urls)
+            if entries is None:
+                validator = None
+            else:
+                expires = min(stored_at + self.cache_policy.get_max_age(
+                    url, headers, sources[url])
+                    for url, headers, stored_at in entries)
+                if stored is not None and _makeValidator(entries) == validator:
+                    log().debug('Parsed show %s is unchanged' % (sid))
+                    self._setParsedShow(sid, stored[0])
+                    self._saveParsedShow(sid, validator, stored[0], expires)
+                    return
+                validator = _makeValidator(entries)
+
+        # Parse episode data
+        log().debug('Getting all episodes of %s' % (sid))
+        seriesItems, episodes = self._getetsrc(epsUrl, sources[epsUrl],
+            self._parseEpisodes)
+
+        # Parse show information
+        if seriesUrl is not None:
+            seriesInfoEt = self._getetsrc(seriesUrl, sources[seriesUrl])
+            seriesItems = self._parseSeries(seriesInfoEt.findall("Series")[0])
+        for tag, value in seriesItems or []:
+            self._setShowData(sid, tag, value)
+        #end for series
+
+        if sid not in self.shows:
+            self.shows[sid] = Show()
+        show = self.shows[sid]
+        for seas_no, ep_no, items in episodes:
+            if seas_no not in show:
+                dict.__setitem__(show, seas_no, Season(show = show))
+            season = dict.__getitem__(show, seas_no)
+            if ep_no in season:
+                # listed twice; the later one wins, as with _setItem
+                dict.__getitem__(season, ep_no).update(items)
+            else:
+                dict.__setitem__(season, ep_no, Episode(season, items))
+        #end for episodes
+
+        # Banners and actors are only parsed if they are asked for
+        self._addLazyData(sid)
+
+        if self.show_cache is not None and validator is not None:
+            self._saveParsedShow(sid, validator, _showToData(self.shows[sid]),
+                expires)
+    #end _geEps
+
+    def _getCachedEntries(self, urls):
+        """Returns the (url, headers, time stored) of the cached responses for
+        the URLs without reading their bodies, or None if any of them isn't
+        cached
+        """
+        entries = []
+        for url in urls:
+            try:
+                cached = self.cache_handler.store.lookup_headers(url)
+            except sqlite3.Error, e:
+                log().debug('Could not look up %s in the cache: %s' % (url, e))
+                return None
+            if cached is None:
+                return None
+            entries.append((url, ) + tuple(cached))
+        return entries
+
+    def _loadParsedShow(self, sid, validator):
+        """Returns the (data, time it expires) from the show cache for the
+        show, if it was parsed from the documents with the given validator
+        """
+        try:
+            return self.show_cache.load(sid, validator)
+        except sqlite3.Error, e:
+            log().debug('Could not load parsed show %s: %s' % (sid, e))
+            return None
+
+    def _saveParsedShow(self, sid, validator, data, expires):
+        try:
+            self.show_cache.save(sid, validator, data, expires)
+        except sqlite3.Error, e:
+            log().debug('Could not store parsed show %s: %s' % (sid, e))
+
+    def _setParsedShow(self, sid, data):
+        """Sets the show to one made from the data in the show cache
+        """
+        self.shows[sid] = _showFromData(data)
+        self._addLazyData(sid)
+
+    def _addLazyData(self, sid):
+        """Makes the banners and actors of the show (if enabled) load the
+        first time they are asked for, as most uses of a show never ask for
+        them and they are a request each
+        """
+        show = self.shows[sid]
+        if self.config['banners_enabled']:
+            show.lazy['_banners'] = lambda: self._fetchOnce(
+                ('_banners', sid), self._parseBanners, sid)
+        if self.config['actors_enabled']:
+            show.lazy['_actors'] = lambda: self._fetchOnce(
+                ('_actors', sid), self._parseActors, sid)
+    #end _addLazyData
+
+    def _parseSeries(self, seriesElem):
+        """Returns a list of (field name, value) for the given Series element
+        """
+        items = []
+        for curInfo in seriesElem:
             tag = curInfo.tag.lower()
             value = curInfo.text
 
@@ -733,54 +1124,178 @@ class Tvdb:
                 else:
                     value = self._cleanData(value)
 
-            self._setShowData(sid, tag, value)
-        #end for series
+            items.append((tag, value))
+        return items
 
-        # Parse banners
-        if self.config['banners_enabled']:
-            self._parseBanners(sid)
+    def _parseEpisodes(self, src):
+        """Parses episodes XML, from
+        http://www.thetvdb.com/api/[APIKEY]/series/[SERIES ID]/all/[LANGUAGE].xml
 
-        # Parse actors
-        if self.config['actors_enabled']:
-            self._parseActors(sid)
-
-        # Parse episode data
-        log().debug('Getting all episodes of %s' % (sid))
-        epsEt = self._getetsrc( self.config['url_epInfo'] % (sid, language) )
+        Returns the list of (field name, value) for the series (or None if
+        the document has no Series element), and a list of (season number,
+        episode number, list of (field name, value)) for each episode. The
+        XML is read with iterparse, and each element is thrown away once it
+        has been read, so the whole document is never held in memory as
+        elements
+        """
+        artworkPrefix = self.config['url_artworkPrefix']
+        cleanData = self._cleanData
+        fieldNames = _fieldNames
+
+        series = None
+        episodes = []
+        root = None
+        for event, elem in ElementTree.iterparse(
+            StringIO.StringIO(src), events = ('start', 'end')):
+            if root is None:
+                root = elem
+            if event != 'end':
+                continue
+            if elem.tag == 'Series' and series is None:
+                series = self._parseSeries(elem)
+                root.clear()
+                continue
+            if elem.tag != 'Episode':
+                continue
 
-        for cur_ep in epsEt.findall("Episode"):
-            seas_no = int(cur_ep.find('SeasonNumber').text)
-            ep_no = int(cur_ep.find('EpisodeNumber').text)
-            for cur_item in cur_ep.getchildren():
-                tag = cur_item.tag.lower()
+            seas_no = ep_no = None
+            items = []
+            for cur_item in elem:
+                tag = fieldNames.get(cur_item.tag)
+                if tag is None:
+                    tag = fieldNames.setdefault(cur_item.tag, cur_item.tag.lower())
                 value = cur_item.text
                 if value is not None:
                     if tag == 'filename':
-                        value = self.config['url_artworkPrefix'] % (value)
+                        value = artworkPrefix % (value)
                     else:
-                        value = self._cleanData(value)
-                self._setItem(sid, seas_no, ep_no, tag, value)
-        #end for cur_ep
-    #end _geEps
+                        value = cleanData(value)
+                    if tag == 'seasonnumber':
+                        seas_no = int(value)
+                    elif tag == 'episodenumber':
+                        ep_no = int(value)
+                items.append((tag, value))
+            episodes.append((seas_no, ep_no, items))
+
+            # everything read so far is done with
+            root.clear()
+        return series, episodes
+    #end _parseEpisodes
+
+    def _fetchOnce(self, key, func, *args):
+        """Calls func(*args) and returns the result, unless another thread is
+        already doing the same (identified by key), in which case this waits
+        for it and returns its result (or raises its exception) instead
+        """
+        with self._lock:
+            fetch = self._fetches.get(key)
+            if fetch is None:
+                fetch = _Fetch()
+                self._fetches[key] = fetch
+                is_fetcher = True
+            else:
+                is_fetcher = False
+
+        if not is_fetcher:
+            log().debug('Waiting for %s to be fetched by another thread' % (key, ))
+            # Event.wait can't be interrupted with Ctrl-C unless it has a timeout
+            while not fetch.done.wait(1):
+                pass
+            if fetch.error is not None:
+                raise fetch.error[0], fetch.error[1], fetch.error[2]
+            return fetch.result
+
+        try:
+            fetch.result = func(*args)
+        except:
+            fetch.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._fetches[key]
+            fetch.done.set()
+        return fetch.result
+    #end _fetchOnce
+
+    def _loadShow(self, sid, language):
+        """Gets the show data for the series ID, unless it has already been
+        loaded. Only marks it as loaded once all of it is there, so other
+        threads never see a partly loaded show
+        """
+        def load():
+            with self._lock:
+                if sid in self._loaded:
+                    return
+            self._getShowData(sid, language)
+            with self._lock:
+                self._loaded.add(sid)
+
+        self._fetchOnce(('sid', sid), load)
+    #end _loadShow
+
+    def _lookupName(self, name):
+        """Returns the (series id, language) the name was resolved to by an
+        earlier search, if there is a name table and it has the name
+        """
+        if self.name_table is None:
+            return None
+        try:
+            return self.name_table.lookup(name)
+        except sqlite3.Error, e:
+            log().debug('Could not look up %s in the name table: %s' % (name, e))
+            return None
+
+    def _saveName(self, name, sid, language):
+        """Records what the name was resolved to in the name table, if there
+        is one, so the name isn't searched for again
+        """
+        if self.name_table is None:
+            return
+        try:
+            self.name_table.save(name, sid, language)
+        except sqlite3.Error, e:
+            log().debug('Could not save %s to the name table: %s' % (name, e))
 
     def _nameToSid(self, name):
         """Takes show name, returns the correct series ID (if the show has
         already been grabbed), or grabs all episodes and returns
         the correct SID.
         """
-        if name in self.corrections:
-            log().debug('Correcting %s to %s' % (name, self.corrections[name]) )
-            sid = self.corrections[name]
-        else:
-            log().debug('Getting show %s' % (name))
-            selected_series = self._getSeries( name )
-            sname, sid = selected_series['seriesname'], selected_series['id']
-            log().debug('Got %(seriesname)s, id %(id)s' % selected_series)
-
-            self.corrections[name] = sid
-            self._getShowData(selected_series['id'], selected_series['language'])
-        #end if name in self.corrections
-        return sid
+        with self._lock:
+            sid = self.corrections.get(name)
+        if sid is not None:
+            log().debug('Correcting %s to %s' % (name, sid) )
+            return sid
+
+        def lookup():
+            resolved = self._lookupName(name)
+            if resolved is not None:
+                sid, language = resolved
+                log().debug('Resolved %s to %s using the name table' % (name, sid))
+                try:
+                    self._loadShow(sid, language)
+                except tvdb_error, e:
+                    # e.g. the show has been removed; search for it again
+                    # (which fails too if tvdb can't be reached)
+                    log().debug('Could not load show %s: %s' % (sid, e))
+                    resolved = None
+
+            if resolved is None:
+                log().debug('Getting show %s' % (name))
+                selected_series = self._getSeries( name )
+                sname, sid = selected_series['seriesname'], selected_series['id']
+                log().debug('Got %(seriesname)s, id %(id)s' % selected_series)
+
+                self._loadShow(sid, selected_series['language'])
+                self._saveName(name, sid, selected_series['language'])
+
+            # only record the correction once the show has been loaded, so
+            # other threads don't use the show before it is ready
+            with self._lock:
+                self.corrections[name] = sid
+            return sid
+
+        return self._fetchOnce(('name', name), lookup)
     #end _nameToSid
 
     def __getitem__(self, key):
@@ -789,8 +1304,7 @@ class Tvdb:
         """
         if isinstance(key, (int, long)):
             # Item is integer, treat as show id
-            if key not in self.shows:
-                self._getShowData(key, self.config['language'])
+            self._loadShow(key, self.config['language'])
             return self.shows[key]
         
         key = key.lower() # make key lower case
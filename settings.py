@@ -21,6 +21,81 @@ DIRS_TO_PROCESS = [
     '/mnt/videos/Movies'
 ]
 
+# the path to the scan index file. If set, metaproc records the state of each
+# directory it visits in this file, and on later runs skips directories that
+# have not changed since they were last found to be complete (their
+# subdirectories are still checked). Use the --full option to check everything
+# regardless. Set to None to disable. This setting is only read in the main
+# settings file.
+SCAN_INDEX_PATH = None
+
+# when running with --watch, new files and directories are only processed once
+# nothing has changed for this many seconds, so files that are still being
+# written or copied in aren't picked up half-finished. This setting is only
+# read in the main settings file.
+WATCH_SETTLE_SECONDS = 10
+
+# the path to a file to keep the compiled settings and override files in
+# between runs. Override files are only compiled again when they are modified.
+# Set to None to disable. This setting is only read in the main settings file.
+OVERRIDE_CACHE_PATH = None
+
+# the HTTP settings used when fetching metadata and images. Connections to each
+# host are kept open and reused between requests; HTTP_POOL_SIZE is the number
+# of idle connections kept open for each host. The timeouts are in seconds.
+# These settings are only read in the main settings file.
+HTTP_POOL_SIZE = 4
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 30
+
+# requests that fail because of a connection error, timeout or temporary server
+# error are tried again up to HTTP_RETRIES times, waiting a random time of up
+# to HTTP_RETRY_BACKOFF seconds before the first retry, and up to twice as long
+# before each one after that. No request takes longer than
+# HTTP_REQUEST_DEADLINE seconds in all, including reading the response. Once
+# HTTP_BREAKER_FAILURES tries in a row (counting retries) to a host have
+# failed, requests to it fail straight away for HTTP_BREAKER_RESET seconds,
+# after which a single request is tried to see if it has recovered. These
+# settings are only read in the main settings file.
+HTTP_RETRIES = 3
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_REQUEST_DEADLINE = 120
+HTTP_BREAKER_FAILURES = 5
+HTTP_BREAKER_RESET = 30
+
+# requests to each host are limited to HTTP_RATE_LIMIT a second on average,
+# with bursts of up to HTTP_RATE_BURST requests at once allowed. Different
+# limits can be given for some hosts in HTTP_HOST_RATE_LIMITS, as a dict of host
+# name to a (rate, burst) tuple, e.g. { 'www.thetvdb.com' : (5, 10) }. Set a
+# rate to None for no limit. The number of requests made to a host at once
+# goes up while the host answers quickly and is halved when it slows down or
+# fails, up to HTTP_MAX_CONCURRENCY. These settings are only read in the main
+# settings file.
+HTTP_RATE_LIMIT = 10
+HTTP_RATE_BURST = 20
+HTTP_HOST_RATE_LIMITS = { }
+HTTP_MAX_CONCURRENCY = 16
+
+# the most space (in bytes) and the most responses to keep in the cache of
+# responses from thetvdb.com. When the cache grows past either, the responses
+# used least recently are removed. Set to None for no limit. Use the
+# --cache-stats switch to see how the cache is doing, and --cache-gc (e.g. from
+# cron) to shrink the cache file. These settings are only read in the main
+# settings file.
+TVDB_CACHE_MAX_SIZE = 200 * 1024 * 1024
+TVDB_CACHE_MAX_ENTRIES = None
+
+# the path to a file to record the series and movies that couldn't be found in.
+# A title that wasn't found isn't searched for again until
+# NOT_FOUND_RETRY_AFTER seconds have passed, and the wait doubles each time it
+# still isn't found, up to NOT_FOUND_MAX_RETRY_AFTER seconds. Changing the facts
+# for the title (e.g. in an override file) means it is searched for straight
+# away. Set to None to disable. These settings are only read in the main
+# settings file.
+NOT_FOUND_CACHE_PATH = None
+NOT_FOUND_RETRY_AFTER = 60 * 60
+NOT_FOUND_MAX_RETRY_AFTER = 7 * 24 * 60 * 60
+
 # the python function to use to determine the facts from a given path, e.g.
 # it will determine from the path /mnt/videos/TV/Entourage/Season 1 that the
 # series_title is Entourage, and the season_number is 1.
@@ -45,8 +120,9 @@ PROCESSOR = 'processors.mediabrowser'
 
 # these are the Python regular expressions used to include and exclude paths to
 # be processed. Remember that include filters are processed first before exclude
-# filters. Directories will have a trailing slash applied. A regexp for
-# subdirectories will be automatically added.
+# filters. Directories will have a trailing slash applied, and are always
+# included by the include filters (exclude them explicitly if needed). Simple
+# extension patterns like the ones below are the quickest to check.
 PATH_INCLUDE_REGEXPS = [
     '.*\.avi$',
     '.*\.mkv$',
@@ -86,3 +162,10 @@ DOWNLOAD_IMAGES = True
 
 # maximum number of backdrop images to download
 MAX_NUMBER_OF_BACKDROPS = 3
+
+# the path to a directory to keep every downloaded image in. Images are then put
+# into the media directories as hard links to the stored copy (or copies, if the
+# store is on a different file system), and an image that has been downloaded
+# before, e.g. a poster used by both a series and its seasons, or an image
+# removed by cleaning, is never downloaded again. Set to None to disable.
+IMAGE_STORE_PATH = None
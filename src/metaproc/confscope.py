@@ -0,0 +1,77 @@
+##
+# Layered configuration scopes.
+#
+# Each settings or override file gets its own scope, which only stores the
+# settings that file sets and looks everything else up in its parent scope.
+# Descending into a directory with an override file therefore doesn't copy
+# the whole conf, and anything already worked out in a parent scope (e.g.
+# compiled regexps) is reused as is.
+##
+
+from UserDict import DictMixin
+
+class ConfScope(DictMixin):
+    '''\
+    A dict-like conf where settings not set in this scope are looked up in the
+    parent, which can be another ConfScope or any other mapping (e.g. a dict).
+    Changes only ever affect this scope; the parent is never modified.
+
+    ConfScope objects can be used as the locals when executing a settings or
+    override file, so the file can reference (and build upon) the settings in
+    the parent scopes by name.
+    '''
+    def __init__(self, parent=None, values=None):
+        self.parent = parent
+        self.values = values or { }
+
+    def __getitem__(self, key):
+        scope = self
+        while isinstance(scope, ConfScope):
+            if key in scope.values:
+                return scope.values[key]
+            scope = scope.parent
+
+        if scope is None:
+            raise KeyError(key)
+        return scope[key]
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def __delitem__(self, key):
+        # settings from the parent scopes can't be removed from here
+        del self.values[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+    def keys(self):
+        '''\
+        Returns all the setting names visible from this scope. This needs to
+        walk through every parent scope, so avoid calling it where possible.
+        '''
+        keys = set(self.values.keys())
+        if self.parent is not None:
+            keys.update(self.parent.keys())
+        return list(keys)
+
+    def own_keys(self):
+        '''\
+        Returns the names of the settings set in this scope only.
+        '''
+        return self.values.keys()
+
+    def pop(self, key, *args):
+        '''\
+        Removes and returns a setting set in this scope only.
+        '''
+        return self.values.pop(key, *args)
+
+    def __repr__(self):
+        return '<ConfScope %r, parent %r>' % (self.values, self.parent)
@@ -0,0 +1,162 @@
+##
+# Fact extraction for the default facts function.
+#
+# Each list of facts regexps (e.g. TV_FILE_FACTS_REGEXPS) is turned into a
+# FactMatcher once, which tries all of them in a single regexp match where
+# possible. The facts found for each name are remembered, so a name seen again
+# (e.g. when cleaning after processing, or in --watch mode) isn't matched again.
+##
+
+import re
+from threading import Lock
+
+# named groups and named backreferences, which are renamed when the regexps are
+# combined so the same group name can be used in more than one of them.
+NAMED_GROUP_REGEXP = re.compile(r'\(\?P([<=])(\w+)')
+
+# regexps that can't be combined with others: ones that use numbered
+# backreferences (group numbers change when combined) or inline flags (which
+# apply to the whole regexp).
+UNCOMBINABLE_PATTERN_REGEXP = re.compile(r'\\[1-9]|\(\?[iLmsux]')
+
+# the number of names remembered by each FactMatcher before it starts again
+MEMO_LIMIT = 50000
+
+_lock = Lock()
+
+# tuple of regexps -> FactMatcher
+_matcher_cache = { }
+
+def _combine(regexps, offset):
+    '''\
+    Returns a single compiled regexp that, when used with match, finds the same
+    match as calling search with each of the given regexps in turn and taking
+    the first one that matches. Returns None if they can't be combined.
+
+    The part matched by regexp i is in the group named _r<offset + i>, and its
+    named groups are prefixed with the same name.
+    '''
+    flags = regexps[0].flags
+    alternatives = [ ]
+    for i, r in enumerate(regexps):
+        if r.flags != flags or not isinstance(r.pattern, basestring) or \
+            UNCOMBINABLE_PATTERN_REGEXP.search(r.pattern):
+            return None
+
+        prefix = '_r%d' % (offset + i)
+        pattern = NAMED_GROUP_REGEXP.sub(
+            lambda m: '(?P%s%s_%s' % (m.group(1), prefix, m.group(2)),
+            r.pattern)
+
+        # make sure the renaming didn't touch anything other than group names
+        try:
+            renamed = re.compile(pattern, flags)
+        except re.error:
+            return None
+        if renamed.groups != r.groups or \
+            sorted(renamed.groupindex.keys()) != \
+            sorted([ '%s_%s' % (prefix, n) for n in r.groupindex.keys() ]):
+            return None
+
+        # the lazy [\s\S]*? makes each alternative search along the whole
+        # string before the next alternative is tried, so the first regexp to
+        # match anywhere wins, rather than the one matching the earliest.
+        alternatives.append(r'[\s\S]*?(?P<%s>%s)' % (prefix, pattern))
+
+    try:
+        return re.compile('|'.join(alternatives), flags)
+    except (re.error, AssertionError):
+        # older versions of Python only allow 100 named groups in a regexp
+        return None
+
+class FactMatcher(object):
+    '''\
+    Extracts facts from names using a list of regexps. The named groups of the
+    first regexp that matches are the facts, like calling search with each
+    regexp in turn.
+    '''
+    def __init__(self, regexps):
+        self.regexps = list(regexps)
+        self._memo = { }
+
+        # combine runs of regexps into as few regexps as possible, keeping
+        # those that can't be combined on their own. Each matcher is either
+        # (combined regexp, None) or (None, regexp).
+        self._matchers = [ ]
+        start = 0
+        for end in xrange(1, len(self.regexps) + 1):
+            if end < len(self.regexps) and \
+                _combine(self.regexps[start:end+1], start) is not None:
+                continue
+            self._add_run(start, end)
+            start = end
+
+    def _add_run(self, start, end):
+        if end - start == 1:
+            self._matchers.append((None, self.regexps[start]))
+        else:
+            combined = _combine(self.regexps[start:end], start)
+            self._matchers.append((combined, None))
+
+    def match(self, name):
+        '''\
+        Returns the facts for the given name as a dict, or None if none of the
+        regexps match. The dict returned is shared, so it must not be changed.
+        '''
+        try:
+            return self._memo[name]
+        except KeyError:
+            pass
+
+        facts = None
+        for combined, regexp in self._matchers:
+            if regexp is not None:
+                m = regexp.search(name)
+                if m:
+                    facts = m.groupdict()
+                    break
+            else:
+                m = combined.match(name)
+                if m:
+                    facts = self._get_facts(m)
+                    break
+
+        if len(self._memo) >= MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[name] = facts
+        return facts
+
+    def match_all(self, names):
+        '''\
+        Returns a dict of facts for each of the given names (e.g. a directory
+        listing) that any of the regexps match.
+        '''
+        results = { }
+        for name in names:
+            facts = self.match(name)
+            if facts is not None:
+                results[name] = facts
+        return results
+
+    def _get_facts(self, m):
+        # the outermost group of the alternative that matched is always the
+        # last one to be closed.
+        prefix = m.lastgroup
+        regexp = self.regexps[int(prefix[2:])]
+        return dict([ (n, m.group('%s_%s' % (prefix, n)))
+                      for n in regexp.groupindex.keys() ])
+
+def get_fact_matcher(regexps):
+    '''\
+    Returns the FactMatcher for the given list of compiled regexps, creating it
+    the first time the list is seen.
+    '''
+    key = tuple(regexps)
+
+    matcher = _matcher_cache.get(key)
+    if matcher is None:
+        matcher = FactMatcher(key)
+        with _lock:
+            matcher = _matcher_cache.setdefault(key, matcher)
+
+    return matcher
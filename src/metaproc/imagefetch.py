@@ -0,0 +1,222 @@
+##
+# Image downloads for metaproc.
+#
+# Images are streamed into a temporary file next to the final path and only
+# renamed into place once the whole image has arrived and looks like an image,
+# so a crash or timeout never leaves a truncated folder.jpg behind (which would
+# otherwise be taken as complete on every later run).
+#
+# If an ImageStore is given (see imagestore), images are downloaded into the
+# store and linked into place from there, and images already in the store
+# aren't downloaded again.
+#
+# Nothing is printed here, as downloads can run on threads other than the one
+# processing the path; the caller reports the results.
+##
+
+import os
+import time
+import errno
+import hashlib
+import socket
+import httplib
+import urllib2
+import tempfile
+import threading
+
+# the size of the chunks images are read and written in
+CHUNK_SIZE = 64 * 1024
+
+# the first bytes of each image format we expect to be sent
+IMAGE_SIGNATURES = (
+    '\xff\xd8\xff',             # JPEG
+    '\x89PNG\r\n\x1a\n',        # PNG
+    'GIF87a', 'GIF89a',         # GIF
+)
+
+# the suffix of the temporary files images are downloaded into. It isn't an
+# image extension, so a partly downloaded image is never taken for a real one.
+PARTIAL_SUFFIX = '.part'
+
+# the errors a failed download can raise
+DOWNLOAD_ERRORS = (urllib2.URLError, httplib.HTTPException, socket.error,
+                   EnvironmentError)
+
+# the process umask, which can only be read by setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+class ImageDownloadError(Exception):
+    '''\
+    Raised when what was downloaded is not a complete image.
+    '''
+    pass
+
+class Download(object):
+    '''\
+    The result of downloading url to path: the number of bytes written, the
+    number of seconds it took and, if it failed, the error. from_store is True
+    if the image came from the image store rather than being downloaded.
+    '''
+    __slots__ = ('url', 'path', 'size', 'seconds', 'error', 'from_store')
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.size = 0
+        self.seconds = 0.0
+        self.error = None
+        self.from_store = False
+
+    def __str__(self):
+        if self.error is not None:
+            return 'could not download %s (%s)' % (self.url, self.error)
+        if self.from_store:
+            return '%s (%s from the image store)' % (
+                os.path.basename(self.path), format_size(self.size))
+        return '%s (%s in %.2fs)' % (os.path.basename(self.path),
+                                     format_size(self.size), self.seconds)
+
+def format_size(size):
+    '''\
+    Returns the given number of bytes in a readable form, e.g. "12.3 KB".
+    '''
+    if size < 1024:
+        return '%d B' % size
+    if size < 1024 * 1024:
+        return '%.1f KB' % (size / 1024.0)
+    return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+def is_image_data(data):
+    '''\
+    Returns whether the given data starts like one of the IMAGE_SIGNATURES.
+    '''
+    for signature in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return True
+    return False
+
+def _get_content_length(response):
+    value = response.info().getheader('Content-Length')
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _stream(response, f, content_hash):
+    '''\
+    Copies the response to the file, checking it is an image as soon as the
+    first chunk arrives and adding it to the given hash. Returns the number of
+    bytes copied.
+    '''
+    size = 0
+    chunk = response.read(CHUNK_SIZE)
+    if not is_image_data(chunk):
+        raise ImageDownloadError('the response is not an image')
+
+    while chunk:
+        f.write(chunk)
+        content_hash.update(chunk)
+        size += len(chunk)
+        chunk = response.read(CHUNK_SIZE)
+
+    return size
+
+def fetch(opener, url, path, store=None):
+    '''\
+    Downloads the image at url to path using the given urllib2 opener, and
+    returns a Download. path is only created (or replaced) if the whole image
+    was downloaded; if the download fails, the Download's error says why and
+    nothing is left behind.
+
+    If an ImageStore is given, the image is taken from it if it has already
+    been downloaded, and is added to it otherwise.
+    '''
+    download = Download(url, path)
+    start = time.time()
+
+    dir_path, name = os.path.split(path)
+    temp_path = None
+    try:
+        if store is not None:
+            object_path = store.lookup(url)
+            if object_path is not None:
+                store.materialise(object_path, path)
+                download.size = os.path.getsize(path)
+                download.from_store = True
+                return download
+
+        response = opener.open(url)
+        try:
+            expected_size = _get_content_length(response)
+
+            if store is not None:
+                f, temp_path = store.mkstemp(name)
+            else:
+                fd, temp_path = tempfile.mkstemp(prefix='.%s.' % name,
+                                                 suffix=PARTIAL_SUFFIX,
+                                                 dir=dir_path or '.')
+                f = os.fdopen(fd, 'wb')
+            content_hash = hashlib.sha1()
+            try:
+                download.size = _stream(response, f, content_hash)
+            finally:
+                f.close()
+        finally:
+            response.close()
+
+        if expected_size is not None and download.size != expected_size:
+            raise ImageDownloadError('expected %d bytes but got %d' %
+                                     (expected_size, download.size))
+
+        # the image gets the usual permissions, rather than the private ones
+        # mkstemp creates files with
+        os.chmod(temp_path, 0666 & ~_umask)
+
+        if store is not None:
+            object_path = store.add(url, temp_path, content_hash.hexdigest())
+            temp_path = None
+            store.materialise(object_path, path)
+        else:
+            os.rename(temp_path, path)
+            temp_path = None
+    except (ImageDownloadError,) + DOWNLOAD_ERRORS, e:
+        download.error = e
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        download.seconds = time.time() - start
+
+    return download
+
+def fetch_all(opener, downloads, store=None):
+    '''\
+    Downloads each of the given (url, path) pairs at the same time, and returns
+    a list of Downloads in the same order.
+    '''
+    results = [ None ] * len(downloads)
+
+    def run(i, url, path):
+        results[i] = fetch(opener, url, path, store)
+
+    # the first one is downloaded on this thread while the others are running
+    threads = [ ]
+    for i, (url, path) in enumerate(downloads[1:]):
+        t = threading.Thread(target=run, args=(i + 1, url, path))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    if downloads:
+        run(0, downloads[0][0], downloads[0][1])
+
+    for t in threads:
+        t.join()
+
+    return results
@@ -0,0 +1,175 @@
+##
+# Content-addressed image store for metaproc.
+#
+# The same image is often needed in more than one place, e.g. a series poster
+# that is also used for a season, a series that is in the library twice, or
+# images that come back after a directory is cleaned and processed again. When
+# the IMAGE_STORE_PATH setting is set, every downloaded image is kept in the
+# store, and images are put into the media directories as hard links to it (or
+# copies, where hard links can't be used). An image already in the store isn't
+# downloaded again.
+#
+# The store directory holds -
+#
+#   objects/ab/abcdef...  the images, named by the SHA-1 of their contents
+#   urls/12/123456...     for each URL (named by the SHA-1 of the URL), the
+#                         SHA-1 of the image downloaded from it
+#   tmp/                  images being downloaded
+#
+# Everything is written to a temporary file and renamed into place, so more
+# than one metaproc can use the same store at once.
+##
+
+import os
+import errno
+import shutil
+import hashlib
+import tempfile
+from threading import Lock
+
+# the errors that mean a hard link can't be made, so the image is copied
+# instead, e.g. the store is on another file system or the file system doesn't
+# do hard links.
+LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP,
+               errno.EOPNOTSUPP, errno.EACCES)
+
+_lock = Lock()
+
+# store path -> ImageStore
+_stores = { }
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def _fan_out(dir_path, name):
+    return os.path.join(dir_path, name[:2], name)
+
+class ImageStore(object):
+    '''\
+    The image store at the given path; see the top of this module.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.objects_path = os.path.join(path, 'objects')
+        self.urls_path = os.path.join(path, 'urls')
+        self.tmp_path = os.path.join(path, 'tmp')
+        _makedirs(self.tmp_path)
+
+    def get_object_path(self, content_hash):
+        return _fan_out(self.objects_path, content_hash)
+
+    def _get_url_path(self, url):
+        # tvdb and tmdb paths can have non-ASCII characters in them
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return _fan_out(self.urls_path, hashlib.sha1(url).hexdigest())
+
+    def lookup(self, url):
+        '''\
+        Returns the path to the image downloaded from the given URL, or None
+        if it isn't in the store.
+        '''
+        try:
+            f = open(self._get_url_path(url), 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            content_hash = f.read().strip()
+        finally:
+            f.close()
+
+        object_path = self.get_object_path(content_hash)
+        if not content_hash or not os.path.exists(object_path):
+            # e.g. the objects have been removed to save space
+            return None
+        return object_path
+
+    def mkstemp(self, name):
+        '''\
+        Returns an open file and its path for downloading an image into. The
+        file is then either added (see add) or removed by the caller.
+        '''
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % name,
+                                         suffix='.part', dir=self.tmp_path)
+        return os.fdopen(fd, 'wb'), temp_path
+
+    def add(self, url, temp_path, content_hash):
+        '''\
+        Moves the image downloaded from the given URL at temp_path into the
+        store, and returns its path in the store. If the same image is already
+        in the store (e.g. downloaded from another URL), that one is used and
+        temp_path is removed.
+        '''
+        object_path = self.get_object_path(content_hash)
+        if os.path.exists(object_path):
+            _remove(temp_path)
+        else:
+            _makedirs(os.path.dirname(object_path))
+            os.rename(temp_path, object_path)
+
+        # record which image the URL gave
+        url_path = self._get_url_path(url)
+        _makedirs(os.path.dirname(url_path))
+        f, record_path = self.mkstemp('url')
+        try:
+            f.write(content_hash)
+        finally:
+            f.close()
+        os.rename(record_path, url_path)
+
+        return object_path
+
+    def materialise(self, object_path, path):
+        '''\
+        Puts the image at object_path (in the store) at the given path, as a
+        hard link if possible or a copy if not. Returns True if a hard link was
+        made.
+        '''
+        dir_path, name = os.path.split(path)
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.part',
+                                         dir=dir_path or '.')
+        os.close(fd)
+        try:
+            os.remove(temp_path)
+            try:
+                os.link(object_path, temp_path)
+                linked = True
+            except OSError, e:
+                if e.errno not in LINK_ERRORS:
+                    raise
+                shutil.copyfile(object_path, temp_path)
+                linked = False
+            os.rename(temp_path, path)
+        except:
+            _remove(temp_path)
+            raise
+
+        return linked
+
+def get_image_store(path):
+    '''\
+    Returns the ImageStore at the given path, or None if path is None.
+    '''
+    if path is None:
+        return None
+
+    path = os.path.abspath(os.path.expanduser(path))
+    with _lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ImageStore(path)
+            _stores[path] = store
+    return store
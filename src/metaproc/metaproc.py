@@ -7,9 +7,29 @@ import sys
 import re
 from optparse import OptionParser
 
-APP_ONLY_SETTINGS = [ 'DIRS_TO_PROCESS' ]
+import walker
+import scanindex
+import parallel
+import watch
+import settingscache
+import confscope
+import pathfilter
+import factmatcher
+import workplan
+import transport
+
+APP_ONLY_SETTINGS = [ 'DIRS_TO_PROCESS', 'SCAN_INDEX_PATH',
+                      'WATCH_SETTLE_SECONDS', 'OVERRIDE_CACHE_PATH',
+                      'HTTP_POOL_SIZE', 'HTTP_CONNECT_TIMEOUT',
+                      'HTTP_READ_TIMEOUT', 'HTTP_RETRIES',
+                      'HTTP_RETRY_BACKOFF', 'HTTP_REQUEST_DEADLINE',
+                      'HTTP_BREAKER_FAILURES', 'HTTP_BREAKER_RESET',
+                      'HTTP_RATE_LIMIT', 'HTTP_RATE_BURST',
+                      'HTTP_HOST_RATE_LIMITS', 'HTTP_MAX_CONCURRENCY',
+                      'TVDB_CACHE_MAX_SIZE', 'TVDB_CACHE_MAX_ENTRIES',
+                      'NOT_FOUND_CACHE_PATH', 'NOT_FOUND_RETRY_AFTER',
+                      'NOT_FOUND_MAX_RETRY_AFTER' ]
 MODULES_TO_LOAD_IN_SETTINGS = [ 'PROCESSOR' ]
-INCLUDE_SUBDIR_REGEXP = re.compile('.*/$')
 
 # FUNCTIONS
 def default_facts_function(path, conf, facts):
@@ -40,20 +60,18 @@ def default_facts_function(path, conf, facts):
         
         # if this is a file, jump straight to the file regexps if we don't have
         # all the details already
-        if os.path.isfile(path) and not \
+        if walker.path_is_file(path) and not \
             (series_title and season_number and episode_number):
-            for regexp in conf['TV_FILE_FACTS_REGEXPS']:
-                m = regexp.search(file_name)
-                if m:
-                    facts.update(m.groupdict())
-                    break
+            matcher = factmatcher.get_fact_matcher(conf['TV_FILE_FACTS_REGEXPS'])
+            found_facts = matcher.match(file_name)
+            if found_facts:
+                facts.update(found_facts)
         
         elif series_title and not season_number:
-            for regexp in conf['TV_SEASON_FACTS_REGEXPS']:
-                m = regexp.search(file_name)
-                if m:
-                    facts.update(m.groupdict())
-                    break
+            matcher = factmatcher.get_fact_matcher(conf['TV_SEASON_FACTS_REGEXPS'])
+            found_facts = matcher.match(file_name)
+            if found_facts:
+                facts.update(found_facts)
         
         elif not series_title:
             facts['series_title'] = file_name
@@ -67,12 +85,11 @@ def default_facts_function(path, conf, facts):
         
         if not movie_title:
             # prefer the dir name as the movie title than one extracted from the file
-            if os.path.isfile(path):
-                for regexp in conf['MOVIE_TITLE_FACTS_REGEXPS']:
-                    m = regexp.search(file_name)
-                    if m:
-                        facts.update(m.groupdict())
-                        break
+            if walker.path_is_file(path):
+                matcher = factmatcher.get_fact_matcher(conf['MOVIE_TITLE_FACTS_REGEXPS'])
+                found_facts = matcher.match(file_name)
+                if found_facts:
+                    facts.update(found_facts)
             # this is a dir, assume the dir name is the movie title
             else:
                 facts['movie_title'] = file_name
@@ -97,19 +114,26 @@ def load_settings(path, current_settings=None):
     
     If current_settings is specified, it is passed into the loading process so
     the settings file to load can reference the current settings. The result is
-    the new settings are merged in with the current settings in a new dict.
+    a new confscope.ConfScope holding only the settings set by this file, with
+    current_settings as its parent; current_settings itself is not changed.
+    
+    The file is only compiled the first time it is seen (or when it changes);
+    see settingscache.
     '''
     tmp_globals = globals()
-    tmp_locals = get_settings_locals()
-    if current_settings:
-        tmp_locals.update(current_settings)
-    execfile(path, tmp_globals, tmp_locals)
+    if current_settings is None:
+        current_settings = get_settings_locals()
+    tmp_locals = confscope.ConfScope(current_settings)
+    exec settingscache.get_code(path) in tmp_globals, tmp_locals
+    
+    # only the settings set by this file need to be looked at below; the ones
+    # inherited from current_settings have already been loaded and compiled.
+    own_keys = tmp_locals.own_keys()
     
     # load the actual module for those settings in MODULES_TO_LOAD_IN_SETTINGS
     for s in MODULES_TO_LOAD_IN_SETTINGS:
-        # also check if it is a string as if current_settings is passed in, it
-        # could already by a module.
-        if s in tmp_locals.keys() and isinstance(tmp_locals[s], basestring):
+        # also check if it is a string as it could be set to a module already.
+        if s in own_keys and isinstance(tmp_locals[s], basestring):
             m = __import__(tmp_locals[s])
             
             # __import__ returns an module wrapped with metadata; we only want
@@ -122,192 +146,389 @@ def load_settings(path, current_settings=None):
             tmp_locals[s] = getattr(m, module_name)
     
     # compile any regexps.
-    for s in tmp_locals.keys():
+    for s in own_keys:
         if s.lower().endswith('_regexp'):
             # only compile if a string is given (a compiled RE object can also
             # be provided)
             if isinstance(tmp_locals[s], basestring):
-                tmp_locals[s] = re.compile(tmp_locals[s], re.IGNORECASE)
+                tmp_locals[s] = settingscache.compile_regexp(tmp_locals[s])
         elif s.lower().endswith('_regexps'):
             regexps = [ ]
             for regexp in tmp_locals[s]:
                 # only compile if a string is given (a compiled RE object can 
                 # also be provided)
                 if isinstance(regexp, basestring):
-                    regexps.append(re.compile(regexp, re.IGNORECASE))
+                    regexps.append(settingscache.compile_regexp(regexp))
                 else:
                     regexps.append(regexp)
             tmp_locals[s] = regexps
     
     return tmp_locals
 
-def get_files_list(path, conf):
+def get_files_list(path, conf, listing=None):
     '''\
-    Gets the list of files to process at this path after applying any rules set
-    in conf.
+    Gets the files to process at this path after applying any rules set in
+    conf, as an iterator. The conf is not changed.
+    
+    If the directory has already been listed using walker.scan_dir, the listing
+    can be passed in so the directory is not listed again. The returned paths
+    are walker.PathEntry objects.
     '''
-    # ignore the override file (it has already be loaded; see above)
-    files = [ p for p in os.listdir(path) if p != '.metaproc-override' ]
-    
-    # make the file paths absolute
-    files = [ os.path.join(path, p) for p in files ]
-    
-    # add trailing slash if it is a directory
-    files = [ os.path.isdir(p) and (p + os.path.sep) or p for p in files ]
-    
-    # apply include filters
-    if 'PATH_INCLUDE_REGEXPS' in conf.keys() and \
-        len(conf['PATH_INCLUDE_REGEXPS']) > 0:
-        filtered_files = [ ]
-        include_regexps = conf['PATH_INCLUDE_REGEXPS']
-        # add the regexp to include subdirectories. If you want to exclude
-        # subdirectories, that needs to be explicitly set in the
-        # PATH_EXCLUDE_REGEXPS setting.
-        include_regexps.append(INCLUDE_SUBDIR_REGEXP)
-        for f in files:
-            for r in include_regexps:
-                if r.search(f):
-                    # matches, so add it to the filtered list and don't bother
-                    # continuing to match
-                    filtered_files.append(f)
-                    break
-        
-        files = filtered_files
+    # the override file is never in the listing (it has already be loaded; see
+    # plan_path)
+    if listing is None:
+        listing = walker.scan_dir(path)
     
-    # apply exclude filters
-    if 'PATH_EXCLUDE_REGEXPS' in conf.keys() and \
-        len(conf['PATH_EXCLUDE_REGEXPS']) > 0:
-        filtered_files = [ ]
-        exclude_regexps = conf['PATH_EXCLUDE_REGEXPS']
-        for f in files:
-            exclude_file = False
-            for r in exclude_regexps:
-                if r.search(f):
-                    # matches, so add mark this as to be excluded and don't
-                    # bother continuing to match
-                    exclude_file = True
-                    break
-            
-            if not exclude_file:
-                filtered_files.append(f)
-        
-        files = filtered_files
+    # the listing is already sorted, so the files are processed in an orderly
+    # fashion, instead of a seemingly random order.
+    return pathfilter.get_path_filter(conf).filter(listing)
+
+def get_work_item(path, conf, facts):
+    '''\
+    Asks the processor what is left to do for the given path, without doing it.
+    Returns a workplan.WorkItem, or None if there is nothing to do.
     
-    # sort the files so the processing works in an orderly fashion, instead of a
-    # seemingly random order.
-    files.sort()
+    Processors that don't implement plan are asked whether the path is complete
+    using is_complete instead; if they don't implement that either, the path is
+    always processed.
+    '''
+    processor = conf['PROCESSOR']
+    plan = getattr(processor, 'plan', None)
+    if plan is not None:
+        return plan(path, conf, facts)
     
-    return files
+    is_complete = getattr(processor, 'is_complete', None)
+    if is_complete is not None and is_complete(path, conf, facts):
+        return None
+    
+    return workplan.WorkItem(path, conf, facts,
+                             os.path.basename(path.rstrip(os.path.sep)),
+                             [ 'processing' ])
 
-def process_path(path, conf, base_facts, is_root=False):
+def plan_path(path, conf, base_facts, work_plan, is_root=False, index=None,
+              force=False, descend=None):
     '''\
-    This function is called for each file/directory encountered.
+    This function is called for each directory encountered. It adds the work
+    needed for the directory and everything in it to work_plan; nothing is
+    fetched or written until the plan is carried out (see execute_plan).
+    
+    If a scan index is given, directories that haven't changed since they were
+    last found to be complete are skipped. Their subdirectories are still
+    visited though, because a change further down the tree doesn't change the
+    mtime of this directory. If force is True, the index is ignored for this
+    directory and its descendants (e.g. because an override file above them
+    has changed).
+    
+    descend is the function used to plan subdirectories; by default, this
+    function recurses into them. Parallel runs pass in a function that hands
+    the subdirectory to another worker instead.
     '''
-    print path
+    path = walker.make_entry(path)
+    if descend is None:
+        descend = plan_path
+    
+    if index is not None and not force:
+        record = index.get_fresh(path)
+        if record is not None and record.complete:
+            skip_path(path, conf, base_facts, work_plan, is_root, index, record,
+                      descend)
+            return
+    
+    if index is not None:
+        # take the mtime now; the processor will write to this directory when
+        # the plan is carried out, but if we took the mtime after that, we could
+        # miss files added in the meantime.
+        mtime = path.stat().st_mtime
+    
+    # list this directory once; the listing tells us whether there is an
+    # override file as well as what the files are.
+    listing = walker.scan_dir(path)
     
     # load the override file if it exists
-    override_path = os.path.join(path, '.metaproc-override')
-    if os.path.exists(override_path):
+    if listing.has_override:
+        override_path = os.path.join(path, walker.OVERRIDE_FILE_NAME)
         conf = load_settings(override_path, conf)
 
         # if it contains a facts override, apply it
-        if 'facts' in conf.keys():
+        if 'facts' in conf:
             base_facts.update(conf.pop('facts'))
     
-    # process this directory if it isn't the root directory
+    # a directory is only complete if nothing needs doing for it or any of its
+    # files.
+    complete = True
+    
+    # plan this directory if it isn't the root directory
     if not is_root:
         # make a copy of the currently known facts
         facts = base_facts.copy()
         # get the facts 
         conf['FACTS_FUNCTION'](path, conf, facts)
-        # process it
-        conf['PROCESSOR'].process(path, conf, facts)
+        # work out what needs doing
+        item = get_work_item(path, conf, facts)
+        if item is not None:
+            work_plan.add(item)
+            complete = False
         # we want these facts to apply to all descendants, so we'll make this
         # the base_facts.
         base_facts = facts
     
-    # process files/directories inside this dir
-    files = get_files_list(path, conf)
+    # plan files/directories inside this dir
+    files = get_files_list(path, conf, listing)
+    
+    if index is not None:
+        files = list(files)
+        overrides = scanindex.get_override_mtimes(path,
+            [ (f.name, f.is_dir(), f.has_override) for f in files ])
+        # if the overrides here have changed, the conf and facts of everything
+        # below may have changed too, so the index can't be trusted for them.
+        force = force or index.overrides_changed(path, overrides)
     
     for f in files:
         # make a copy of the currently known facts
         facts = base_facts.copy()
             
-        # if this file is a directory, process that too
-        if os.path.isdir(f):
-            process_path(f, conf, facts)
+        # if this file is a directory, plan that too
+        if f.is_dir():
+            descend(f, conf, facts, work_plan, index=index, force=force)
         else:
-            # this is a file; process it
-            # load the override file if it exists
-            override_path = f + '.metaproc-override'
-            if os.path.exists(override_path):
-                conf = load_settings(override_path, conf)
+            # this is a file; plan it
+            if plan_file(f, conf, facts, work_plan) is not None:
+                complete = False
+    
+    # directories with work to do are checked again on the next run, by which
+    # time the work has been done.
+    if index is not None:
+        index.put(path, mtime, files, overrides, complete)
+
+def plan_file(path, conf, facts, work_plan):
+    '''\
+    Adds the work needed for a single file to work_plan, loading its override
+    file first if it exists; settings from the file's override file only apply
+    to that file. The facts are updated in place. Returns the
+    workplan.WorkItem added, or None if there is nothing to do.
+    '''
+    # load the override file if it exists
+    if walker.make_entry(path).has_override:
+        override_path = path + walker.OVERRIDE_FILE_NAME
+        conf = load_settings(override_path, conf)
+
+        # if it contains a facts override, apply it
+        if 'facts' in conf:
+            facts.update(conf.pop('facts'))
+    
+    # get the facts for this file
+    conf['FACTS_FUNCTION'](path, conf, facts)
+    
+    # work out what needs doing
+    item = get_work_item(path, conf, facts)
+    if item is not None:
+        work_plan.add(item)
+    
+    return item
+
+def execute_plan(work_plan, dirs, jobs=1):
+    '''\
+    Carries out the work in the plan by processing each path that needs it.
+    dirs is the list of directories the plan was made from (i.e.
+    DIRS_TO_PROCESS); the work is done in the same order as the directories
+    were walked, except that work for the same group (e.g. series) is done
+    together.
+    
+    If jobs is more than 1, that many paths are processed at the same time.
+    The output is still printed in order. Processors need to cope with being
+    called from several threads in this case; the Media Browser processor
+    makes sure each series or movie is only fetched once.
+    '''
+    # work out where the directory headings go up front, as the items may be
+    # processed out of order.
+    tasks = [ ]
+    last_dir = None
+    for item in work_plan.get_work(dirs):
+        item_dir = get_item_dir(item)
+        tasks.append(((item, item_dir != last_dir and item_dir or None), { }))
+        last_dir = item_dir
+    
+    if jobs > 1:
+        parallel.ParallelWalker(jobs, execute_item).run(tasks)
+    else:
+        for args, kwargs in tasks:
+            execute_item(*args, **kwargs)
+
+def execute_item(item, heading=None, descend=None):
+    '''\
+    Processes the path for a single work item, printing the heading (the
+    directory the item is in) first if given. descend is not used; it is only
+    accepted so this can be run by parallel.ParallelWalker.
+    '''
+    if heading is not None:
+        print heading
+    item.conf['PROCESSOR'].process(item.path, item.conf, item.facts)
+
+def print_plan(work_plan, dirs):
+    '''\
+    Prints the work in the plan, in the order execute_plan would do it.
+    '''
+    last_dir = None
+    for item in work_plan.get_work(dirs):
+        item_dir = get_item_dir(item)
+        if item_dir != last_dir:
+            print item_dir
+        last_dir = item_dir
         
-                # if it contains a facts override, apply it
-                if 'facts' in conf.keys():
-                    facts.update(conf.pop('facts'))
-            
-            # get the facts for this file
-            conf['FACTS_FUNCTION'](f, conf, facts)
-            
-            # process this file
-            conf['PROCESSOR'].process(f, conf, facts)
+        if item.path.is_dir():
+            print '\t%s' % item
+        else:
+            print '\t%s' % item.path.name
+            print '\t\t%s' % item
 
-def perform_clean(root_path, path, conf, base_facts, recursive=False):
+def get_item_dir(item):
     '''\
-    This function is the starting point for a clean operation. Paths provided
-    must be absolute paths.
+    Returns the directory the work item is for (or in, for files).
+    '''
+    if item.path.is_dir():
+        return item.path
+    return os.path.join(os.path.dirname(item.path), '')
+
+def skip_path(path, conf, base_facts, work_plan, is_root, index, record,
+              descend):
+    '''\
+    Walks through a directory that the scan index says is unchanged and
+    complete, without listing or planning it. Only the conf and facts needed
+    by its subdirectories are worked out.
+    '''
+    # load the override file if it exists
+    if walker.OVERRIDE_FILE_NAME in record.overrides:
+        override_path = os.path.join(path, walker.OVERRIDE_FILE_NAME)
+        conf = load_settings(override_path, conf)
+
+        # if it contains a facts override, apply it
+        if 'facts' in conf:
+            base_facts.update(conf.pop('facts'))
+    
+    if not is_root:
+        facts = base_facts.copy()
+        conf['FACTS_FUNCTION'](path, conf, facts)
+        base_facts = facts
+    
+    for name, is_dir, has_override in record.entries:
+        if is_dir:
+            descend(os.path.join(path, name), conf, base_facts.copy(),
+                    work_plan, index=index)
+
+def get_root_path(path, dirs):
+    '''\
+    Returns the directory from dirs (i.e. DIRS_TO_PROCESS) that the given path is
+    in, or None if it isn't in any of them.
+    '''
+    for p in dirs:
+        if path.startswith(p):
+            return p
+    return None
+
+def resolve_path(root_path, path, conf, base_facts):
+    '''\
+    Works out the conf and facts that apply to the given path by visiting each
+    directory between the root path and the path, loading override files and
+    getting facts the same way plan_path would. Paths provided must be
+    absolute paths.
+    
+    Returns a (path, conf, facts) tuple, where path is the PathEntry for the
+    path and facts are the facts inherited from the directories above it. None
+    is returned if the path, or any directory above it, has been excluded by
+    the configured filters.
     '''
     # sanity check
     if not path.startswith(root_path):
         raise ValueError('The path given does not start with the root path.')
     
+    # don't change the original facts
+    facts = base_facts.copy()
+    entry = walker.make_entry(root_path)
+    if path.rstrip(os.path.sep) == root_path.rstrip(os.path.sep):
+        return entry, conf, facts
+    
     # get all the path components between the root path and the path
     # we get rid of any leading or trailing path separators to ensure the split
     # result doesn't contain blank entries.
     rel_path_bits = path.strip(os.path.sep)[len(root_path):].split(os.path.sep)
     
-    # work out all the intermediate paths we need to visit to build up the conf
-    intermediate_paths = [ ]
+    # work out all the paths we need to visit to build up the conf, ending with
+    # the path itself
+    child_paths = [ ]
     for i,p in enumerate(rel_path_bits):
-        intermediate_path = os.path.join(root_path, os.path.sep.join(rel_path_bits[:i]))
-        if not intermediate_path.endswith(os.path.sep):
-            intermediate_path += os.path.sep
-        intermediate_paths.append(intermediate_path)
+        child_path = os.path.join(root_path, os.path.sep.join(rel_path_bits[:i+1]))
+        child_paths.append(child_path.rstrip(os.path.sep))
     
-    # don't change the original facts
-    facts = base_facts.copy()
-    files = [ intermediate_paths[0] ]
-    for p in intermediate_paths:
-        # check if this intermediate path is in the list of paths; if not, it
-        # means it has been excluded by the filters.
-        if p not in files:
-            print 'The given path to clean has been excluded by the configured filters. Aborting.'
-            return
+    for i,p in enumerate(child_paths):
+        listing = walker.scan_dir(entry)
         
         # load the override file if it exists
-        override_path = os.path.join(p, '.metaproc-override')
-        if os.path.exists(override_path):
+        if listing.has_override:
+            override_path = os.path.join(entry, walker.OVERRIDE_FILE_NAME)
             conf = load_settings(override_path, conf)
             
             # if it contains a facts override, apply it
-            if 'facts' in conf.keys():
+            if 'facts' in conf:
                 facts.update(conf.pop('facts'))
         
-        # get the facts from this path
-        conf['FACTS_FUNCTION'](p, conf, facts)
+        # get the facts from this path; like plan_path, the root directory
+        # itself doesn't get any.
+        if i > 0:
+            conf['FACTS_FUNCTION'](entry, conf, facts)
         
-        # process files/directories inside this dir
-        files = get_files_list(p, conf)
+        # check if the next path down is in the list of paths; if not, it
+        # means it has been excluded by the filters.
+        files = get_files_list(entry, conf, listing)
+        matches = [ f for f in files if f.rstrip(os.path.sep) == p ]
+        if not matches:
+            return None
+        entry = matches[0]
+    
+    return entry, conf, facts
 
+def perform_clean(root_path, path, conf, base_facts, recursive=False):
+    '''\
+    This function is the starting point for a clean operation. Paths provided
+    must be absolute paths.
+    '''
+    resolved = resolve_path(root_path, path, conf, base_facts)
+    if resolved is None:
+        print 'The given path to clean has been excluded by the configured filters. Aborting.'
+        return
+    
     # conf has been built up; clean!
+    path, conf, facts = resolved
     clean_path(path, conf, facts, recursive)
 
+def plan_changed_path(path, dirs, conf, base_facts, work_plan, index=None):
+    '''\
+    Adds the work needed for a single path that has been created or changed
+    (and everything below it if it is a directory) to work_plan, e.g. when
+    watching for changes. Paths that
+    are excluded by the configured filters, such as the metadata files the
+    processor writes, are ignored.
+    '''
+    root_path = get_root_path(path, dirs)
+    if root_path is None:
+        return
+    
+    resolved = resolve_path(root_path, path, conf, base_facts)
+    if resolved is None:
+        return
+    
+    path, conf, facts = resolved
+    if path.is_dir():
+        is_root = path.rstrip(os.path.sep) == root_path.rstrip(os.path.sep)
+        plan_path(path, conf, facts, work_plan, is_root, index)
+    else:
+        plan_file(path, conf, facts, work_plan)
+
 def clean_path(path, conf, base_facts, recursive=False):
     '''\
     Cleans the given path. Also cleans any descendants if recursive = True.
     '''
     print path
+    path = walker.make_entry(path)
     
     # clean ourselves first
     facts = base_facts.copy()
@@ -325,24 +546,118 @@ def clean_path(path, conf, base_facts, recursive=False):
             facts = base_facts.copy()
 
             # if this file is a directory, process that too
-            if os.path.isdir(f):
+            if f.is_dir():
                 clean_path(f, conf, facts, recursive)
             else:
                 # this is a file; clean it
-                # load the override file if it exists
-                override_path = f + '.metaproc-override'
-                if os.path.exists(override_path):
-                    conf = load_settings(override_path, conf)
+                # load the override file if it exists; it only applies to
+                # this file.
+                file_conf = conf
+                if f.has_override:
+                    override_path = f + walker.OVERRIDE_FILE_NAME
+                    file_conf = load_settings(override_path, conf)
             
                     # if it contains a facts override, apply it
-                    if 'facts' in conf.keys():
-                        facts.update(conf.pop('facts'))
+                    if 'facts' in file_conf:
+                        facts.update(file_conf.pop('facts'))
                 
                 # get the facts for this file
-                conf['FACTS_FUNCTION'](f, conf, facts)
+                file_conf['FACTS_FUNCTION'](f, file_conf, facts)
                 
                 # clean this file
-                conf['PROCESSOR'].clean(f, conf, facts)
+                file_conf['PROCESSOR'].clean(f, file_conf, facts)
+
+def get_caches(processor):
+    '''\
+    Returns the dict of caches kept by the given processor, by name; processors
+    that don't implement get_caches don't keep any.
+    '''
+    get_processor_caches = getattr(processor, 'get_caches', None)
+    if get_processor_caches is None:
+        return { }
+    return get_processor_caches()
+
+def format_size(size):
+    '''\
+    Returns the given number of bytes in megabytes, for printing.
+    '''
+    return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+def print_cache_stats(processor):
+    '''\
+    Prints the statistics for each of the caches kept by the given processor.
+    '''
+    caches = get_caches(processor)
+    if not caches:
+        print 'The processor does not keep any caches.'
+    
+    for name in sorted(caches):
+        stats = caches[name].get_stats()
+        lookups = stats['hits'] + stats['stale'] + stats['misses']
+        hit_ratio = lookups and 100.0 * stats['hits'] / lookups or 0.0
+        
+        print '%s cache' % name
+        print '\tentries:   %d' % stats['entries']
+        print '\tsize:      %s (the cache file is %s)' % (
+            format_size(stats['size']), format_size(stats['file_size']))
+        print '\thits:      %d (%.1f%% of %d lookups)' % (stats['hits'],
+                                                        hit_ratio, lookups)
+        print '\tstale:     %d (%d revalidated without downloading again)' % (
+            stats['stale'], stats['revalidations'])
+        print '\tmisses:    %d' % stats['misses']
+        print '\tevictions: %d' % stats['evictions']
+
+def gc_caches(processor):
+    '''\
+    Shrinks each of the caches kept by the given processor to fit its limits.
+    '''
+    caches = get_caches(processor)
+    if not caches:
+        print 'The processor does not keep any caches.'
+    
+    for name in sorted(caches):
+        removed = caches[name].gc()
+        print '%s cache: removed %d entries' % (name, removed)
+
+def export_names(processor, path):
+    '''\
+    Writes the series names resolved by the given processor to the file at
+    path.
+    '''
+    processor_export_names = getattr(processor, 'export_names', None)
+    if processor_export_names is None:
+        print 'The processor does not keep a name table.'
+        return
+    
+    f = open(path, 'wb')
+    try:
+        count = processor_export_names(f)
+    finally:
+        f.close()
+    if count is None:
+        print 'The processor does not keep a name table.'
+    else:
+        print 'Exported %d names to %s' % (count, path)
+
+def import_names(processor, path):
+    '''\
+    Reads series names written by export_names from the file at path into the
+    name table of the given processor.
+    '''
+    processor_import_names = getattr(processor, 'import_names', None)
+    if processor_import_names is None:
+        print 'The processor does not keep a name table.'
+        return
+    
+    f = open(path, 'rb')
+    try:
+        count = processor_import_names(f)
+    finally:
+        f.close()
+    if count is None:
+        print 'The processor does not keep a name table.'
+    else:
+        print 'Imported %d names from %s' % (count, path)
 
 def main():
     # parse args
@@ -351,6 +666,29 @@ def main():
                       help="settings file to use")
     parser.add_option("-C", "--clean", dest="clean_path", help="path to clean")
     parser.add_option("-R", "--rclean", dest="rclean_path", help="path to recursively clean from")
+    parser.add_option("-F", "--full", dest="full", action="store_true",
+                      default=False,
+                      help="check every directory, even if the scan index says it is complete")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="number of directories to process at the same time")
+    parser.add_option("-w", "--watch", dest="watch", action="store_true",
+                      default=False,
+                      help="keep running after processing, and process new files as they appear")
+    parser.add_option("-J", "--fetch-jobs", dest="fetch_jobs", type="int",
+                      help="number of paths to fetch metadata for at the same time (defaults to the number of jobs)")
+    parser.add_option("-n", "--dry-run", dest="dry_run", action="store_true",
+                      default=False,
+                      help="print the work that needs to be done without doing it")
+    parser.add_option("--cache-stats", dest="cache_stats", action="store_true",
+                      default=False,
+                      help="print statistics for the metadata caches and exit")
+    parser.add_option("--cache-gc", dest="cache_gc", action="store_true",
+                      default=False,
+                      help="shrink the metadata caches to fit their limits and exit")
+    parser.add_option("--export-names", dest="export_names_path",
+                      help="write the resolved series names to this file and exit")
+    parser.add_option("--import-names", dest="import_names_path",
+                      help="read resolved series names written by --export-names from this file and exit")
    
     (options, args) = parser.parse_args()
     
@@ -359,11 +697,49 @@ def main():
         print "The --settings argument must be specified."
         sys.exit(1)
     
+    if options.watch:
+        if options.clean_path or options.rclean_path:
+            print "The --watch argument can't be used when cleaning."
+            sys.exit(1)
+        if watch.pyinotify is None:
+            print "The pyinotify module is needed for the --watch argument."
+            sys.exit(1)
+    
+    if options.dry_run and (options.clean_path or options.rclean_path):
+        print "The --dry-run argument can't be used when cleaning."
+        sys.exit(1)
+    
+    if options.fetch_jobs is None:
+        options.fetch_jobs = options.jobs
+    
     settings_path = options.settings
     
     # load settings
     settings = load_settings(settings_path)
     
+    # set up the connection pools used for fetching metadata
+    transport.configure(settings)
+    
+    # let the processor set itself up
+    processor = settings['PROCESSOR']
+    configure = getattr(processor, 'configure', None)
+    if configure is not None:
+        configure(settings)
+    
+    if options.import_names_path or options.export_names_path:
+        if options.import_names_path:
+            import_names(processor, options.import_names_path)
+        if options.export_names_path:
+            export_names(processor, options.export_names_path)
+        return
+    
+    if options.cache_stats or options.cache_gc:
+        if options.cache_gc:
+            gc_caches(processor)
+        if options.cache_stats:
+            print_cache_stats(processor)
+        return
+    
     # build the base context for processing by copying and removing the
     # irrelevant settings from the app settings.
     base_conf = { }
@@ -371,6 +747,15 @@ def main():
         if k not in APP_ONLY_SETTINGS:
             base_conf[k] = v
     
+    # load the compiled override files from the last run if configured
+    if settings.get('OVERRIDE_CACHE_PATH'):
+        settingscache.load_code_cache(settings['OVERRIDE_CACHE_PATH'])
+    
+    # load the scan index if one has been configured
+    index = None
+    if settings.get('SCAN_INDEX_PATH'):
+        index = scanindex.ScanIndex(settings['SCAN_INDEX_PATH'], settings_path)
+    
     if options.clean_path or options.rclean_path:
         # we're cleaning!
         if options.clean_path:
@@ -383,21 +768,63 @@ def main():
         path = os.path.abspath(path)
         
         # determine the right root path
-        root_path = None
-        for p in settings['DIRS_TO_PROCESS']:
-            if path.startswith(p):
-                root_path = p
-                break
+        root_path = get_root_path(path, settings['DIRS_TO_PROCESS'])
         
         if root_path is None:
             print 'The path to clean is not contained in one of the configured DIRS_TO_PROCESS. Aborting.'
             sys.exit(2)
         
         perform_clean(root_path, path, base_conf, { }, recursive)
+        
+        # the cleaned directories are no longer complete
+        if index is not None:
+            index.invalidate(path)
+            index.save()
     else:
-        # we're processing!
-        for p in settings['DIRS_TO_PROCESS']:
-            process_path(p, base_conf, { }, True)
+        # we're processing! work out what needs doing first...
+        work_plan = workplan.WorkPlan()
+        if options.jobs > 1:
+            tasks = [ ((p, base_conf, { }, work_plan, True, index, options.full), { })
+                      for p in settings['DIRS_TO_PROCESS'] ]
+            parallel.ParallelWalker(options.jobs, plan_path).run(tasks)
+        else:
+            for p in settings['DIRS_TO_PROCESS']:
+                plan_path(p, base_conf, { }, work_plan, True, index, options.full)
+        
+        # ...then do it, unless this is a dry run
+        if options.dry_run:
+            print_plan(work_plan, settings['DIRS_TO_PROCESS'])
+        else:
+            execute_plan(work_plan, settings['DIRS_TO_PROCESS'],
+                         options.fetch_jobs)
+            if index is not None:
+                index.save()
+        
+        if options.watch:
+            # the settings, conf and anything the processor keeps in memory
+            # (e.g. the tvdb client) stay loaded between changes.
+            def process_changes(path):
+                work_plan = workplan.WorkPlan()
+                plan_changed_path(path, settings['DIRS_TO_PROCESS'],
+                                  base_conf, { }, work_plan, index)
+                if options.dry_run:
+                    print_plan(work_plan, settings['DIRS_TO_PROCESS'])
+                else:
+                    execute_plan(work_plan, settings['DIRS_TO_PROCESS'],
+                                 options.fetch_jobs)
+                    if index is not None:
+                        index.save()
+            
+            print '\nWatching for changes...\n'
+            watcher = watch.Watcher(settings['DIRS_TO_PROCESS'], process_changes,
+                                    settings.get('WATCH_SETTLE_SECONDS', 10))
+            try:
+                watcher.run()
+            except KeyboardInterrupt:
+                pass
+    
+    if settings.get('OVERRIDE_CACHE_PATH'):
+        settingscache.save_code_cache(settings['OVERRIDE_CACHE_PATH'])
     
     print '\nMetaProc done.\n'
 
@@ -0,0 +1,179 @@
+##
+# The not-found cache records the series and movies that could not be found,
+# so they aren't searched for again on every run. After a failed search, the
+# title isn't searched for again for a while; each further failure doubles the
+# wait, up to a limit.
+#
+# Titles are recorded by item type and normalised title (see normalise_title),
+# along with a fingerprint of the facts they were looked up with. If the facts
+# change, e.g. because an override file was edited to give the right title or
+# other details, the recorded failure no longer applies and the title is
+# searched for straight away.
+##
+
+import os
+import re
+import errno
+import time
+import hashlib
+import tempfile
+import unicodedata
+import cPickle as pickle
+from collections import namedtuple
+from threading import Lock
+
+# bump this if the format of the records change; older caches are discarded.
+CACHE_VERSION = 1
+
+# facts that say where an item is within a series rather than which series it
+# is, so they are left out of the fingerprint; an episode and its series
+# directory share the same record.
+POSITION_FACTS = ( 'season_number', 'episode_number' )
+
+# fingerprint - see get_facts_fingerprint
+# failures    - the number of failed searches in a row
+# retry_at    - the time after which the title can be searched for again
+NotFound = namedtuple('NotFound', 'fingerprint failures retry_at')
+
+_non_word_regexp = re.compile(r'[\W_]+', re.UNICODE)
+
+def normalise_title(title):
+    '''\
+    Returns the given title in lower case, with accents removed and runs of
+    punctuation and spaces replaced by a single space, so e.g. 'The.Show_Name'
+    and 'the show name' are the same title.
+    '''
+    if isinstance(title, str):
+        title = title.decode('utf-8', 'replace')
+    title = unicodedata.normalize('NFKD', title)
+    title = u''.join(c for c in title if not unicodedata.combining(c))
+    return _non_word_regexp.sub(u' ', title).strip().lower()
+
+def get_facts_fingerprint(facts):
+    '''\
+    Returns a string identifying the given facts, apart from the
+    POSITION_FACTS.
+    '''
+    items = sorted((k, v) for k, v in facts.iteritems()
+                   if k not in POSITION_FACTS)
+    return hashlib.sha1(repr(items)).hexdigest()
+
+class NotFoundCache(object):
+    '''\
+    A persistent record of failed searches, stored as a pickled dict in a
+    single file. The file is written whenever the records change.
+
+    retry_after is the number of seconds to wait after the first failure, and
+    max_retry_after the most to wait after any number of failures.
+    '''
+    def __init__(self, path, retry_after, max_retry_after):
+        self.path = path
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.records = { }
+        self.lock = Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError, e:
+            # only swallow the 'no such file or directory' error
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        try:
+            try:
+                version, records = pickle.load(f)
+            except Exception, e:
+                print '[WARN] Could not read the not-found cache at %s ' \
+                      '(%s). Ignoring it.' % (self.path, e)
+                return
+        finally:
+            f.close()
+
+        if version == CACHE_VERSION:
+            self.records = records
+
+    def _save(self):
+        # called with the lock held. Write to a temporary file first so a crash
+        # doesn't leave a truncated cache behind. The temporary file has a
+        # unique name so two metaproc processes saving at once don't write to
+        # the same file.
+        dir_path, name = os.path.split(self.path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp',
+                                        dir=dir_path or '.')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((CACHE_VERSION, self.records), f,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def check(self, item_type, title, facts):
+        '''\
+        Returns the NotFound record for the title if it shouldn't be searched
+        for yet, otherwise None.
+        '''
+        key = (item_type, normalise_title(title))
+        with self.lock:
+            record = self.records.get(key)
+
+        if record is None or record.fingerprint != get_facts_fingerprint(facts):
+            return None
+        if time.time() >= record.retry_at:
+            return None
+        return record
+
+    def add(self, item_type, title, facts):
+        '''\
+        Records a failed search for the title, and returns its NotFound record.
+        '''
+        key = (item_type, normalise_title(title))
+        fingerprint = get_facts_fingerprint(facts)
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None and record.fingerprint == fingerprint and \
+                time.time() < record.retry_at:
+                # another search that started before this failure was
+                # recorded, e.g. for another episode of the same series
+                return record
+            if record is None or record.fingerprint != fingerprint:
+                failures = 1
+            else:
+                failures = record.failures + 1
+            wait = min(self.retry_after * 2 ** (failures - 1),
+                       self.max_retry_after)
+            record = NotFound(fingerprint, failures, time.time() + wait)
+            self.records[key] = record
+            self._save()
+        return record
+
+    def remove(self, item_type, title):
+        '''\
+        Forgets any failed searches for the title, e.g. once it has been found.
+        '''
+        key = (item_type, normalise_title(title))
+        with self.lock:
+            if key in self.records:
+                del self.records[key]
+                self._save()
+
+def get_not_found_cache(conf):
+    '''\
+    Returns a NotFoundCache using the NOT_FOUND_CACHE_PATH,
+    NOT_FOUND_RETRY_AFTER and NOT_FOUND_MAX_RETRY_AFTER settings, or None if
+    NOT_FOUND_CACHE_PATH isn't set.
+    '''
+    path = conf.get('NOT_FOUND_CACHE_PATH')
+    if not path:
+        return None
+    return NotFoundCache(os.path.expanduser(path),
+                         conf.get('NOT_FOUND_RETRY_AFTER', 60 * 60),
+                         conf.get('NOT_FOUND_MAX_RETRY_AFTER', 7 * 24 * 60 * 60))
@@ -0,0 +1,224 @@
+##
+# Parallel directory traversal for metaproc.
+#
+# Each directory is processed as a task on a bounded thread pool. Subdirectories
+# are handed back to the pool instead of being recursed into, so a worker never
+# waits on another worker. Anything printed while processing a directory is
+# buffered and written out in the same order a sequential run would print it.
+#
+# SingleFlight lets threads that need the same thing (e.g. the metadata for a
+# movie) share a single fetch of it.
+##
+
+import sys
+import threading
+from Queue import Queue, Empty
+from multiprocessing.pool import ThreadPool
+
+class _Node(object):
+    '''\
+    The output of a single task. parts is a list of strings and the _Nodes of
+    the subdirectory tasks it started, in the order they were printed or
+    started.
+    '''
+    __slots__ = ('parts', 'done', 'error')
+
+    def __init__(self):
+        self.parts = [ ]
+        self.done = False
+        self.error = None
+
+class _OutputRouter(object):
+    '''\
+    Stands in for sys.stdout while a parallel walk is running. Text printed by
+    a worker thread is added to the output of the task it is running; text
+    printed by any other thread goes straight to the real stdout.
+    '''
+    def __init__(self, stream, local):
+        self._stream = stream
+        self._local = local
+
+    def write(self, s):
+        node = getattr(self._local, 'node', None)
+        if node is None:
+            self._stream.write(s)
+        else:
+            node.parts.append(s)
+
+    def flush(self):
+        self._stream.flush()
+
+    # the print statement keeps track of whether it needs to write a space
+    # before the next item using the softspace attribute. This needs to be per
+    # thread, otherwise the threads would add spaces to each others output.
+    def _get_softspace(self):
+        return getattr(self._local, 'softspace', 0)
+
+    def _set_softspace(self, value):
+        self._local.softspace = value
+
+    softspace = property(_get_softspace, _set_softspace)
+
+class ParallelWalker(object):
+    '''\
+    Runs walk_function over a tree using a pool of the given number of worker
+    threads.
+
+    walk_function is called with the task arguments plus a descend keyword
+    argument. Instead of recursing into a subdirectory, walk_function should
+    call descend with the same arguments it would have recursed with.
+    '''
+    def __init__(self, jobs, walk_function):
+        self.jobs = jobs
+        self.walk_function = walk_function
+        self._local = threading.local()
+        self._finished = Queue()
+        self._pool = None
+        # the number of tasks submitted but not yet picked up from _finished
+        self._outstanding = 0
+        self._lock = threading.Lock()
+
+    def run(self, tasks):
+        '''\
+        Runs the given tasks, a list of (args, kwargs) tuples, and everything
+        they descend into. Returns when all of it has been processed and printed.
+        '''
+        root = _Node()
+        root.done = True
+
+        real_stdout = sys.stdout
+        sys.stdout = _OutputRouter(real_stdout, self._local)
+        self._pool = ThreadPool(self.jobs)
+        try:
+            for args, kwargs in tasks:
+                root.parts.append(self._submit(args, kwargs))
+
+            # stack of [node, index of the next part to write] for writing out
+            # the output in order.
+            stack = [ [ root, 0 ] ]
+            while True:
+                # a task's subdirectories are submitted before it finishes, so
+                # this can only reach zero once everything has been processed.
+                with self._lock:
+                    if self._outstanding == 0:
+                        break
+                self._wait_for_task()
+                with self._lock:
+                    self._outstanding -= 1
+                self._write_ready(stack, real_stdout)
+            self._write_ready(stack, real_stdout)
+        finally:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            sys.stdout = real_stdout
+
+    def descend(self, *args, **kwargs):
+        '''\
+        Queues up a subdirectory for processing. Must be called from inside
+        walk_function.
+        '''
+        self._local.node.parts.append(self._submit(args, kwargs))
+
+    def _submit(self, args, kwargs):
+        node = _Node()
+        with self._lock:
+            self._outstanding += 1
+        self._pool.apply_async(self._run_task, (node, args, kwargs))
+        return node
+
+    def _run_task(self, node, args, kwargs):
+        self._local.node = node
+        self._local.softspace = 0
+        try:
+            try:
+                kwargs = dict(kwargs, descend=self.descend)
+                self.walk_function(*args, **kwargs)
+            except:
+                node.error = sys.exc_info()
+        finally:
+            self._local.node = None
+            node.done = True
+            self._finished.put(node)
+
+    def _wait_for_task(self):
+        # Queue.get can't be interrupted with Ctrl-C unless it has a timeout
+        while True:
+            try:
+                return self._finished.get(True, 1)
+            except Empty:
+                pass
+
+    def _write_ready(self, stack, stream):
+        '''\
+        Writes out as much of the output as possible without getting ahead of
+        any task that hasn't finished yet.
+        '''
+        while stack:
+            frame = stack[-1]
+            node = frame[0]
+            if not node.done:
+                return
+
+            while frame[1] < len(node.parts):
+                part = node.parts[frame[1]]
+                frame[1] += 1
+                if isinstance(part, _Node):
+                    stack.append([ part, 0 ])
+                    break
+                stream.write(part)
+            else:
+                stack.pop()
+                if node.error is not None:
+                    # the same exception a sequential run would have stopped
+                    # with
+                    raise node.error[0], node.error[1], node.error[2]
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    '''\
+    Makes sure a function is only running once at a time for each key. Threads
+    calling do with a key that is already being worked on wait for that call to
+    finish and get the same result (or exception), instead of repeating it.
+    '''
+    def __init__(self):
+        self._calls = { }
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                is_caller = True
+            else:
+                is_caller = False
+
+        if not is_caller:
+            # Event.wait can't be interrupted with Ctrl-C unless it has a timeout
+            while not call.done.wait(1):
+                pass
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+
+        try:
+            try:
+                call.result = function(*args, **kwargs)
+            except:
+                call.error = sys.exc_info()
+                raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
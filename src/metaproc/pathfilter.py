@@ -0,0 +1,117 @@
+##
+# Path filtering for metaproc.
+#
+# The PATH_INCLUDE_REGEXPS and PATH_EXCLUDE_REGEXPS settings are turned into a
+# PathFilter once for each distinct set of regexps (usually once per settings
+# or override file that sets them), instead of being looped over for every
+# path. Regexps that only check the file extension, e.g. '.*\.avi$', become a
+# set lookup; the rest are combined into a single regexp where possible.
+##
+
+import re
+from threading import Lock
+
+# matches patterns like '.*\.avi$' or '\.avi$', capturing the extension.
+EXTENSION_PATTERN_REGEXP = re.compile(r'^(?:\.\*)?\\\.([A-Za-z0-9_\-]+)\$$')
+
+# patterns that can't be combined with others into a single regexp: ones that
+# use backreferences (group numbers change when combined) or inline flags
+# (which apply to the whole regexp).
+UNCOMBINABLE_PATTERN_REGEXP = re.compile(r'\\[1-9]|\(\?P=|\(\?[iLmsux]')
+
+_lock = Lock()
+
+# (include regexps, exclude regexps) -> PathFilter
+_filter_cache = { }
+
+class _RegexpSet(object):
+    '''\
+    Matches a path against a list of compiled regexps, in the same way as
+    calling search with each of them until one matches.
+    '''
+    def __init__(self, regexps):
+        self.extensions = set()
+        self.regexps = [ ]
+
+        combinable = { }
+        for r in regexps:
+            m = EXTENSION_PATTERN_REGEXP.match(r.pattern)
+            if m and r.flags == re.IGNORECASE:
+                self.extensions.add(m.group(1).lower())
+            elif isinstance(r.pattern, basestring) and not r.groupindex and \
+                not UNCOMBINABLE_PATTERN_REGEXP.search(r.pattern):
+                # only patterns with the same flags can be combined
+                combinable.setdefault(r.flags, [ ]).append(r)
+            else:
+                self.regexps.append(r)
+
+        for flags, group in combinable.iteritems():
+            if len(group) == 1:
+                self.regexps.append(group[0])
+            else:
+                pattern = '|'.join([ '(?:%s)' % r.pattern for r in group ])
+                self.regexps.append(re.compile(pattern, flags))
+
+    def __nonzero__(self):
+        return bool(self.extensions or self.regexps)
+
+    def search(self, path):
+        if self.extensions:
+            dot = path.rfind('.')
+            if dot >= 0 and path[dot+1:].lower() in self.extensions:
+                return True
+
+        for r in self.regexps:
+            if r.search(path):
+                return True
+
+        return False
+
+class PathFilter(object):
+    '''\
+    Decides which paths are processed, given the include and exclude regexps.
+
+    If there are any include regexps, only paths matching at least one of them
+    are included; directories (paths with a trailing slash) are always included.
+    Paths matching any exclude regexp are then left out.
+    '''
+    def __init__(self, include_regexps, exclude_regexps):
+        self.include = _RegexpSet(include_regexps)
+        self.exclude = _RegexpSet(exclude_regexps)
+
+    def is_included(self, path):
+        '''\
+        Returns whether the given path passes the filters.
+        '''
+        if self.include and not path.endswith('/') and \
+            not self.include.search(path):
+            return False
+
+        if self.exclude and self.exclude.search(path):
+            return False
+
+        return True
+
+    def filter(self, paths):
+        '''\
+        Returns an iterator over the given paths that pass the filters, in the
+        same order.
+        '''
+        is_included = self.is_included
+        return ( p for p in paths if is_included(p) )
+
+def get_path_filter(conf):
+    '''\
+    Returns the PathFilter for the PATH_INCLUDE_REGEXPS and PATH_EXCLUDE_REGEXPS
+    settings in the given conf. The conf is not changed.
+    '''
+    key = (tuple(conf.get('PATH_INCLUDE_REGEXPS') or ()),
+           tuple(conf.get('PATH_EXCLUDE_REGEXPS') or ()))
+
+    path_filter = _filter_cache.get(key)
+    if path_filter is None:
+        path_filter = PathFilter(key[0], key[1])
+        with _lock:
+            path_filter = _filter_cache.setdefault(key, path_filter)
+
+    return path_filter
@@ -1,8 +1,10 @@
 import os
-import urllib
-import glob
-import re
+import errno
+import time
+import bisect
 from datetime import date, datetime
+from threading import Lock
+from collections import OrderedDict
 
 try:
     import xml.etree.cElementTree as ET
@@ -12,10 +14,44 @@ except ImportError:
 from tvdb_api import tvdb_api, tvdb_exceptions
 from themoviedb import tmdb
 
+import walker
+import workplan
+import parallel
+import transport
+import imagefetch
+import imagestore
+import notfound
+
 NO_IMAGE_EXTENSION = '.noimage'
 IMAGE_EXTENSIONS = [ '.jpg', '.png' ]
 
-tvdb = tvdb_api.Tvdb(select_first=True, cache=True, banners=True)
+# all HTTP requests (tvdb, tmdb and images) share the same pool of
+# connections; see transport.
+http_opener = transport.build_opener()
+tmdb.config['urlopener'] = http_opener
+
+# tvdb_api.Tvdb can be shared between threads; a series wanted by several
+# threads at once is only fetched once.
+tvdb = tvdb_api.Tvdb(select_first=True, cache=True, banners=True,
+    http_handlers=[ transport.PooledHTTPHandler(transport.default_transport) ])
+
+# movie searches in progress, so a movie is only fetched once at a time
+movie_fetches = parallel.SingleFlight()
+
+# the series and movies that couldn't be found, so they aren't searched for on
+# every run; set up by configure if the NOT_FOUND_CACHE_PATH setting is set.
+not_found = None
+
+# the number of directory snapshots to keep (see get_dir_snapshot), and the
+# number of seconds they are used for before the directory is listed again (in
+# case something else has changed the directory, e.g. in --watch mode).
+SNAPSHOT_CACHE_SIZE = 64
+SNAPSHOT_MAX_AGE = 60
+snapshots = OrderedDict()
+# the number of times each directory has been written to, so a listing that
+# was overtaken by a write isn't kept (see get_dir_snapshot)
+snapshot_generations = { }
+snapshots_lock = Lock()
 
 def process(path, conf, facts):
     '''\
@@ -30,7 +66,7 @@ def process(path, conf, facts):
         episode_number = facts.get('episode_number', '')
         
         # if this is a file, this is an episode
-        if os.path.isfile(path):
+        if walker.path_is_file(path):
             if series_title and season_number and episode_number:
                 process_episode(path, conf, facts)
             else:
@@ -58,7 +94,7 @@ def process(path, conf, facts):
     elif item_type == 'movie':
         movie_title = facts.get('movie_title', '')
         
-        if os.path.isfile(path):
+        if walker.path_is_file(path):
             # we don't process files because Media Browser expects each movie
             # to be in a separate directory, so we just need to process
             # directories. This is not an error, so we just silently return.
@@ -88,7 +124,7 @@ def clean(path, conf, facts):
         episode_number = facts.get('episode_number', '')
         
         # if this is a file, this is an episode
-        if os.path.isfile(path):
+        if walker.path_is_file(path):
             if series_title and season_number and episode_number:
                 clean_episode(path, conf, facts)
             else:
@@ -113,7 +149,7 @@ def clean(path, conf, facts):
     elif item_type == 'movie':
         movie_title = facts.get('movie_title', '')
         
-        if os.path.isfile(path):
+        if walker.path_is_file(path):
             # we don't process files because Media Browser expects each movie
             # to be in a separate directory, so we just need to process
             # directories. This is not an error, so we just silently return.
@@ -130,6 +166,190 @@ def clean(path, conf, facts):
         print '\t\t[WARN] Unknown item type (%s). Skipping.' % item_type
         return
 
+def is_complete(path, conf, facts):
+    '''\
+    This is an optional entry point to this processor. It is called after a path
+    has been processed and returns True if there is nothing left to do for it,
+    so metaproc can skip it on later runs when a scan index is configured.
+    
+    Paths that can't be processed because not enough facts are available are
+    also considered complete, as processing them again won't change anything
+    until the facts change (and they only change if an override file does).
+    '''
+    item_type = facts.get('type', '').lower()
+    
+    if item_type == 'tv':
+        series_title = facts.get('series_title', '')
+        season_number = facts.get('season_number', '')
+        episode_number = facts.get('episode_number', '')
+        
+        if walker.path_is_file(path):
+            if series_title and season_number and episode_number:
+                return is_episode_metadata_complete(path, conf)
+        elif series_title and not season_number and not episode_number:
+            return is_series_metadata_complete(path, conf)
+        elif series_title and season_number and not episode_number:
+            return is_season_metadata_complete(path, conf)
+    
+    elif item_type == 'movie':
+        if not walker.path_is_file(path) and facts.get('movie_title', ''):
+            return is_movie_metadata_complete(path, conf)
+    
+    return True
+
+def plan(path, conf, facts):
+    '''\
+    This is an optional entry point to this processor. It is called when
+    planning the work to be done, and returns a workplan.WorkItem describing
+    the metadata missing for the path, or None if there is nothing to do. No
+    metadata is fetched; the work is carried out later by calling process.
+    
+    Like process, a warning is printed for paths without enough facts.
+    '''
+    item_type = facts.get('type', '').lower()
+    
+    if item_type == 'tv':
+        series_title = facts.get('series_title', '')
+        season_number = facts.get('season_number', '')
+        episode_number = facts.get('episode_number', '')
+        group = ('tv', series_title)
+        
+        # if this is a file, this is an episode
+        if walker.path_is_file(path):
+            if series_title and season_number and episode_number:
+                missing = get_missing_episode_metadata(path, conf)
+                description = 'episode s%se%s of %s' % (season_number,
+                                                        episode_number,
+                                                        series_title)
+            else:
+                # nothing else is printed while planning, so the full path is
+                # needed here.
+                print '\t%s [%s, s%se%s]' % (path, series_title or '?',
+                                             season_number or '?',
+                                             episode_number or '?')
+                print '\t\t[WARN] Not enough facts were available. Skipping.'
+                return None
+        
+        # if we only have the series title, this is a series directory
+        elif series_title and not season_number and not episode_number:
+            missing = get_missing_series_metadata(path, conf)
+            description = 'series %s' % series_title
+        
+        # if we have the series title and the season number, this is a season
+        # directory
+        elif series_title and season_number and not episode_number:
+            missing = get_missing_season_metadata(path, conf)
+            description = 'season %s of %s' % (season_number, series_title)
+        
+        else:
+            print '\t%s' % path
+            print '\t\t[WARN] Not enough facts were available. Skipping.'
+            return None
+    
+    elif item_type == 'movie':
+        movie_title = facts.get('movie_title', '')
+        
+        if walker.path_is_file(path):
+            # movies are processed by directory; see process.
+            return None
+        elif movie_title:
+            missing = get_missing_movie_metadata(path, conf)
+            description = 'movie %s' % movie_title
+            group = ('movie', movie_title)
+        else:
+            print '\t%s' % path
+            print '\t\t[WARN] Not enough facts were available. Skipping.'
+            return None
+    
+    else:
+        print '\t%s' % path
+        print '\t\t[WARN] Unknown item type (%s). Skipping.' % item_type
+        return None
+    
+    if not missing:
+        return None
+    
+    return workplan.WorkItem(path, conf, facts, description, missing, group)
+
+def configure(settings):
+    '''\
+    This is an optional entry point to this processor. It is called once the
+    main settings file has been loaded, before anything is processed.
+    '''
+    global not_found
+    not_found = notfound.get_not_found_cache(settings)
+    
+    if tvdb.cache_handler is not None:
+        tvdb.cache_handler.store.max_size = settings.get('TVDB_CACHE_MAX_SIZE')
+        tvdb.cache_handler.store.max_entries = \
+            settings.get('TVDB_CACHE_MAX_ENTRIES')
+
+def get_caches():
+    '''\
+    This is an optional entry point to this processor. It returns a dict of
+    the caches this processor keeps, by name, for the --cache-stats and
+    --cache-gc switches. Each cache has a get_stats method, returning a dict of
+    statistics, and a gc method, which makes the cache fit its limits and
+    returns the number of entries removed.
+    '''
+    if tvdb.cache_handler is None:
+        return { }
+    return { 'tvdb' : tvdb.cache_handler }
+
+def export_names(f):
+    '''\
+    This is an optional entry point to this processor. It writes the names
+    of the series looked up so far, and the series each was resolved to, to
+    the given file for the --export-names switch, and returns how many there
+    were. Returns None if the names aren't kept.
+    '''
+    if tvdb.name_table is None:
+        return None
+    return tvdb.name_table.export_names(f)
+
+def import_names(f):
+    '''\
+    This is an optional entry point to this processor. It reads names written
+    by export_names (e.g. on another machine) from the given file for the
+    --import-names switch, so those series aren't searched for again, and
+    returns how many were added or changed. Returns None if the names aren't
+    kept.
+    '''
+    if tvdb.name_table is None:
+        return None
+    return tvdb.name_table.import_names(f)
+
+def describe_not_found(record):
+    '''\
+    Returns a description of the given notfound.NotFound record, for printing.
+    '''
+    return 'not found (%d failed search%s); not searching again until %s' % (
+        record.failures, record.failures != 1 and 'es' or '',
+        time.strftime('%Y-%m-%d %H:%M', time.localtime(record.retry_at)))
+
+def get_series(series_title, facts):
+    '''\
+    Returns the tvdb show for the given series title. If it can't be found,
+    tvdb_shownotfound is raised, and it isn't searched for again until the
+    not-found cache (if any) allows it.
+    '''
+    if not_found is not None:
+        record = not_found.check('tv', series_title, facts)
+        if record is not None:
+            raise tvdb_exceptions.tvdb_shownotfound(
+                'The series was %s' % describe_not_found(record))
+    
+    try:
+        result = tvdb[series_title]
+    except tvdb_exceptions.tvdb_shownotfound:
+        if not_found is not None:
+            not_found.add('tv', series_title, facts)
+        raise
+    
+    if not_found is not None:
+        not_found.remove('tv', series_title)
+    return result
+
 def get_metadata_dir_path(path):
     '''\
     Returns the path to the metadata directory for this path.
@@ -146,6 +366,7 @@ def mkdir_if_not_exists(path):
     p = os.path.dirname(path)
     if not os.path.exists(p):
         os.makedirs(p)
+        invalidate_dir_snapshot(p)
 
 def rm_if_exists(path):
     '''\
@@ -157,36 +378,140 @@ def rm_if_exists(path):
         # only catch the 'no such file or directory' error
         if e.errno != 2:
             raise
+    invalidate_dir_snapshot(path)
+
+def download_image(image_url, image_path, conf):
+    '''\
+    Downloads the image at the given URL to the given path. Returns False (and
+    prints an error) if the image could not be downloaded; nothing is written
+    to the path in that case, so it will be tried again next time.
+    '''
+    return download_images([ (image_url, image_path) ], conf)
 
-def image_file_exists(glob_pattern, include_no_image=True):
+def download_images(downloads, conf):
     '''\
-    Performs a glob and checks the extension of each result to see if it matches
-    a known image file extension. Returns a list of image files, or None if none
-    were found.
+    Downloads each of the given (image URL, image path) pairs at the same time
+    (e.g. all the backdrops for a series), and prints how each one went.
+    Returns False if any of them could not be downloaded. Images already in
+    the image store (see the IMAGE_STORE_PATH setting) are linked from there.
+    '''
+    store = imagestore.get_image_store(conf.get('IMAGE_STORE_PATH'))
+    results = imagefetch.fetch_all(http_opener, downloads, store)
     
-    Because filenames can contain square brackets, but square brackets have a
-    special meaning when globbing, all square brackets are replaced with a [[]
-    or []] respectively to 'escape' them. Square brackets in glob land means
-    match any of the characters inside the square brackets once.
+    ok = True
+    for download in results:
+        invalidate_dir_snapshot(download.path)
+        if download.error is not None:
+            print '\t\t[ERROR] ' + str(download).capitalize()
+            ok = False
+        else:
+            print '\t\tDownloaded ' + str(download)
     
-    Therefore in effect, the square bracket functionality for the glob pattern
-    has been disabled.
+    return ok
+
+def write_no_image_file(image_path):
+    '''\
+    Drops a marker file at the given path, so we know not to look for an image
+    again.
+    '''
+    open(image_path, 'a').close()
+    invalidate_dir_snapshot(image_path)
+
+def is_image_file_name(name, include_no_image=True):
+    '''\
+    Returns whether the given file name has a known image file extension.
     '''
-    # HACK: escaping square brackets in filenames
-    # replace the left square bracket with [[]
-    glob_pattern = re.sub(r'\[', '[[]', glob_pattern)
-    # replace the right square bracket with []] but being careful not to replace
-    # the right square brackets in the left square bracket's 'escape' sequence.
-    glob_pattern = re.sub(r'(?<!\[)\]', '[]]', glob_pattern)
+    ext = os.path.splitext(name)[1]
+    return ext in IMAGE_EXTENSIONS or \
+        (include_no_image and ext == NO_IMAGE_EXTENSION)
+
+class DirSnapshot(object):
+    '''\
+    The names of the files in a directory at the time it was listed, so the
+    completeness and clean checks can look files up instead of listing the
+    directory for each one. image_names is the sorted list of names with an
+    image or no image extension, so they can be looked up by prefix.
+    '''
+    __slots__ = ('names', 'image_names', 'taken')
     
-    files = glob.glob(glob_pattern)
+    def __init__(self, dir_path):
+        try:
+            names = os.listdir(dir_path)
+        except OSError, e:
+            # a missing directory (e.g. no metadata directory yet) is empty
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            names = [ ]
+        
+        self.names = frozenset(names)
+        self.image_names = sorted([ n for n in names
+                                    if is_image_file_name(n) ])
+        self.taken = time.time()
+
+def get_dir_snapshot(dir_path):
+    '''\
+    Returns the DirSnapshot for the given directory, listing the directory if
+    it hasn't been listed recently or has been written to since.
+    '''
+    dir_path = dir_path.rstrip(os.path.sep)
+    with snapshots_lock:
+        snapshot = snapshots.pop(dir_path, None)
+        if snapshot is not None and \
+            time.time() - snapshot.taken < SNAPSHOT_MAX_AGE:
+            # put it back at the end, as the most recently used
+            snapshots[dir_path] = snapshot
+            return snapshot
+        generation = snapshot_generations.get(dir_path, 0)
+    
+    snapshot = DirSnapshot(dir_path)
+    with snapshots_lock:
+        # another thread may have written to the directory while it was being
+        # listed, in which case the listing is out of date already and isn't
+        # kept for anyone else
+        if snapshot_generations.get(dir_path, 0) == generation:
+            snapshots[dir_path] = snapshot
+            while len(snapshots) > SNAPSHOT_CACHE_SIZE:
+                snapshots.popitem(last=False)
+    
+    return snapshot
+
+def invalidate_dir_snapshot(path):
+    '''\
+    Drops the snapshot of the directory containing the given path. This needs
+    to be called whenever a file is written or removed.
+    '''
+    dir_path = os.path.dirname(path.rstrip(os.path.sep))
+    with snapshots_lock:
+        snapshots.pop(dir_path, None)
+        snapshot_generations[dir_path] = \
+            snapshot_generations.get(dir_path, 0) + 1
+
+def snapshot_path_exists(path):
+    '''\
+    Returns whether the given path exists, according to the snapshot of the
+    directory containing it.
+    '''
+    dir_path, name = os.path.split(path)
+    return name in get_dir_snapshot(dir_path).names
+
+def image_file_exists(path_prefix, include_no_image=True):
+    '''\
+    Looks for files starting with the given path prefix (e.g. /path/folder. or
+    /path/backdrop) with a known image file extension. Returns a list of image
+    files, or None if none were found.
+    '''
+    dir_path, name_prefix = os.path.split(path_prefix)
+    image_names = get_dir_snapshot(dir_path).image_names
+    
+    # the names are sorted, so the ones starting with the prefix are together
     image_files = [ ]
-    for f in files:
-        ext = os.path.splitext(f)[1]
-        if ext in IMAGE_EXTENSIONS:
-            image_files.append(f)
-        if include_no_image and ext == NO_IMAGE_EXTENSION:
-            image_files.append(f)
+    i = bisect.bisect_left(image_names, name_prefix)
+    while i < len(image_names) and image_names[i].startswith(name_prefix):
+        n = image_names[i]
+        i += 1
+        if not is_image_file_name(n, include_no_image):
+            continue
+        image_files.append(os.path.join(dir_path, n))
     
     if len(image_files) > 0:
         return image_files
@@ -211,25 +536,33 @@ def get_episode_metadata_path(path):
     
     return metadata_xml_path
 
-def is_episode_metadata_complete(path, conf):
+def get_missing_episode_metadata(path, conf):
     '''\
-    Returns true if all the metadata for the episode at the given path looks
-    to be complete (i.e. the expected files are there).
+    Returns a list of the metadata that is missing for the episode at the given
+    path (i.e. the expected files that aren't there).
     '''
-    if not os.path.exists(get_episode_metadata_path(path)):
-        return False
+    missing = [ ]
+    if not snapshot_path_exists(get_episode_metadata_path(path)):
+        missing.append('xml')
     
     # images are optional, dependent on the setting. If no image is available,
     # the .noimage file is dropped. Image files are named with the name of the
     # file and a .jpg, .png or .noimage extension in the metadata directory.
     if conf.get('DOWNLOAD_IMAGES'):
-        # if at least one image file exists for this episode, metadata is
-        # complete.
-        images = image_file_exists(os.path.splitext(get_episode_metadata_path(path))[0] + '.*')
+        # if at least one image file exists for this episode, the image is
+        # there.
+        images = image_file_exists(os.path.splitext(get_episode_metadata_path(path))[0] + '.')
         if images is None:
-            return False
+            missing.append('thumb')
     
-    return True
+    return missing
+
+def is_episode_metadata_complete(path, conf):
+    '''\
+    Returns true if all the metadata for the episode at the given path looks
+    to be complete (i.e. the expected files are there).
+    '''
+    return not get_missing_episode_metadata(path, conf)
 
 def process_episode(path, conf, facts):
     '''\
@@ -252,7 +585,7 @@ def process_episode(path, conf, facts):
         print ' [%s, s%de%d]' % (series_title, season_number, episode_number)
         
         print '\t\tRetrieving episode metadata...'
-        result = tvdb[series_title][season_number][episode_number]
+        result = get_series(series_title, facts)[season_number][episode_number]
     
         # data has been fetched; write it out
         xml_path = get_episode_metadata_path(path)
@@ -294,11 +627,12 @@ def process_episode(path, conf, facts):
         mkdir_if_not_exists(xml_path)
         # TODO: somehow pretty print this?
         xml.write(xml_path)
+        invalidate_dir_snapshot(xml_path)
         
         if conf.get('DOWNLOAD_IMAGES'):
             image_path = os.path.splitext(xml_path)[0]
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 image_url = result.get('filename')
                 if image_url:
                     print '\t\tDownloading episode image...'
@@ -307,11 +641,11 @@ def process_episode(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # there is no image; drop a marker file so we won't check again
                     image_path += NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
     
     except tvdb_exceptions.tvdb_exception, e:
         print '\t\t[ERROR] ' + repr(e)
@@ -324,7 +658,7 @@ def clean_episode(path, conf, facts):
 
     # metadata XML
     xml_path = get_episode_metadata_path(path)
-    if os.path.exists(xml_path):
+    if snapshot_path_exists(xml_path):
         if not path_printed:
             print '\t%s' % os.path.basename(path)
             path_printed = True
@@ -334,36 +668,46 @@ def clean_episode(path, conf, facts):
     # image
     if conf.get('DOWNLOAD_IMAGES'):
         image_path = os.path.splitext(xml_path)[0]
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             if not path_printed:
                 print '\t%s' % os.path.basename(path)
                 path_printed = True
             print '\t\tRemoving episode images...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
 
-def is_season_metadata_complete(path, conf):
+def get_missing_season_metadata(path, conf):
     '''\
-    Returns true if all the metadata for the season at the given path looks
-    to be complete (i.e. the expected files are there).
+    Returns a list of the metadata that is missing for the season at the given
+    path (i.e. the expected files that aren't there).
     '''
+    missing = [ ]
+    
+    # images are optional, dependent on the setting. If no image is available,
+    # the .noimage file is dropped. Image files are named either 'folder', 
+    # 'banner' or 'backdrop' with a .jpg, .png or .noimage extension.
     if conf.get('DOWNLOAD_IMAGES'):
         # check for poster (folder.*)
-        poster_found = image_file_exists(os.path.join(path, 'folder.*'))
+        if not image_file_exists(os.path.join(path, 'folder.')):
+            missing.append('poster')
         
         # check for banner (banner.*)
-        banner_found = image_file_exists(os.path.join(path, 'banner.*'))
+        if not image_file_exists(os.path.join(path, 'banner.')):
+            missing.append('banner')
         
         # check for backdrops (backdrop*)
-        backdrop_found = image_file_exists(os.path.join(path, 'backdrop*'))
-        
-        if poster_found and banner_found and backdrop_found:
-            return True
-        else:
-            return False
+        if not image_file_exists(os.path.join(path, 'backdrop')):
+            missing.append('backdrops')
     
-    return True
+    return missing
+
+def is_season_metadata_complete(path, conf):
+    '''\
+    Returns true if all the metadata for the season at the given path looks
+    to be complete (i.e. the expected files are there).
+    '''
+    return not get_missing_season_metadata(path, conf)
 
 def process_season(path, conf, facts):
     '''\
@@ -381,14 +725,14 @@ def process_season(path, conf, facts):
         # ASCII characters in it. In Linux, path names are UTF-8 encoded, so
         # we need to tell Python that so it can use that information for
         # encoding later (the tvdb_api forces re-encoding to UTF-8).
-        result = tvdb[facts['series_title'].decode('utf-8')]
+        result = get_series(facts['series_title'].decode('utf-8'), facts)
         
         # download the image files
         if conf.get('DOWNLOAD_IMAGES'):
             # the poster, saved as folder.jpg
             image_path = os.path.join(path, 'folder')
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 print '\tDownloading season poster...'
                 images = result['_banners'].get('season', { }).get('season', { }).values()
                 # filter to only the items that are for this season
@@ -405,16 +749,16 @@ def process_season(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
             
             # the season image, saved as banner.jpg
             image_path = os.path.join(path, 'banner')
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 print '\tDownloading season banner...'
                 images = result['_banners'].get('season', { }).get('seasonwide', { }).values()
                 # filter to only the items that are for this season
@@ -431,17 +775,17 @@ def process_season(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # no season images exist, drop a marker file so we don't check
                     # again
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
             
             # all fanart images, saved as backdropX.jpg, where X is an
             # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(os.path.join(path, 'backdrop*')):
+            if not image_file_exists(os.path.join(path, 'backdrop')):
                 print '\tDownloading season backdrops...'
                 images = result['_banners'].get('season', { }).get('fanart', { }).values()
                 # filter to only the items that are for this season
@@ -453,6 +797,7 @@ def process_season(path, conf, facts):
                     # take up to the max number of backdrops setting
                     images = images[:conf.get('MAX_NUMBER_OF_BACKDROPS', 3)]
                     
+                    downloads = [ ]
                     for i,image in enumerate(images):
                         image_path = os.path.join(path, 'backdrop') + str(i > 0 and i or '')
                         image_url = image['_bannerpath']
@@ -461,12 +806,13 @@ def process_season(path, conf, facts):
                         # know how to put them together (the ext is ASCII; path is
                         # UTF-8 on Linux).
                         image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                        urllib.urlretrieve(image_url, image_path)
+                        downloads.append((image_url, image_path))
+                    download_images(downloads, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = os.path.join(path, 'backdrop')
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
     
     except tvdb_exceptions.tvdb_exception, e:
         print '\t\t[ERROR] ' + repr(e)
@@ -478,28 +824,28 @@ def clean_season(path, conf, facts):
     if conf.get('DOWNLOAD_IMAGES'):
         # the poster, saved as folder.jpg
         image_path = os.path.join(path, 'folder')
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             print '\tRemoving season poster...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
         
         # the season image, saved as banner.jpg
         image_path = os.path.join(path, 'banner')
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             print '\tRemoving season banner...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
         
         # all fanart images, saved as backdropX.jpg, where X is an
         # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
         image_path = os.path.join(path, 'backdrop')
-        image_files = image_file_exists(image_path + '*')
+        image_files = image_file_exists(image_path)
         if image_files:
             print '\tRemoving season backdrops...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
 
 def get_series_metadata_path(path):
     '''\
@@ -507,36 +853,41 @@ def get_series_metadata_path(path):
     '''
     return os.path.join(path, 'series.xml')
 
-def is_series_metadata_complete(path, conf):
+def get_missing_series_metadata(path, conf):
     '''\
-    Returns true if all the metadata for the series at the given path looks
-    to be complete (i.e. the expected files are there).
+    Returns a list of the metadata that is missing for the series at the given
+    path (i.e. the expected files that aren't there).
     '''
-    # check if series.xml exists in the series dir
-    series_xml_path = get_series_metadata_path(path)
+    missing = [ ]
     
-    if not os.path.exists(series_xml_path):
-        return False
+    # check if series.xml exists in the series dir
+    if not snapshot_path_exists(get_series_metadata_path(path)):
+        missing.append('xml')
     
     # images are optional, dependent on the setting. If no image is available,
     # the .noimage file is dropped. Image files are named either 'folder', 
     # 'banner' or 'backdrop' with a .jpg, .png or .noimage extension.
     if conf.get('DOWNLOAD_IMAGES'):
         # check for poster (folder.*)
-        poster_found = image_file_exists(os.path.join(path, 'folder.*'))
+        if not image_file_exists(os.path.join(path, 'folder.')):
+            missing.append('poster')
         
         # check for banner (banner.*)
-        banner_found = image_file_exists(os.path.join(path, 'banner.*'))
+        if not image_file_exists(os.path.join(path, 'banner.')):
+            missing.append('banner')
         
         # check for backdrops (backdrop*)
-        backdrop_found = image_file_exists(os.path.join(path, 'backdrop*'))
-        
-        if poster_found and banner_found and backdrop_found:
-            return True
-        else:
-            return False
+        if not image_file_exists(os.path.join(path, 'backdrop')):
+            missing.append('backdrops')
     
-    return True
+    return missing
+
+def is_series_metadata_complete(path, conf):
+    '''\
+    Returns true if all the metadata for the series at the given path looks
+    to be complete (i.e. the expected files are there).
+    '''
+    return not get_missing_series_metadata(path, conf)
 
 def process_series(path, conf, facts):
     '''\
@@ -554,7 +905,7 @@ def process_series(path, conf, facts):
         # ASCII characters in it. In Linux, path names are UTF-8 encoded, so
         # we need to tell Python that so it can use that information for
         # encoding later (the tvdb_api forces re-encoding to UTF-8).
-        result = tvdb[facts['series_title'].decode('utf-8')]
+        result = get_series(facts['series_title'].decode('utf-8'), facts)
         
         # data has been fetched; write it out
         xml_path = get_series_metadata_path(path)
@@ -601,13 +952,14 @@ def process_series(path, conf, facts):
         mkdir_if_not_exists(xml_path)
         # TODO: somehow pretty print this?
         xml.write(xml_path)
+        invalidate_dir_snapshot(xml_path)
         
         # download the image files
         if conf.get('DOWNLOAD_IMAGES'):
             # the poster, saved as folder.jpg
             image_path = os.path.join(path, 'folder')
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 print '\tDownloading series poster...'
                 # TODO: work out which res is appropriate
                 images = result['_banners'].get('poster')
@@ -627,16 +979,16 @@ def process_series(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
             
             # the series image, saved as banner.jpg
             image_path = os.path.join(path, 'banner')
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 print '\tDownloading series banner...'
                 images = result['_banners'].get('series', { }).get('graphical')
                 if images:
@@ -653,17 +1005,17 @@ def process_series(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # no series images exist, drop a marker file so we don't check
                     # again
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
             
             # all fanart images, saved as backdropX.jpg, where X is an
             # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(os.path.join(path, 'backdrop*')):
+            if not image_file_exists(os.path.join(path, 'backdrop')):
                 print '\tDownloading series backdrops...'
                 # TODO: work out which res is appropriate
                 images = result['_banners'].get('fanart')
@@ -679,6 +1031,7 @@ def process_series(path, conf, facts):
                     # take up to the max number of backdrops setting
                     images = images[:conf.get('MAX_NUMBER_OF_BACKDROPS', 3)]
                     
+                    downloads = [ ]
                     for i,image in enumerate(images):
                         image_path = os.path.join(path, 'backdrop') + str(i > 0 and i or '')
                         image_url = image['_bannerpath']
@@ -687,12 +1040,13 @@ def process_series(path, conf, facts):
                         # know how to put them together (the ext is ASCII; path is
                         # UTF-8 on Linux).
                         image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                        urllib.urlretrieve(image_url, image_path)
+                        downloads.append((image_url, image_path))
+                    download_images(downloads, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = os.path.join(path, 'backdrop')
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
     
     except tvdb_exceptions.tvdb_exception, e:
         print '\t\t[ERROR] ' + repr(e)
@@ -703,35 +1057,35 @@ def clean_series(path, conf, facts):
     '''
     # metadata XML
     xml_path = get_series_metadata_path(path)
-    if os.path.exists(xml_path):
+    if snapshot_path_exists(xml_path):
         print '\tRemoving series metadata...'
         rm_if_exists(xml_path)
     
     if conf.get('DOWNLOAD_IMAGES'):
         # the poster, saved as folder.jpg
         image_path = os.path.join(path, 'folder')
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             print '\tRemoving series poster...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
         
         # the season image, saved as banner.jpg
         image_path = os.path.join(path, 'banner')
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             print '\tRemoving series banner...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
         
         # all fanart images, saved as backdropX.jpg, where X is an
         # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
         image_path = os.path.join(path, 'backdrop')
-        image_files = image_file_exists(image_path + '*')
+        image_files = image_file_exists(image_path)
         if image_files:
             print '\tRemoving series backdrops...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
 
 def get_movie_metadata_path(path):
     '''\
@@ -739,33 +1093,48 @@ def get_movie_metadata_path(path):
     '''
     return os.path.join(path, 'movie.xml')
 
-def is_movie_metadata_complete(path, conf):
+def get_missing_movie_metadata(path, conf):
     '''\
-    Returns true if all the metadata for the movie at the given path looks
-    to be complete (i.e. the expected files are there).
+    Returns a list of the metadata that is missing for the movie at the given
+    path (i.e. the expected files that aren't there).
     '''
-    # check if movie.xml exists in the series dir
-    movie_xml_path = get_movie_metadata_path(path)
+    missing = [ ]
     
-    if not os.path.exists(movie_xml_path):
-        return False
+    # check if movie.xml exists in the movie dir
+    if not snapshot_path_exists(get_movie_metadata_path(path)):
+        missing.append('xml')
     
     # images are optional, dependent on the setting. If no image is available,
     # the .noimage file is dropped. Image files are named either 'folder' 
     # or 'backdrop' with a .jpg, .png or .noimage extension.
     if conf.get('DOWNLOAD_IMAGES'):
         # check for poster (folder.*)
-        poster_found = image_file_exists(os.path.join(path, 'folder.*'))
+        if not image_file_exists(os.path.join(path, 'folder.')):
+            missing.append('poster')
         
         # check for backdrops (backdrop*)
-        backdrop_found = image_file_exists(os.path.join(path, 'backdrop*'))
-        
-        if poster_found and backdrop_found:
-            return True
-        else:
-            return False
+        if not image_file_exists(os.path.join(path, 'backdrop')):
+            missing.append('backdrops')
     
-    return True
+    return missing
+
+def is_movie_metadata_complete(path, conf):
+    '''\
+    Returns true if all the metadata for the movie at the given path looks
+    to be complete (i.e. the expected files are there).
+    '''
+    return not get_missing_movie_metadata(path, conf)
+
+def fetch_movie(movie_title):
+    '''\
+    Searches for the given movie title, returning the full record of the first
+    match, or None if there are no matches.
+    '''
+    results = tmdb.search(movie_title)
+    if results:
+        # using .info() returns the full record, not just a common subset
+        return results[0].info()
+    return None
 
 def process_movie(path, conf, facts):
     '''\
@@ -780,18 +1149,28 @@ def process_movie(path, conf, facts):
         print '\tRetrieving movie metadata...'
         
         movie_title = facts['movie_title']
+        if not_found is not None:
+            record = not_found.check('movie', movie_title, facts)
+            if record is not None:
+                print '\t\t[ERROR] The title \'%s\' was %s' % (
+                    movie_title, describe_not_found(record))
+                return
+        
         # the .decode call is necessary because the series title may have non-
         # ASCII characters in it. In Linux, path names are UTF-8 encoded, so
         # we need to tell Python that so it can use that information for
         # encoding later.
-        results = tmdb.search(movie_title.decode('utf-8'))
-        if results:
-            # using .info() returns the full record, not just a common subset
-            result = results[0].info()
-        else:
+        result = movie_fetches.do(movie_title, fetch_movie,
+                                  movie_title.decode('utf-8'))
+        if result is None:
             print '\t\t[ERROR] No matches found for the title \'%s\'' % movie_title
+            if not_found is not None:
+                not_found.add('movie', movie_title, facts)
             return
         
+        if not_found is not None:
+            not_found.remove('movie', movie_title)
+        
         # data has been fetched; write it out
         xml_path = get_movie_metadata_path(path)
         
@@ -893,6 +1272,7 @@ def process_movie(path, conf, facts):
         mkdir_if_not_exists(xml_path)
         # TODO: somehow pretty print this?
         xml.write(xml_path)
+        invalidate_dir_snapshot(xml_path)
         
         # download the image files
         if conf.get('DOWNLOAD_IMAGES'):
@@ -900,7 +1280,7 @@ def process_movie(path, conf, facts):
             # the poster, saved as folder.jpg
             image_path = os.path.join(path, 'folder')
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(image_path + '.*'):
+            if not image_file_exists(image_path + '.'):
                 print '\tDownloading movie poster...'
                 if images.posters:
                     # HACK: don't know how to pick the best one, so we'll just
@@ -912,16 +1292,16 @@ def process_movie(path, conf, facts):
                     # know how to put them together (the ext is ASCII; path is
                     # UTF-8 on Linux).
                     image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                    urllib.urlretrieve(image_url, image_path)
+                    download_image(image_url, image_path, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
             
             # all fanart images, saved as backdropX.jpg, where X is an
             # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
             # only attempt to download an image if one does not already exist
-            if not image_file_exists(os.path.join(path, 'backdrop*')):
+            if not image_file_exists(os.path.join(path, 'backdrop')):
                 print '\tDownloading movie backdrops...'
                 # TODO: work out which res is appropriate
                 if images.backdrops:
@@ -930,6 +1310,7 @@ def process_movie(path, conf, facts):
                     #       setting
                     backdrops = images.backdrops[:conf.get('MAX_NUMBER_OF_BACKDROPS', 3)]
                     
+                    downloads = [ ]
                     for i,image in enumerate(backdrops):
                         image_path = os.path.join(path, 'backdrop') + str(i > 0 and i or '')
                         image_url = image['original']
@@ -938,14 +1319,15 @@ def process_movie(path, conf, facts):
                         # know how to put them together (the ext is ASCII; path is
                         # UTF-8 on Linux).
                         image_path += os.path.splitext(image_url)[1].encode('utf-8')
-                        urllib.urlretrieve(image_url, image_path)
+                        downloads.append((image_url, image_path))
+                    download_images(downloads, conf)
                 else:
                     # no posters exist, drop a marker file so we don't check again
                     image_path = os.path.join(path, 'backdrop')
                     image_path = image_path + NO_IMAGE_EXTENSION
-                    open(image_path, 'a').close()
+                    write_no_image_file(image_path)
     
-    except KeyError, e:
+    except (KeyError, tmdb.TmdBaseError), e:
         print '\t\t[ERROR] ' + repr(e)
 
 def clean_movie(path, conf, facts):
@@ -954,24 +1336,24 @@ def clean_movie(path, conf, facts):
     '''
     # metadata XML
     xml_path = get_movie_metadata_path(path)
-    if os.path.exists(xml_path):
+    if snapshot_path_exists(xml_path):
         print '\tRemoving movie metadata...'
         rm_if_exists(xml_path)
     
     if conf.get('DOWNLOAD_IMAGES'):
         # the poster, saved as folder.jpg
         image_path = os.path.join(path, 'folder')
-        image_files = image_file_exists(image_path + '.*')
+        image_files = image_file_exists(image_path + '.')
         if image_files:
             print '\tRemoving movie poster...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
         
         # all fanart images, saved as backdropX.jpg, where X is an
         # incrementing number, up to conf.MAX_NUMBER_OF_BACKDROPS.
         image_path = os.path.join(path, 'backdrop')
-        image_files = image_file_exists(image_path + '*')
+        image_files = image_file_exists(image_path)
         if image_files:
             print '\tRemoving movie backdrops...'
             for f in image_files:
-                os.remove(f)
+                rm_if_exists(f)
@@ -0,0 +1,176 @@
+##
+# The scan index records the state of each directory metaproc has visited, so
+# later runs can skip directories that have not changed since they were last
+# found to be complete.
+##
+
+import os
+import errno
+import tempfile
+import cPickle as pickle
+from collections import namedtuple
+from threading import Lock
+
+import walker
+
+# bump this if the format of the records change; older indexes are discarded.
+INDEX_VERSION = 1
+
+# mtime        - the mtime of the directory before it was processed
+# entries      - the filtered listing, as (name, is_dir, has_override) tuples
+# overrides    - a dict of override file name to mtime, for the directory
+#                override and any per-file overrides in the directory
+# complete     - the processor's verdict on the directory and its files
+DirRecord = namedtuple('DirRecord', 'mtime entries overrides complete')
+
+class ScanIndex(object):
+    '''\
+    A persistent index of directory states, stored as a pickled dict in a
+    single file.
+
+    The index is only valid for the settings file it was built with; if the
+    settings file has been modified since, the index is discarded.
+    '''
+    def __init__(self, index_path, settings_path):
+        self.index_path = index_path
+        self.settings_mtime = os.stat(settings_path).st_mtime
+        self.records = { }
+        self.touched = set()
+        self.lock = Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.index_path, 'rb')
+        except IOError, e:
+            # only swallow the 'no such file or directory' error
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        try:
+            try:
+                version, settings_mtime, records = pickle.load(f)
+            except Exception, e:
+                print '[WARN] Could not read the scan index at %s (%s). ' \
+                      'Ignoring it.' % (self.index_path, e)
+                return
+        finally:
+            f.close()
+
+        if version == INDEX_VERSION and settings_mtime == self.settings_mtime:
+            self.records = records
+
+    def save(self):
+        '''\
+        Writes the index out. Records for directories that weren't visited
+        during this run (i.e. that no longer exist) are dropped.
+        '''
+        with self.lock:
+            records = dict((k, v) for k, v in self.records.iteritems()
+                           if k in self.touched)
+
+            # write to a temporary file first so a crash doesn't leave a
+            # truncated index behind. The temporary file has a unique name so
+            # two metaproc processes saving at once don't write to the same
+            # file.
+            dir_path, name = os.path.split(self.index_path)
+            fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % name,
+                                            suffix='.tmp', dir=dir_path or '.')
+            try:
+                f = os.fdopen(fd, 'wb')
+                try:
+                    pickle.dump((INDEX_VERSION, self.settings_mtime, records),
+                                f, pickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.index_path)
+            except:
+                os.unlink(tmp_path)
+                raise
+
+    def get_fresh(self, path):
+        '''\
+        Returns the record for the directory at the given path if the directory
+        and its override files haven't been modified since the record was
+        made, otherwise None.
+        '''
+        key = get_key(path)
+        with self.lock:
+            record = self.records.get(key)
+            self.touched.add(key)
+
+        if record is None or walker.make_entry(path).stat().st_mtime != \
+            record.mtime:
+            return None
+
+        if get_override_mtimes(path, record.entries) != record.overrides:
+            return None
+
+        return record
+
+    def overrides_changed(self, path, overrides):
+        '''\
+        Returns True if the override files for the directory at the given path
+        differ from the ones last recorded.
+        '''
+        with self.lock:
+            record = self.records.get(get_key(path))
+
+        return record is None or record.overrides != overrides
+
+    def put(self, path, mtime, files, overrides, complete):
+        '''\
+        Records the state of the directory at the given path. files is the
+        filtered list of PathEntry objects in that directory.
+        '''
+        key = get_key(path)
+        entries = tuple((f.name, f.is_dir(), f.has_override) for f in files)
+        with self.lock:
+            self.records[key] = DirRecord(mtime, entries, overrides, complete)
+            self.touched.add(key)
+
+    def invalidate(self, path):
+        '''\
+        Drops the records for the given path and everything below it, e.g.
+        after its metadata has been cleaned.
+        '''
+        path = get_key(path).rstrip(os.path.sep)
+        with self.lock:
+            for k in self.records.keys():
+                if k.rstrip(os.path.sep) == path or \
+                    k.startswith(path + os.path.sep):
+                    del self.records[k]
+            # keep the records of everything else
+            self.touched.update(self.records.keys())
+
+def get_key(path):
+    '''\
+    Returns the index key for the given path. Records are keyed by plain
+    strings rather than PathEntry objects, which would carry their stat info
+    (and possibly a DirEntry, which can't be pickled) into the index.
+    '''
+    if isinstance(path, walker.PathEntry):
+        return str(path)
+    return path
+
+def get_override_mtimes(path, entries):
+    '''\
+    Returns a dict of override file name to mtime for the directory override
+    file and the per-file override files in the given directory. entries is a
+    sequence of (name, is_dir, has_override) tuples, or the has_override flags
+    can be taken from a DirListing.
+    '''
+    names = [ walker.OVERRIDE_FILE_NAME ]
+    for name, is_dir, has_override in entries:
+        if has_override:
+            names.append(name + walker.OVERRIDE_FILE_NAME)
+
+    mtimes = { }
+    for name in names:
+        try:
+            mtimes[name] = os.stat(os.path.join(path, name)).st_mtime
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+    return mtimes
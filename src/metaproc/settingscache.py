@@ -0,0 +1,133 @@
+##
+# Caches used when loading settings and override files.
+#
+# Override files are compiled once per process and reused as long as their
+# mtime and size are unchanged; the compiled code objects can also be kept on
+# disk between runs. Regular expressions are compiled once per pattern.
+##
+
+import os
+import re
+import imp
+import errno
+import marshal
+import tempfile
+from threading import Lock
+
+# bump this if the format of the cache file changes. The bytecode magic number
+# is also stored, as marshalled code objects are specific to a Python version.
+CODE_CACHE_VERSION = 1
+
+_lock = Lock()
+
+# path -> (mtime, size, code object)
+_code_cache = { }
+_code_cache_dirty = False
+
+# pattern -> compiled regexp
+_regexp_cache = { }
+
+def get_code(path):
+    '''\
+    Returns the compiled code object for the settings or override file at the
+    given path, compiling it only if it hasn't been seen before with the same
+    mtime and size.
+    '''
+    global _code_cache_dirty
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    cached = _code_cache.get(path)
+    if cached is not None and cached[0] == st.st_mtime and \
+        cached[1] == st.st_size:
+        return cached[2]
+
+    f = open(path, 'rU')
+    try:
+        source = f.read()
+    finally:
+        f.close()
+
+    # execfile copes with a missing newline at the end of the file, compile
+    # doesn't in older versions of Python
+    code = compile(source + '\n', path, 'exec')
+
+    with _lock:
+        _code_cache[path] = (st.st_mtime, st.st_size, code)
+        _code_cache_dirty = True
+
+    return code
+
+def compile_regexp(pattern):
+    '''\
+    Returns the compiled, case-insensitive regexp for the given pattern. Each
+    distinct pattern is only compiled once per process.
+    '''
+    regexp = _regexp_cache.get(pattern)
+    if regexp is None:
+        regexp = re.compile(pattern, re.IGNORECASE)
+        _regexp_cache[pattern] = regexp
+    return regexp
+
+def load_code_cache(cache_path):
+    '''\
+    Loads compiled code objects saved by save_code_cache. A missing, unreadable
+    or outdated cache file is ignored.
+    '''
+    try:
+        f = open(cache_path, 'rb')
+    except IOError, e:
+        # only swallow the 'no such file or directory' error
+        if e.errno != errno.ENOENT:
+            raise
+        return
+
+    try:
+        try:
+            version, magic, entries = marshal.load(f)
+        except (EOFError, ValueError, TypeError), e:
+            print '[WARN] Could not read the override cache at %s (%s). ' \
+                  'Ignoring it.' % (cache_path, e)
+            return
+    finally:
+        f.close()
+
+    if version != CODE_CACHE_VERSION or magic != imp.get_magic():
+        return
+
+    with _lock:
+        for path, entry in entries.iteritems():
+            # anything compiled during this run is at least as fresh
+            if path not in _code_cache:
+                _code_cache[path] = entry
+
+def save_code_cache(cache_path):
+    '''\
+    Saves the compiled code objects to the given path, if anything has changed
+    since they were loaded.
+    '''
+    global _code_cache_dirty
+
+    with _lock:
+        if not _code_cache_dirty:
+            return
+        entries = _code_cache.copy()
+        _code_cache_dirty = False
+
+    # write to a temporary file first so a crash doesn't leave a truncated
+    # cache behind. The temporary file has a unique name so two metaproc
+    # processes saving at once (e.g. --watch and a cron run) don't write to
+    # the same file.
+    dir_path, name = os.path.split(cache_path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp',
+                                    dir=dir_path or '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump((CODE_CACHE_VERSION, imp.get_magic(), entries), f)
+        finally:
+            f.close()
+        os.rename(tmp_path, cache_path)
+    except:
+        os.unlink(tmp_path)
+        raise
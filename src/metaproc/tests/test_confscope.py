@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the confscope module, and the way metaproc layers the confs of
+settings and override files.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metaproc
+import walker
+import workplan
+from confscope import ConfScope
+from settingscache import compile_regexp
+
+class test_confscope(unittest.TestCase):
+    def test_lookup(self):
+        '''\
+        Settings not set in a scope come from its parents
+        '''
+        parent = ConfScope({ 'A': 1, 'B': 2 })
+        child = ConfScope(parent, { 'B': 3 })
+        self.assertEquals((child['A'], child['B']), (1, 3))
+        self.assertEquals(child.get('C', 4), 4)
+        self.assertRaises(KeyError, lambda: child['C'])
+        self.assertTrue('A' in child)
+        self.assertFalse('C' in child)
+        self.assertEquals(sorted(child.keys()), [ 'A', 'B' ])
+        self.assertEquals(child.own_keys(), [ 'B' ])
+
+    def test_copy_on_write(self):
+        '''\
+        Changes only ever affect the scope they are made in
+        '''
+        parent = { 'A': 1 }
+        child = ConfScope(parent)
+        sibling = ConfScope(parent)
+        child['A'] = 2
+        child['B'] = 3
+        self.assertEquals(parent, { 'A': 1 })
+        self.assertEquals((sibling['A'], 'B' in sibling), (1, False))
+
+        self.assertEquals(child.pop('A'), 2)
+        self.assertEquals(child['A'], 1)
+        # settings from the parent can't be removed
+        self.assertRaises(KeyError, child.pop, 'A')
+        self.assertEquals(child.pop('A', None), None)
+
+class test_override_scopes(unittest.TestCase):
+    '''\
+    Walks a temporary tree with override files, and checks the conf and facts
+    each path is planned with.
+    '''
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conf = ConfScope(None, {
+            'SETTING': 'main',
+            'PATH_INCLUDE_REGEXPS': [ compile_regexp(r'.*\.avi$') ],
+            'PATH_EXCLUDE_REGEXPS': [ ],
+            'FACTS_FUNCTION': lambda path, conf, facts: None,
+            # a processor without plan or is_complete plans every path
+            'PROCESSOR': object(),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text=''):
+        path = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(text)
+
+    def plan(self):
+        work_plan = workplan.WorkPlan()
+        metaproc.plan_path(self.dir, self.conf, { }, work_plan, is_root=True)
+        return dict((os.path.relpath(i.path, self.dir), i)
+                    for i in work_plan.items)
+
+    def test_file_override(self):
+        '''\
+        A file's override file only applies to that file
+        '''
+        self.write('a.avi')
+        self.write('a.avi' + walker.OVERRIDE_FILE_NAME,
+                   "SETTING = 'a'\nfacts = { 'movie_title': 'A' }\n")
+        self.write('b.avi')
+        items = self.plan()
+        self.assertEquals(sorted(items.keys()), [ 'a.avi', 'b.avi' ])
+        self.assertEquals(items['a.avi'].conf['SETTING'], 'a')
+        self.assertEquals(items['a.avi'].facts, { 'movie_title': 'A' })
+        self.assertEquals(items['b.avi'].conf['SETTING'], 'main')
+        self.assertEquals(items['b.avi'].facts, { })
+        self.assertEquals(self.conf['SETTING'], 'main')
+
+    def test_dir_override(self):
+        '''\
+        A directory's override file applies to everything below it, and
+        can build on the settings above it
+        '''
+        self.write('show/season 1/e1.avi')
+        self.write('show/' + walker.OVERRIDE_FILE_NAME,
+                   "SETTING = SETTING + ' show'\n"
+                   "PATH_EXCLUDE_REGEXPS = [ 'e2' ]\n"
+                   "facts = { 'series_title': 'Show' }\n")
+        self.write('show/season 1/e2.avi')
+        self.write('other/e1.avi')
+        items = self.plan()
+        self.assertEquals(sorted(items.keys()), [ 'other', 'other/e1.avi',
+            'show', 'show/season 1', 'show/season 1/e1.avi' ])
+        self.assertEquals(items['show/season 1/e1.avi'].conf['SETTING'],
+                          'main show')
+        self.assertEquals(items['show/season 1/e1.avi'].facts,
+                          { 'series_title': 'Show' })
+        self.assertEquals(items['other/e1.avi'].conf['SETTING'], 'main')
+        self.assertEquals(items['other/e1.avi'].facts, { })
+        # the regexps set by the override file are compiled
+        regexps = items['show'].conf['PATH_EXCLUDE_REGEXPS']
+        self.assertEquals(regexps[0].pattern, 'e2')
+
+if __name__ == '__main__':
+    unittest.main()
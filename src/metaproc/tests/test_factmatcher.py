@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the factmatcher module.
+'''
+
+import os
+import re
+import sys
+import random
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import factmatcher
+from settingscache import compile_regexp
+
+# the facts regexps from the default settings file
+TV_FILE_FACTS_REGEXPS = [
+    '([\.\-_ ]|^)S(?P<season_number>\d+)[\.\-_ ]*E(?P<episode_number>\d+)[\.\-_ ]',
+    '([\.\-_ ]|^)0?(?P<season_number>\d{1})(?P<episode_number>\d{2})[\.\-_ ]',
+    '([\.\-_ ]|^)(?P<season_number>\d+)x(?P<episode_number>\d{2})[\.\-_ ]',
+    '([\.\-_ ]|^)Season[\.\-_ ](?P<season_number>\d+)[\.\-_ ]+Episode[\.\-_ ](?P<episode_number>\d+)[\.\-_ ]'
+]
+TV_SEASON_FACTS_REGEXPS = [
+    'SEASON\s*(?P<season_number>\d+)'
+]
+
+def match_in_turn(regexps, name):
+    '''\
+    Returns the facts found by searching with each regexp in turn, the way
+    facts were found before FactMatcher.
+    '''
+    for r in regexps:
+        m = r.search(name)
+        if m:
+            return m.groupdict()
+    return None
+
+def random_name(rnd):
+    parts = [ 'Show', 'S01E02', 's1e2', '102', '1x02', '12x34', 'Season 1',
+              'Episode 3', 'season', 'episode', '2010', '-', '.', '_', ' ',
+              'E05', 'S3', 'x', '0', 'SEASON2', '720p',
+              'Season.2.Episode.10.', 'season_3 - episode 4 ' ]
+    name = ''.join(rnd.choice(parts) for i in range(rnd.randint(1, 8)))
+    return name + rnd.choice([ '.avi', ' ', '', '.mkv' ])
+
+class test_factmatcher(unittest.TestCase):
+    def check_same(self, regexps, count=20000):
+        matcher = factmatcher.FactMatcher(regexps)
+        rnd = random.Random(1)
+        for i in range(count):
+            name = random_name(rnd)
+            self.assertEquals(matcher.match(name),
+                              match_in_turn(regexps, name), name)
+        return matcher
+
+    def test_default_regexps(self):
+        '''\
+        The default facts regexps are combined, and find the same facts as
+        searching with each of them in turn
+        '''
+        for patterns in (TV_FILE_FACTS_REGEXPS, TV_SEASON_FACTS_REGEXPS):
+            regexps = [ compile_regexp(p) for p in patterns ]
+            matcher = self.check_same(regexps)
+            self.assertEquals(len(matcher._matchers), 1)
+
+    def test_first_regexp_wins(self):
+        '''\
+        The first regexp to match anywhere wins, not the one matching the
+        earliest
+        '''
+        regexps = [ compile_regexp(r'(?P<b>B)'), compile_regexp(r'(?P<a>A)') ]
+        matcher = factmatcher.FactMatcher(regexps)
+        self.assertEquals(matcher.match('A B'), { 'b': 'B' })
+        self.assertEquals(matcher.match('A'), { 'a': 'A' })
+        self.assertEquals(matcher.match('C'), None)
+
+    def test_same_group_names(self):
+        '''\
+        Regexps can use the same group names
+        '''
+        regexps = [ compile_regexp(r'(?P<n>\d+)x'),
+                    compile_regexp(r'(?P<n>\d+)(?P<m>y)(?P=n)') ]
+        matcher = factmatcher.FactMatcher(regexps)
+        self.assertEquals(len(matcher._matchers), 1)
+        self.assertEquals(matcher.match('12y12'), { 'n': '12', 'm': 'y' })
+        self.assertEquals(matcher.match('12y13'), None)
+        self.check_same(regexps, 2000)
+
+    def test_uncombinable(self):
+        '''\
+        Regexps with numbered backreferences, inline flags or other flags are
+        kept on their own, and still find the same facts
+        '''
+        regexps = [ compile_regexp(r'(?P<a>S)\d'),
+                    compile_regexp(r'(\d)\1(?P<b>x)'),
+                    re.compile(r'(?P<c>season)'),
+                    compile_regexp(r'(?P<d>E)\d'),
+                    compile_regexp(r'(?s)(?P<e>\d+)') ]
+        matcher = self.check_same(regexps)
+        self.assertEquals(len(matcher._matchers), 5)
+
+    def test_memo(self):
+        '''\
+        Names seen before aren't matched again, until MEMO_LIMIT names have
+        been seen
+        '''
+        matcher = factmatcher.FactMatcher([ compile_regexp(r'(?P<a>\d)') ])
+        facts = matcher.match('1')
+        self.assertTrue(matcher.match('1') is facts)
+        self.assertEquals(matcher.match_all([ '1', 'x', '2' ]),
+                          { '1': { 'a': '1' }, '2': { 'a': '2' } })
+
+        limit = factmatcher.MEMO_LIMIT
+        factmatcher.MEMO_LIMIT = 3
+        try:
+            matcher.match('3')
+            self.assertEquals(len(matcher._memo), 1)
+        finally:
+            factmatcher.MEMO_LIMIT = limit
+
+if __name__ == '__main__':
+    unittest.main()
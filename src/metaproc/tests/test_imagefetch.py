@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the imagefetch module. Images are "downloaded" from a fake
+opener, so no network connection is needed.
+'''
+
+import os
+import sys
+import shutil
+import socket
+import urllib
+import urllib2
+import tempfile
+import unittest
+import mimetools
+import StringIO
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import imagefetch
+
+JPEG = '\xff\xd8\xff\xe0' + 'x' * 100000
+PNG = '\x89PNG\r\n\x1a\n' + 'y' * 100
+
+class _FailingFile(StringIO.StringIO):
+    '''\
+    A file that fails after the first read, like a connection that drops.
+    '''
+    def read(self, size=-1):
+        if self.tell():
+            raise socket.timeout('timed out')
+        return StringIO.StringIO.read(self, size)
+
+class FakeOpener(object):
+    '''\
+    Opens URLs by looking up their bodies in a dict. A body can be an
+    exception to raise instead, and content_length can be given for each URL
+    to send a different Content-Length.
+    '''
+    def __init__(self, bodies, content_length=None):
+        self.bodies = bodies
+        self.content_length = content_length or { }
+        self.opened = [ ]
+
+    def open(self, url):
+        self.opened.append(url)
+        body = self.bodies[url]
+        if isinstance(body, Exception):
+            raise body
+        length = self.content_length.get(url, len(body))
+        f = StringIO.StringIO(body)
+        if url.endswith('drops'):
+            f = _FailingFile(body)
+        return urllib.addinfourl(f, mimetools.Message(StringIO.StringIO(
+            'Content-Length: %d\r\n' % length)), url)
+
+class ImageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def listdir(self):
+        return sorted(os.listdir(self.dir))
+
+class test_imagefetch(ImageTestCase):
+    def test_fetch(self):
+        '''\
+        The image is written to the path, and nothing else is left behind
+        '''
+        path = os.path.join(self.dir, 'folder.jpg')
+        download = imagefetch.fetch(FakeOpener({ 'u': JPEG }), 'u', path)
+        self.assertEquals(download.error, None)
+        self.assertEquals(download.size, len(JPEG))
+        self.assertEquals(open(path, 'rb').read(), JPEG)
+        self.assertEquals(self.listdir(), [ 'folder.jpg' ])
+
+    def test_not_an_image(self):
+        '''\
+        Something that doesn't start like an image isn't kept, and doesn't
+        replace an image that is already there
+        '''
+        path = os.path.join(self.dir, 'folder.jpg')
+        open(path, 'wb').write(PNG)
+        download = imagefetch.fetch(
+            FakeOpener({ 'u': '<html>Not Found</html>' }), 'u', path)
+        self.assertTrue(isinstance(download.error,
+                                   imagefetch.ImageDownloadError))
+        self.assertEquals(open(path, 'rb').read(), PNG)
+        self.assertEquals(self.listdir(), [ 'folder.jpg' ])
+
+    def test_truncated(self):
+        '''\
+        An image shorter than its Content-Length isn't kept
+        '''
+        path = os.path.join(self.dir, 'folder.jpg')
+        opener = FakeOpener({ 'u': JPEG }, { 'u': len(JPEG) + 1 })
+        download = imagefetch.fetch(opener, 'u', path)
+        self.assertTrue(isinstance(download.error,
+                                   imagefetch.ImageDownloadError))
+        self.assertEquals(self.listdir(), [ ])
+
+    def test_errors(self):
+        '''\
+        Download errors are returned rather than raised, and no .part file is
+        left behind
+        '''
+        path = os.path.join(self.dir, 'folder.jpg')
+        opener = FakeOpener({ 'http://x/drops': JPEG,
+            'http://x/404': urllib2.HTTPError('http://x/404', 404, 'Not Found',
+                                              None, None) })
+        for url in ('http://x/drops', 'http://x/404'):
+            download = imagefetch.fetch(opener, url, path)
+            self.assertNotEquals(download.error, None)
+            self.assertTrue(str(download).startswith('could not download'))
+        self.assertEquals(self.listdir(), [ ])
+
+    def test_fetch_all(self):
+        '''\
+        Images are downloaded at the same time, and the results come back in
+        order
+        '''
+        opener = FakeOpener({ 'a': JPEG, 'b': 'nope', 'c': PNG })
+        downloads = [ (url, os.path.join(self.dir, url + '.jpg'))
+                      for url in ('a', 'b', 'c') ]
+        results = imagefetch.fetch_all(opener, downloads)
+        self.assertEquals([ r.url for r in results ], [ 'a', 'b', 'c' ])
+        self.assertEquals([ r.error is None for r in results ],
+                          [ True, False, True ])
+        self.assertEquals(self.listdir(), [ 'a.jpg', 'c.jpg' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the imagestore module.
+'''
+
+import os
+import sys
+import errno
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import imagefetch
+import imagestore
+from test_imagefetch import FakeOpener, ImageTestCase, JPEG
+
+class test_imagestore(ImageTestCase):
+    def setUp(self):
+        ImageTestCase.setUp(self)
+        self.store = imagestore.ImageStore(os.path.join(self.dir, 'store'))
+        self.media = os.path.join(self.dir, 'media')
+        os.mkdir(self.media)
+
+    def fetch(self, opener, url, name):
+        return imagefetch.fetch(opener, url, os.path.join(self.media, name),
+                                self.store)
+
+    def test_downloaded_once(self):
+        '''\
+        An image is only downloaded once, and is hard linked into place
+        '''
+        opener = FakeOpener({ 'u': JPEG })
+        first = self.fetch(opener, 'u', 'folder.jpg')
+        second = self.fetch(opener, 'u', 'poster.jpg')
+        self.assertEquals(opener.opened, [ 'u' ])
+        self.assertEquals((first.from_store, second.from_store),
+                          (False, True))
+        self.assertEquals(second.size, len(JPEG))
+
+        object_path = self.store.lookup('u')
+        for name in ('folder.jpg', 'poster.jpg'):
+            st = os.stat(os.path.join(self.media, name))
+            self.assertEquals(st.st_ino, os.stat(object_path).st_ino)
+        self.assertEquals(os.listdir(os.path.join(self.dir, 'store', 'tmp')),
+                          [ ])
+
+    def test_same_image(self):
+        '''\
+        The same image from two URLs is only kept once
+        '''
+        opener = FakeOpener({ 'a': JPEG, 'b': JPEG })
+        self.fetch(opener, 'a', 'a.jpg')
+        self.fetch(opener, 'b', 'b.jpg')
+        self.assertEquals(self.store.lookup('a'), self.store.lookup('b'))
+
+    def test_copied(self):
+        '''\
+        The image is copied where it can't be hard linked
+        '''
+        self.fetch(FakeOpener({ 'u': JPEG }), 'u', 'a.jpg')
+        object_path = self.store.lookup('u')
+        path = os.path.join(self.media, 'b.jpg')
+
+        def link(source, link_name):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        real_link = imagestore.os.link
+        imagestore.os.link = link
+        try:
+            self.assertFalse(self.store.materialise(object_path, path))
+        finally:
+            imagestore.os.link = real_link
+
+        self.assertEquals(open(path, 'rb').read(), JPEG)
+        self.assertNotEquals(os.stat(path).st_ino, os.stat(object_path).st_ino)
+        self.assertEquals(sorted(os.listdir(self.media)),
+                          [ 'a.jpg', 'b.jpg' ])
+
+    def test_other_link_errors(self):
+        '''\
+        Errors that don't mean hard links can't be used are raised, and
+        nothing is left behind
+        '''
+        self.fetch(FakeOpener({ 'u': JPEG }), 'u', 'a.jpg')
+        def link(source, link_name):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        real_link = imagestore.os.link
+        imagestore.os.link = link
+        try:
+            self.assertRaises(OSError, self.store.materialise,
+                              self.store.lookup('u'),
+                              os.path.join(self.media, 'b.jpg'))
+        finally:
+            imagestore.os.link = real_link
+        self.assertEquals(os.listdir(self.media), [ 'a.jpg' ])
+
+    def test_missing_object(self):
+        '''\
+        An image removed from the store is downloaded again
+        '''
+        opener = FakeOpener({ 'u': JPEG })
+        self.fetch(opener, 'u', 'a.jpg')
+        os.remove(self.store.lookup('u'))
+        self.assertEquals(self.store.lookup('u'), None)
+        self.assertFalse(self.fetch(opener, 'u', 'a.jpg').from_store)
+        self.assertEquals(len(opener.opened), 2)
+
+    def test_unicode_url(self):
+        '''\
+        URLs with non-ASCII characters can be used
+        '''
+        url = u'http://x/caf\xe9.jpg'
+        self.fetch(FakeOpener({ url: JPEG }), url, 'a.jpg')
+        self.assertEquals(self.store.lookup(url),
+                          self.store.lookup(url.encode('utf-8')))
+        self.assertNotEquals(self.store.lookup(url), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the directory snapshots of the mediabrowser processor.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory and the bundled packages onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), 'packages'))
+
+from processors import mediabrowser
+
+class test_dir_snapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        open(os.path.join(self.dir, 'folder.jpg'), 'w').close()
+        mediabrowser.snapshots.clear()
+
+    def tearDown(self):
+        mediabrowser.snapshots.clear()
+        shutil.rmtree(self.dir)
+
+    def write(self, name):
+        path = os.path.join(self.dir, name)
+        open(path, 'w').close()
+        mediabrowser.invalidate_dir_snapshot(path)
+        return path
+
+    def test_snapshot(self):
+        '''\
+        A directory is listed once until it is written to
+        '''
+        snapshot = mediabrowser.get_dir_snapshot(self.dir + os.path.sep)
+        self.assertTrue(mediabrowser.get_dir_snapshot(self.dir) is snapshot)
+        self.assertEquals(mediabrowser.image_file_exists(
+            os.path.join(self.dir, 'folder.')),
+            [ os.path.join(self.dir, 'folder.jpg') ])
+
+        path = self.write('backdrop.png')
+        self.assertTrue(mediabrowser.snapshot_path_exists(path))
+        self.assertFalse(mediabrowser.snapshot_path_exists(
+            os.path.join(self.dir, 'missing.xml')))
+
+    def test_written_while_listing(self):
+        '''\
+        A listing overtaken by a write from another thread isn't kept
+        '''
+        listdir = os.listdir
+        written = [ ]
+        def racing_listdir(path):
+            names = listdir(path)
+            if not written:
+                written.append(self.write('series.xml'))
+            return names
+
+        os.listdir = racing_listdir
+        try:
+            snapshot = mediabrowser.get_dir_snapshot(self.dir)
+        finally:
+            os.listdir = listdir
+        self.assertFalse('series.xml' in snapshot.names)
+        self.assertTrue(mediabrowser.snapshot_path_exists(written[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the notfound module.
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import notfound
+
+class test_notfound(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'notfound')
+        self.facts = { 'series_name': 'The Show', 'season_number': 1,
+                       'episode_number': 2 }
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_cache(self):
+        return notfound.NotFoundCache(self.path, 60, 200)
+
+    def test_normalise_title(self):
+        '''\
+        Case, accents and punctuation don't make titles different
+        '''
+        self.assertEquals(notfound.normalise_title('The.Show_Name'),
+                          notfound.normalise_title(u'the  show name'))
+        self.assertEquals(notfound.normalise_title('Caf\xc3\xa9 - Stories'),
+                          u'cafe stories')
+
+    def test_fingerprint(self):
+        '''\
+        The season and episode numbers aren't part of the fingerprint
+        '''
+        other_episode = dict(self.facts, season_number=3, episode_number=4)
+        other_year = dict(self.facts, year=2001)
+        fingerprint = notfound.get_facts_fingerprint(self.facts)
+        self.assertEquals(notfound.get_facts_fingerprint(other_episode),
+                          fingerprint)
+        self.assertNotEquals(notfound.get_facts_fingerprint(other_year),
+                             fingerprint)
+
+    def test_backoff(self):
+        '''\
+        Each failure doubles the wait, up to the limit, and the records are
+        kept between runs
+        '''
+        cache = self.get_cache()
+        self.assertEquals(cache.check('series', 'The Show', self.facts), None)
+        waits = [ ]
+        for i in range(4):
+            record = cache.add('series', 'The Show', self.facts)
+            self.assertEquals(record.failures, i + 1)
+            waits.append(round(record.retry_at - time.time()))
+            # as if the wait had passed
+            cache.records[('series', u'the show')] = \
+                record._replace(retry_at=0)
+        self.assertEquals(waits, [ 60, 120, 200, 200 ])
+
+        record = self.get_cache().check('series', 'the.show', self.facts)
+        self.assertEquals(record.failures, 4)
+
+    def test_concurrent_failures(self):
+        '''\
+        Failures while the title is already being waited for count once
+        '''
+        cache = self.get_cache()
+        cache.add('series', 'The Show', self.facts)
+        other_episode = dict(self.facts, episode_number=3)
+        record = cache.add('series', 'The Show', other_episode)
+        self.assertEquals(record.failures, 1)
+        self.assertNotEquals(cache.check('series', 'The Show', other_episode),
+                             None)
+
+    def test_facts_changed(self):
+        '''\
+        Changing the facts, e.g. in an override file, means the title is
+        searched for straight away, and starts again from the first wait
+        '''
+        cache = self.get_cache()
+        cache.add('series', 'The Show', self.facts)
+        cache.add('series', 'The Show', self.facts)
+        changed = dict(self.facts, tvdb_id=1234)
+        self.assertEquals(cache.check('series', 'The Show', changed), None)
+        record = cache.add('series', 'The Show', changed)
+        self.assertEquals(record.failures, 1)
+
+    def test_remove(self):
+        '''\
+        Titles that are found are forgotten
+        '''
+        cache = self.get_cache()
+        cache.add('movie', 'A Movie', { })
+        cache.add('series', 'A Movie', { })
+        cache.remove('movie', 'a movie')
+        self.assertEquals(self.get_cache().check('movie', 'A Movie', { }),
+                          None)
+        self.assertNotEquals(self.get_cache().check('series', 'A Movie', { }),
+                             None)
+
+    def test_unreadable(self):
+        '''\
+        A damaged cache is ignored, and no temporary files are left behind
+        '''
+        open(self.path, 'wb').write('not a pickle')
+        cache = self.get_cache()
+        self.assertEquals(cache.records, { })
+        cache.add('series', 'The Show', self.facts)
+        self.assertEquals(os.listdir(self.dir), [ 'notfound' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the parallel module.
+'''
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metaproc
+import parallel
+import walker
+import workplan
+from confscope import ConfScope
+from settingscache import compile_regexp
+
+def _print_facts(path, conf, facts):
+    '''\
+    A facts function that prints each path with the conf and facts it gets, and
+    takes a little while about it so the workers finish out of order.
+    '''
+    time.sleep(random.random() * 0.01)
+    print path, conf['SETTING'], sorted(facts.items())
+    facts['seen'] = facts.get('seen', 0) + 1
+
+class test_parallel_plan(unittest.TestCase):
+    '''\
+    Plans a temporary tree with override files with and without -j, and checks
+    the plan and output are the same.
+    '''
+    def setUp(self):
+        self.dir = tempfile.mkdtemp() + os.path.sep
+        self.conf = ConfScope(None, {
+            'SETTING': 'main',
+            'PATH_INCLUDE_REGEXPS': [ compile_regexp(r'.*\.avi$') ],
+            'PATH_EXCLUDE_REGEXPS': [ ],
+            'FACTS_FUNCTION': _print_facts,
+            # a processor without plan or is_complete plans every path
+            'PROCESSOR': object(),
+        })
+        for show in ('a', 'b', 'c'):
+            self.write('tv/%s/%s' % (show, walker.OVERRIDE_FILE_NAME),
+                       "SETTING = SETTING + ' %s'\n"
+                       "facts = { 'series_title': '%s' }\n" % (show, show))
+            for season in ('1', '2'):
+                for episode in ('1', '2', '3'):
+                    self.write('tv/%s/season %s/e%s.avi' %
+                               (show, season, episode))
+        self.write('tv/b/season 2/e2.avi' + walker.OVERRIDE_FILE_NAME,
+                   "SETTING = 'e2'\nfacts = { 'episode_title': 'E2' }\n")
+        self.write('movies/m.avi')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text=''):
+        path = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(text)
+
+    def plan(self, jobs):
+        '''\
+        Plans the tree the way main does for the given number of jobs, and
+        returns the plan and what was printed.
+        '''
+        dirs = [ os.path.join(self.dir, 'tv', ''),
+                 os.path.join(self.dir, 'movies', '') ]
+        work_plan = workplan.WorkPlan()
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            if jobs > 1:
+                tasks = [ ((p, self.conf, { }, work_plan, True), { })
+                          for p in dirs ]
+                parallel.ParallelWalker(jobs, metaproc.plan_path).run(tasks)
+            else:
+                for p in dirs:
+                    metaproc.plan_path(p, self.conf, { }, work_plan, True)
+        finally:
+            sys.stdout = stdout
+        return work_plan, dirs, output.getvalue()
+
+    def test_same_plan(self):
+        '''\
+        Every path is planned with the same conf and facts, and the output is
+        printed in the same order
+        '''
+        expected, dirs, expected_output = self.plan(1)
+        self.assertEquals(len(expected), 28)
+        for run in range(3):
+            work_plan, dirs, output = self.plan(8)
+            self.assertEquals(output, expected_output)
+            self.assertEquals(
+                [ (i.path, i.conf['SETTING'], i.facts)
+                  for i in work_plan.get_work(dirs) ],
+                [ (i.path, i.conf['SETTING'], i.facts)
+                  for i in expected.get_work(dirs) ])
+
+        items = dict((i.path, i) for i in expected.items)
+        item = items[self.dir + 'tv/b/season 2/e2.avi']
+        self.assertEquals(item.conf['SETTING'], 'e2')
+        self.assertEquals(item.facts, { 'series_title': 'b',
+            'episode_title': 'E2', 'seen': 3 })
+        item = items[self.dir + 'tv/c/season 1/e1.avi']
+        self.assertEquals(item.conf['SETTING'], 'main c')
+        self.assertEquals(item.facts, { 'series_title': 'c', 'seen': 3 })
+
+class test_parallel_walker(unittest.TestCase):
+    def walk(self, name, depth, output, descend=None):
+        time.sleep(random.random() * 0.01)
+        print name
+        output.append(threading.current_thread())
+        if depth > 0:
+            for i in range(3):
+                descend('%s/%d' % (name, i), depth - 1, output)
+        print name, 'done'
+
+    def test_output_order(self):
+        '''\
+        Output is printed in the order a sequential walk would print it,
+        whichever order the workers finish in
+        '''
+        def sequential(name, depth, output):
+            self.walk(name, depth, output, descend=sequential)
+
+        stdout = sys.stdout
+        sys.stdout = expected = StringIO()
+        try:
+            sequential('a', 3, [ ])
+            sequential('b', 2, [ ])
+            sys.stdout = output = StringIO()
+            threads = [ ]
+            parallel.ParallelWalker(4, self.walk).run([
+                (('a', 3, threads), { }), (('b', 2, threads), { }) ])
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(output.getvalue(), expected.getvalue())
+        self.assertEquals(len(threads), 40 + 13)
+        self.assertTrue(len(set(threads)) > 1)
+        self.assertFalse(threading.current_thread() in threads)
+
+    def test_error(self):
+        '''\
+        An exception raised in a worker is raised by run, after the output
+        that comes before it has been printed
+        '''
+        def walk(name, descend):
+            if name == 'b':
+                raise ValueError(name)
+            print name
+            if len(name) < 2:
+                descend(name + 'x')
+
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            self.assertRaises(ValueError, parallel.ParallelWalker(2, walk).run,
+                [ (('a',), { }), (('b',), { }), (('c',), { }) ])
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(output.getvalue(), 'a\nax\n')
+        self.assertTrue(sys.stdout is stdout)
+
+class test_single_flight(unittest.TestCase):
+    def call_together(self, function, count=8):
+        '''\
+        Calls function for the same key from count threads at once, and
+        returns what each of them got back (or raised).
+        '''
+        single_flight = parallel.SingleFlight()
+        results = [ ]
+        def call():
+            try:
+                results.append(single_flight.do('key', function, 'arg'))
+            except Exception, e:
+                results.append(e)
+
+        threads = [ threading.Thread(target=call) for i in range(count) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(single_flight._calls, { })
+        return results
+
+    def test_shared_result(self):
+        '''\
+        Threads calling do for the same key at the same time share a single
+        call, and all get its result
+        '''
+        calls = [ ]
+        def function(arg):
+            calls.append(arg)
+            # give the other threads time to start waiting
+            time.sleep(0.2)
+            return [ arg ]
+
+        results = self.call_together(function)
+        self.assertEquals(calls, [ 'arg' ])
+        self.assertEquals(results, [ [ 'arg' ] ] * 8)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_shared_error(self):
+        '''\
+        If the call raises an exception, all the threads waiting for it get
+        the same exception
+        '''
+        calls = [ ]
+        def function(arg):
+            calls.append(arg)
+            time.sleep(0.2)
+            raise ValueError(arg)
+
+        results = self.call_together(function)
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(len(results), 8)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertTrue(isinstance(results[0], ValueError))
+
+    def test_not_kept(self):
+        '''\
+        Only calls that are running at the same time are shared
+        '''
+        single_flight = parallel.SingleFlight()
+        calls = [ ]
+        self.assertEquals(single_flight.do('a', calls.append, 1), None)
+        single_flight.do('a', calls.append, 2)
+        single_flight.do('b', calls.append, 3)
+        self.assertEquals(calls, [ 1, 2, 3 ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the pathfilter module.
+'''
+
+import os
+import re
+import sys
+import random
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pathfilter
+from settingscache import compile_regexp
+
+def filter_in_turn(include_regexps, exclude_regexps, path):
+    '''\
+    Filters the path by searching with each regexp in turn, the way paths were
+    filtered before PathFilter.
+    '''
+    if include_regexps and not path.endswith('/') and \
+        not [ r for r in include_regexps if r.search(path) ]:
+        return False
+    return not [ r for r in exclude_regexps if r.search(path) ]
+
+def random_path(rnd):
+    names = [ 'Show', 'season 1', 'metadata', 'Sample', 'e01', 'Movie (2001)',
+              'folder', 'x.avi', 'dir.mkv' ]
+    extensions = [ '.avi', '.AVI', '.mkv', '.mp4', '.jpg', '.nfo', '.avi.part',
+                   '', '.Mkv' ]
+    path = '/' + '/'.join(rnd.sample(names, rnd.randint(1, 4)))
+    if rnd.random() < 0.3:
+        return path + '/'
+    return path + rnd.choice(extensions)
+
+class test_pathfilter(unittest.TestCase):
+    def check_same(self, include, exclude):
+        include = [ compile_regexp(p) for p in include ]
+        exclude = [ compile_regexp(p) for p in exclude ]
+        path_filter = pathfilter.PathFilter(include, exclude)
+        rnd = random.Random(1)
+        for i in range(5000):
+            path = random_path(rnd)
+            self.assertEquals(path_filter.is_included(path),
+                              filter_in_turn(include, exclude, path), path)
+
+    def test_extensions(self):
+        '''\
+        Extension patterns are looked up in a set, and match the same paths
+        '''
+        path_filter = pathfilter.PathFilter(
+            [ compile_regexp(r'.*\.avi$'), compile_regexp(r'\.mkv$') ], [ ])
+        self.assertEquals(path_filter.include.extensions,
+                          set([ 'avi', 'mkv' ]))
+        self.assertEquals(path_filter.include.regexps, [ ])
+        self.check_same([ r'.*\.avi$', r'\.mkv$' ], [ ])
+
+    def test_case_sensitive_extensions(self):
+        '''\
+        Extension patterns that aren't case-insensitive are kept as regexps
+        '''
+        path_filter = pathfilter.PathFilter([ re.compile(r'.*\.avi$') ], [ ])
+        self.assertEquals(path_filter.include.extensions, set())
+        self.assertFalse(path_filter.is_included('/x.AVI'))
+        self.assertTrue(path_filter.is_included('/x.avi'))
+
+    def test_combined(self):
+        '''\
+        Other patterns are combined into one regexp, and match the same paths
+        '''
+        include = [ r'.*\.avi$', r'e\d+', r'\.(mp4|mkv)$' ]
+        exclude = [ r'/metadata/$', r'sample', r'\.part$' ]
+        path_filter = pathfilter.PathFilter(
+            [ compile_regexp(p) for p in include ],
+            [ compile_regexp(p) for p in exclude ])
+        self.assertEquals(len(path_filter.include.regexps), 1)
+        self.assertEquals(len(path_filter.exclude.regexps), 1)
+        self.check_same(include, exclude)
+
+    def test_uncombinable(self):
+        '''\
+        Patterns with backreferences or inline flags are kept on their own,
+        and still match the same paths
+        '''
+        include = [ r'(\w)\1', r'(?P<x>e)(?P=x)', r'(?s)mkv$', r'\.avi$' ]
+        exclude = [ r'(?P<name>sample)' ]
+        path_filter = pathfilter.PathFilter(
+            [ compile_regexp(p) for p in include ],
+            [ compile_regexp(p) for p in exclude ])
+        self.assertEquals(len(path_filter.include.regexps), 3)
+        self.check_same(include, exclude)
+
+    def test_order(self):
+        '''\
+        Paths come out in the order they went in, and directories are always
+        included unless excluded
+        '''
+        path_filter = pathfilter.PathFilter([ compile_regexp(r'.*\.avi$') ],
+                                            [ compile_regexp(r'/metadata/$') ])
+        paths = [ '/b.avi', '/a/', '/c.nfo', '/metadata/', '/a.avi' ]
+        self.assertEquals(list(path_filter.filter(paths)),
+                          [ '/b.avi', '/a/', '/a.avi' ])
+
+    def test_no_regexps(self):
+        '''\
+        Without any regexps, everything is included
+        '''
+        path_filter = pathfilter.PathFilter([ ], [ ])
+        self.assertTrue(path_filter.is_included('/x.nfo'))
+
+    def test_cached(self):
+        '''\
+        The same regexps give the same PathFilter
+        '''
+        conf = { 'PATH_INCLUDE_REGEXPS': [ compile_regexp(r'.*\.avi$') ] }
+        self.assertTrue(pathfilter.get_path_filter(conf) is
+                        pathfilter.get_path_filter(dict(conf)))
+
+if __name__ == '__main__':
+    unittest.main()
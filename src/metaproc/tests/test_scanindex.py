@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the scanindex module.
+'''
+
+import os
+import sys
+import shutil
+import cPickle
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import walker
+import scanindex
+
+class _Unpicklable(object):
+    '''\
+    Stands in for a scandir DirEntry, which can't be pickled.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def stat(self):
+        return os.stat(self.path)
+
+    def __reduce__(self):
+        raise TypeError("can't pickle DirEntry objects")
+
+class test_scanindex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings_path = os.path.join(self.dir, 'settings.py')
+        open(self.settings_path, 'w').close()
+        self.index_path = os.path.join(self.dir, 'index')
+        self.media = os.path.join(self.dir, 'media') + os.path.sep
+        os.makedirs(os.path.join(self.media, 'show'))
+        open(os.path.join(self.media, 'a.avi'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_index(self):
+        return scanindex.ScanIndex(self.index_path, self.settings_path)
+
+    def put(self, index, path, complete=True):
+        path = walker.make_entry(path)
+        listing = walker.scan_dir(path)
+        overrides = scanindex.get_override_mtimes(path,
+            [ (f.name, f.is_dir(), f.has_override) for f in listing ])
+        index.put(path, path.stat().st_mtime, listing, overrides, complete)
+
+    def touch(self, path):
+        # make sure the mtime changes, whatever its resolution
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+    def test_fresh(self):
+        '''\
+        A record is fresh until the directory is modified, and is kept
+        between runs
+        '''
+        index = self.get_index()
+        self.assertEquals(index.get_fresh(walker.make_entry(self.media)), None)
+        self.put(index, self.media)
+        index.save()
+
+        index = self.get_index()
+        record = index.get_fresh(walker.make_entry(self.media))
+        self.assertTrue(record.complete)
+        self.assertEquals(sorted(record.entries),
+                          [ ('a.avi', False, False), ('show', True, False) ])
+        index.save()
+
+        self.touch(self.media)
+        self.assertEquals(self.get_index().get_fresh(self.media), None)
+
+    def test_overrides(self):
+        '''\
+        Adding or changing an override file makes the record stale
+        '''
+        index = self.get_index()
+        self.put(index, self.media)
+        override = os.path.join(self.media, 'a.avi' +
+                                walker.OVERRIDE_FILE_NAME)
+        open(override, 'w').close()
+        self.put(index, self.media)
+        self.assertNotEquals(index.get_fresh(self.media), None)
+
+        self.touch(override)
+        self.assertEquals(index.get_fresh(self.media), None)
+        self.assertTrue(index.overrides_changed(self.media,
+            scanindex.get_override_mtimes(self.media,
+                [ ('a.avi', False, True) ])))
+
+    def test_unvisited_dropped(self):
+        '''\
+        Directories that weren't visited during a run are dropped
+        '''
+        index = self.get_index()
+        show = os.path.join(self.media, 'show') + os.path.sep
+        self.put(index, self.media)
+        self.put(index, show)
+        index.save()
+
+        index = self.get_index()
+        index.get_fresh(self.media)
+        index.save()
+        self.assertEquals(self.get_index().records.keys(), [ self.media ])
+
+    def test_invalidate(self):
+        '''\
+        Invalidating a directory drops it and everything below it only
+        '''
+        index = self.get_index()
+        show = os.path.join(self.media, 'show') + os.path.sep
+        os.mkdir(os.path.join(self.dir, 'media2'))
+        other = os.path.join(self.dir, 'media2') + os.path.sep
+        for path in (self.media, show, other):
+            self.put(index, path)
+        index.invalidate(walker.make_entry(self.media))
+        self.assertEquals(index.records.keys(), [ other ])
+        index.save()
+        self.assertEquals(self.get_index().records.keys(), [ other ])
+
+    def test_keys(self):
+        '''\
+        Records are keyed by plain strings, so the stat info and DirEntry
+        objects of PathEntry objects aren't saved with them
+        '''
+        index = self.get_index()
+        path = walker.PathEntry(self.media, is_dir=True,
+                                dir_entry=_Unpicklable(self.media))
+        index.put(path, path.stat().st_mtime, [ ], { }, True)
+        index.save()
+
+        f = open(self.index_path, 'rb')
+        try:
+            version, settings_mtime, records = cPickle.load(f)
+        finally:
+            f.close()
+        self.assertEquals([ type(k) for k in records.keys() ], [ str ])
+        # no temporary files are left behind
+        self.assertEquals(sorted(os.listdir(self.dir)),
+                          [ 'index', 'media', 'settings.py' ])
+        self.assertNotEquals(self.get_index().get_fresh(self.media), None)
+
+    def test_settings_changed(self):
+        '''\
+        The index is discarded if the settings file has been changed
+        '''
+        index = self.get_index()
+        self.put(index, self.media)
+        index.save()
+        self.touch(self.settings_path)
+        self.assertEquals(self.get_index().records, { })
+
+if __name__ == '__main__':
+    unittest.main()
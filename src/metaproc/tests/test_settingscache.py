@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the settingscache module.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settingscache
+
+class test_settingscache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'override')
+        self.cache_path = os.path.join(self.dir, 'cache')
+        settingscache._code_cache.clear()
+
+    def tearDown(self):
+        settingscache._code_cache.clear()
+        shutil.rmtree(self.dir)
+
+    def write(self, text, mtime):
+        open(self.path, 'w').write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def run_code(self, code):
+        values = { }
+        exec code in { }, values
+        return values
+
+    def test_compiled_once(self):
+        '''\
+        A file is compiled again only when its mtime or size changes
+        '''
+        self.write('A = 1', 1000)
+        code = settingscache.get_code(self.path)
+        self.assertTrue(settingscache.get_code(self.path) is code)
+        self.assertEquals(self.run_code(code), { 'A': 1 })
+
+        self.write('A = 2', 1000)
+        self.assertTrue(settingscache.get_code(self.path) is code)
+        self.write('A = 2', 2000)
+        self.assertEquals(self.run_code(settingscache.get_code(self.path)),
+                          { 'A': 2 })
+        self.write('A = 30', 2000)
+        self.assertEquals(self.run_code(settingscache.get_code(self.path)),
+                          { 'A': 30 })
+
+    def test_saved(self):
+        '''\
+        Compiled files are kept between runs, and no temporary files are left
+        behind
+        '''
+        self.write('A = 1', 1000)
+        settingscache.get_code(self.path)
+        settingscache.save_code_cache(self.cache_path)
+        self.assertEquals(sorted(os.listdir(self.dir)), [ 'cache', 'override' ])
+
+        settingscache._code_cache.clear()
+        settingscache.load_code_cache(self.cache_path)
+        self.assertTrue(os.path.abspath(self.path) in settingscache._code_cache)
+        self.write('A = 2', 1000)
+        # the file looks the same, so the cached code is used
+        self.assertEquals(self.run_code(settingscache.get_code(self.path)),
+                          { 'A': 1 })
+
+    def test_unreadable(self):
+        '''\
+        A damaged cache file is ignored
+        '''
+        open(self.cache_path, 'wb').write('not marshalled data')
+        settingscache.load_code_cache(self.cache_path)
+        self.assertEquals(settingscache._code_cache, { })
+
+    def test_compile_regexp(self):
+        '''\
+        Regexps are case-insensitive, and only compiled once per pattern
+        '''
+        regexp = settingscache.compile_regexp(r'\.avi$')
+        self.assertTrue(regexp.search('x.AVI'))
+        self.assertTrue(settingscache.compile_regexp(r'\.avi$') is regexp)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the transport module. The requests are made to a HTTP server
+run by the tests, so no network connection is needed.
+'''
+
+import os
+import sys
+import time
+import socket
+import urllib2
+import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transport
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''\
+    Answers GET /<status> with that status and a short body, after waiting
+    for the server's delay. If the server's trickle is set, the body is sent a
+    byte at a time, that many seconds apart.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        time.sleep(self.server.delay)
+        body = 'body of %s' % self.path
+        self.send_response(int(self.path[1:4]))
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in self.server.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for c in body:
+            self.wfile.write(c)
+            if self.server.trickle:
+                self.wfile.flush()
+                time.sleep(self.server.trickle)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # e.g. the client giving up on a response
+        pass
+
+class ServerTestCase(unittest.TestCase):
+    '''\
+    Base class for the tests that need a HTTP server to talk to.
+    '''
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.requests = [ ]
+        self.server.delay = 0
+        self.server.trickle = 0
+        self.server.headers = { }
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05, ))
+        thread.daemon = True
+        thread.start()
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class test_transport_pool(ServerTestCase):
+    def test_keep_alive(self):
+        '''\
+        Connections are reused once a response has been read
+        '''
+        t = transport.Transport()
+        for i in range(3):
+            response, fp = t.request('http', self.host, 'GET', '/200')
+            self.assertEquals(response.status, 200)
+            self.assertEquals(fp.read(), 'body of /200')
+        self.assertEquals(len(set(a for p, a in self.server.requests)), 1)
+        t.close()
+
+    def test_unread_response_not_reused(self):
+        '''\
+        A connection closed part way through a response isn't reused
+        '''
+        t = transport.Transport()
+        response, fp = t.request('http', self.host, 'GET', '/200')
+        fp.read(4)
+        fp.close()
+        response, fp = t.request('http', self.host, 'GET', '/200')
+        self.assertEquals(fp.read(), 'body of /200')
+        self.assertEquals(len(set(a for p, a in self.server.requests)), 2)
+        t.close()
+
+    def test_opener(self):
+        '''\
+        urllib2 openers built on a transport use it
+        '''
+        t = transport.Transport()
+        opener = urllib2.build_opener(transport.PooledHTTPHandler(t))
+        self.assertEquals(opener.open('http://%s/200' % self.host).read(),
+                          'body of /200')
+        self.assertEquals(len(t.get_pool('http', self.host)._idle), 1)
+        t.close()
+
+class _FakeResponse(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+class test_transport_retries(ServerTestCase):
+    def test_retry_delay(self):
+        '''\
+        Retries wait a random time up to an exponentially growing limit
+        '''
+        t = transport.Transport(retry_backoff=0.5)
+        for tries, limit in ((1, 0.5), (2, 1.0), (3, 2.0),
+                             (20, transport.MAX_RETRY_DELAY)):
+            delays = [ t.get_retry_delay(tries) for i in range(50) ]
+            self.assertTrue(0 <= min(delays) and max(delays) <= limit)
+            self.assertTrue(max(delays) > limit / 4)
+
+    def test_retry_after(self):
+        '''\
+        The server's Retry-After is waited for, within reason
+        '''
+        t = transport.Transport(retry_backoff=0.5)
+        self.assertTrue(t.get_retry_delay(1,
+            _FakeResponse({ 'Retry-After': '7' })) >= 7)
+        self.assertEquals(t.get_retry_delay(1,
+            _FakeResponse({ 'Retry-After': '3600' })),
+            transport.MAX_RETRY_DELAY)
+        # dates aren't understood
+        self.assertTrue(t.get_retry_delay(1, _FakeResponse({ 'Retry-After':
+            'Fri, 31 Dec 1999 23:59:59 GMT' })) <= 0.5)
+
+    def test_retried(self):
+        '''\
+        Temporary errors are retried, and the last response is returned if
+        they keep happening
+        '''
+        t = transport.Transport(retries=2, retry_backoff=0.01,
+                                breaker_failures=10)
+        response, fp = t.request('http', self.host, 'GET', '/503')
+        self.assertEquals(response.status, 503)
+        self.assertEquals(len(self.server.requests), 3)
+
+        # only requests that can safely be sent twice are retried
+        del self.server.requests[:]
+        response, fp = t.request('http', self.host, 'POST', '/503')
+        self.assertEquals(len(self.server.requests), 1)
+        t.close()
+
+    def test_not_retried(self):
+        '''\
+        Other errors aren't retried
+        '''
+        t = transport.Transport(retries=2, retry_backoff=0.01)
+        response, fp = t.request('http', self.host, 'GET', '/404')
+        self.assertEquals(response.status, 404)
+        self.assertEquals(len(self.server.requests), 1)
+        t.close()
+
+    def test_deadline(self):
+        '''\
+        A request fails once its deadline has passed, even while its body is
+        being read
+        '''
+        t = transport.Transport(request_deadline=0.2)
+        self.server.delay = 0.5
+        start = time.time()
+        self.assertRaises(socket.timeout, t.request, 'http', self.host, 'GET',
+                          '/200')
+        self.assertTrue(time.time() - start < 0.45)
+
+        self.server.delay = 0
+        self.server.trickle = 0.05
+        t = transport.Transport(request_deadline=0.3)
+        start = time.time()
+        response, fp = t.request('http', self.host, 'GET', '/200')
+        self.assertRaises(socket.timeout, fp.read)
+        self.assertTrue(time.time() - start < 0.5)
+        t.close()
+
+class test_transport_breaker(unittest.TestCase):
+    def test_opens(self):
+        '''\
+        The breaker opens after max_failures failures in a row, and requests
+        fail straight away until reset_seconds have passed
+        '''
+        breaker = transport.CircuitBreaker('host', 2, 60)
+        breaker.record_failure(breaker.before_request())
+        breaker.record_success(breaker.before_request())
+        breaker.record_failure(breaker.before_request())
+        self.assertTrue(breaker.is_closed())
+        breaker.record_failure(breaker.before_request())
+        self.assertEquals(breaker.state, breaker.OPEN)
+        self.assertRaises(transport.CircuitOpenError, breaker.before_request)
+
+    def test_half_open(self):
+        '''\
+        Once reset_seconds have passed, a single probe is let through, which
+        closes the breaker if it works and opens it again if not
+        '''
+        breaker = transport.CircuitBreaker('host', 1, 0.05)
+        breaker.record_failure(breaker.before_request())
+        time.sleep(0.06)
+        probe = breaker.before_request()
+        self.assertTrue(probe)
+        self.assertEquals(breaker.state, breaker.HALF_OPEN)
+        self.assertRaises(transport.CircuitOpenError, breaker.before_request)
+        breaker.record_failure(probe)
+        self.assertEquals(breaker.state, breaker.OPEN)
+        self.assertRaises(transport.CircuitOpenError, breaker.before_request)
+
+        time.sleep(0.06)
+        probe = breaker.before_request()
+        breaker.record_success(probe)
+        self.assertTrue(breaker.is_closed())
+        self.assertFalse(breaker.before_request())
+
+    def test_late_results(self):
+        '''\
+        Requests let through before the breaker opened don't change it
+        '''
+        breaker = transport.CircuitBreaker('host', 1, 0.05)
+        early = [ breaker.before_request() for i in range(2) ]
+        breaker.record_failure(breaker.before_request())
+        time.sleep(0.06)
+        probe = breaker.before_request()
+
+        breaker.record_failure(early[0])
+        self.assertEquals(breaker.state, breaker.HALF_OPEN)
+        self.assertRaises(transport.CircuitOpenError, breaker.before_request)
+        breaker.record_success(early[1])
+        self.assertEquals(breaker.state, breaker.HALF_OPEN)
+        breaker.record_success(probe)
+        self.assertTrue(breaker.is_closed())
+
+    def test_transport(self):
+        '''\
+        Requests to a host that keeps failing fail straight away once its
+        breaker has opened
+        '''
+        t = transport.Transport(retries=0, breaker_failures=2,
+                                breaker_reset=60, connect_timeout=1)
+        # nothing listens on this port once the socket is closed
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        host = '127.0.0.1:%d' % s.getsockname()[1]
+        s.close()
+        for i in range(2):
+            self.assertRaises(socket.error, t.request, 'http', host, 'GET',
+                              '/200')
+        self.assertRaises(transport.CircuitOpenError, t.request, 'http', host,
+                          'GET', '/200')
+        t.close()
+
+class test_transport_limits(ServerTestCase):
+    def test_token_bucket(self):
+        '''\
+        Bursts of up to burst requests are let through straight away, and
+        then rate a second
+        '''
+        bucket = transport.TokenBucket(20, 3)
+        start = time.time()
+        for i in range(5):
+            bucket.take()
+        self.assertTrue(0.08 <= time.time() - start < 0.2)
+
+        bucket = transport.TokenBucket(None, 1)
+        for i in range(100):
+            bucket.take()
+
+    def test_token_bucket_deadline(self):
+        '''\
+        Waiting for a token that would come after the deadline fails straight
+        away, and doesn't use up the token
+        '''
+        bucket = transport.TokenBucket(1, 1)
+        bucket.take()
+        start = time.time()
+        self.assertRaises(socket.timeout, bucket.take, time.time() + 0.5)
+        self.assertTrue(time.time() - start < 0.1)
+        self.assertTrue(bucket.tokens > -0.1)
+
+    def test_increase(self):
+        '''\
+        The limit goes up by one for each limit's worth of quick successes, up
+        to the maximum
+        '''
+        concurrency = transport.AdaptiveConcurrency(2, 3)
+        for i in range(2):
+            concurrency.release(concurrency.acquire(), True)
+        self.assertAlmostEquals(concurrency.limit, 2.9)
+        for i in range(10):
+            concurrency.release(concurrency.acquire(), True)
+        self.assertEquals(concurrency.limit, 3)
+
+    def test_decrease(self):
+        '''\
+        The limit is halved by a failure or a slow request, but only once for
+        requests that started before it was last halved
+        '''
+        concurrency = transport.AdaptiveConcurrency(8, 8)
+        started = [ concurrency.acquire() for i in range(3) ]
+        concurrency.release(started[0], False)
+        self.assertEquals(concurrency.limit, 4)
+        concurrency.release(started[1], False)
+        self.assertEquals(concurrency.limit, 4)
+        concurrency.release(started[2], None)
+        self.assertEquals((concurrency.limit, concurrency.in_flight), (4, 0))
+
+        concurrency = transport.AdaptiveConcurrency(4, 8)
+        concurrency.release(concurrency.acquire(), True)
+        concurrency.acquire()
+        # as if it had been started a while ago
+        slow = time.time() - transport.MIN_SLOW_LATENCY * 2
+        concurrency.release(slow, True)
+        self.assertAlmostEquals(concurrency.limit, 4.25 / 2)
+
+    def test_acquire_deadline(self):
+        '''\
+        Waiting for a place fails once the deadline has passed
+        '''
+        concurrency = transport.AdaptiveConcurrency(1, 1)
+        concurrency.acquire()
+        start = time.time()
+        self.assertRaises(socket.timeout, concurrency.acquire,
+                          time.time() + 0.1)
+        self.assertTrue(0.1 <= time.time() - start < 0.3)
+
+    def test_held_until_read(self):
+        '''\
+        A request counts against the limit until its body has been read, or
+        straight away for error responses
+        '''
+        t = transport.Transport()
+        concurrency = t.get_pool('http', self.host).concurrency
+        response, fp = t.request('http', self.host, 'GET', '/200')
+        self.assertEquals(concurrency.in_flight, 1)
+        fp.read()
+        self.assertEquals(concurrency.in_flight, 0)
+
+        response, fp = t.request('http', self.host, 'GET', '/404')
+        self.assertEquals(concurrency.in_flight, 0)
+
+        response, fp = t.request('http', self.host, 'GET', '/200')
+        fp.read(2)
+        fp.close()
+        self.assertEquals(concurrency.in_flight, 0)
+        t.close()
+
+    def test_large_bodies(self):
+        '''\
+        Large bodies, which take a while to arrive or are read slowly, don't
+        count as slow requests when mixed with small ones on the same host;
+        slow answers do
+        '''
+        t = transport.Transport()
+        concurrency = t.get_pool('http', self.host).concurrency
+        for i in range(3):
+            t.request('http', self.host, 'GET', '/200')[1].read()
+        limit = concurrency.limit
+
+        for i in range(3):
+            # a body that arrives slowly
+            self.server.trickle = 0.03
+            t.request('http', self.host, 'GET', '/200')[1].read()
+            self.server.trickle = 0
+            t.request('http', self.host, 'GET', '/200')[1].read()
+            # a body read by a caller doing something slow between reads
+            response, fp = t.request('http', self.host, 'GET', '/200')
+            while fp.read(4):
+                time.sleep(transport.MIN_SLOW_LATENCY / 2)
+            self.assertEquals(concurrency.in_flight, 0)
+        self.assertTrue(concurrency.limit >= limit)
+
+        limit = concurrency.limit
+        self.server.delay = transport.MIN_SLOW_LATENCY * 2
+        t.request('http', self.host, 'GET', '/200')[1].read()
+        self.assertEquals(concurrency.limit, limit / 2)
+        t.close()
+
+if __name__ == '__main__':
+    unittest.main()
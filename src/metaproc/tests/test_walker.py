@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the walker module.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import walker
+
+class _CountingDirEntry(object):
+    '''\
+    Stands in for a scandir DirEntry, and counts the stat calls made on it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.stat_calls = 0
+
+    def stat(self):
+        self.stat_calls += 1
+        return os.stat(self.path)
+
+class test_walker(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp() + os.path.sep
+        for name in ('b.avi', 'a.avi', 'a.avi' + walker.OVERRIDE_FILE_NAME,
+                     walker.OVERRIDE_FILE_NAME):
+            open(self.dir + name, 'w').close()
+        os.mkdir(self.dir + 'show')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_listing(self):
+        listing = walker.scan_dir(self.dir)
+        self.assertEquals(listing, [ self.dir + 'a.avi',
+            self.dir + 'a.avi' + walker.OVERRIDE_FILE_NAME,
+            self.dir + 'b.avi', self.dir + 'show' + os.path.sep ])
+        self.assertTrue(listing.has_override)
+        self.assertTrue(walker.OVERRIDE_FILE_NAME in listing.names)
+        self.assertEquals([ e.name for e in listing ], [ 'a.avi',
+            'a.avi' + walker.OVERRIDE_FILE_NAME, 'b.avi', 'show' ])
+        self.assertEquals([ e.has_override for e in listing ],
+                          [ True, False, False, False ])
+        self.assertEquals([ e.is_dir() for e in listing ],
+                          [ False, False, False, True ])
+        self.assertEquals([ e.is_file() for e in listing ],
+                          [ True, True, True, False ])
+        self.assertEquals(listing[0].stat().st_ino,
+                          os.stat(self.dir + 'a.avi').st_ino)
+
+    def test_scan_dir(self):
+        '''\
+        Entries are sorted, directories have a trailing separator, and the
+        directory override file is left out of the listing
+        '''
+        self.check_listing()
+
+    def test_scan_dir_listdir(self):
+        '''\
+        Listing without scandir gives the same entries
+        '''
+        scandir = walker.scandir
+        walker.scandir = None
+        try:
+            self.check_listing()
+        finally:
+            walker.scandir = scandir
+
+    def test_make_entry(self):
+        '''\
+        make_entry stats the path once, and adds a trailing separator to
+        directories
+        '''
+        entry = walker.make_entry(self.dir + 'show')
+        self.assertEquals(entry, self.dir + 'show' + os.path.sep)
+        self.assertTrue(entry.is_dir())
+        self.assertTrue(walker.make_entry(entry) is entry)
+
+        entry = walker.make_entry(self.dir + 'a.avi')
+        self.assertTrue(entry.is_file())
+        self.assertTrue(entry.has_override)
+        self.assertFalse(walker.make_entry(self.dir + 'b.avi').has_override)
+
+        entry = walker.make_entry(self.dir + 'missing.avi')
+        self.assertFalse(entry.is_dir() or entry.is_file())
+
+    def test_stat_cached(self):
+        '''\
+        The stat info of an entry is only fetched once
+        '''
+        dir_entry = _CountingDirEntry(self.dir + 'a.avi')
+        entry = walker.PathEntry(self.dir + 'a.avi', is_file=True,
+                                 dir_entry=dir_entry)
+        self.assertTrue(entry.stat() is entry.stat())
+        self.assertEquals(dir_entry.stat_calls, 1)
+
+    def test_path_is_dir(self):
+        '''\
+        path_is_dir and path_is_file work on plain paths too
+        '''
+        self.assertTrue(walker.path_is_dir(self.dir + 'show'))
+        self.assertTrue(walker.path_is_file(self.dir + 'a.avi'))
+        entry = walker.PathEntry(self.dir + 'show', is_dir=False)
+        # the cached info is trusted
+        self.assertFalse(walker.path_is_dir(entry))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the watch module.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import walker
+import watch
+
+class _Event(object):
+    def __init__(self, mask, pathname, dir=False):
+        self.mask = mask
+        self.pathname = pathname
+        self.dir = dir
+
+class _FakeWatchManager(object):
+    def __init__(self):
+        self.watches = [ ]
+
+    def add_watch(self, path, mask, rec=False, auto_add=False):
+        self.watches.append((path, mask, rec, auto_add))
+
+if watch.pyinotify is not None:
+    class test_event_handler(unittest.TestCase):
+        def setUp(self):
+            self.pending = { }
+            self.watch_manager = _FakeWatchManager()
+            self.handler = watch._EventHandler(self.pending,
+                                               self.watch_manager)
+
+        def test_files(self):
+            '''\
+            Files are only pending once they have been closed
+            '''
+            self.handler(_Event(watch.pyinotify.IN_CREATE, '/media/a.avi'))
+            self.assertEquals(self.pending, { })
+            self.handler(_Event(watch.pyinotify.IN_CLOSE_WRITE,
+                                '/media/a.avi'))
+            self.assertEquals(self.pending.keys(), [ '/media/a.avi' ])
+            self.assertEquals(self.watch_manager.watches, [ ])
+
+        def test_moved_dir(self):
+            '''\
+            Directories moved in are watched, along with everything inside
+            them
+            '''
+            self.handler(_Event(watch.pyinotify.IN_MOVED_TO, '/media/show',
+                                dir=True))
+            self.assertEquals(self.pending.keys(), [ '/media/show' ])
+            self.assertEquals(self.watch_manager.watches,
+                              [ ('/media/show', watch.WATCH_MASK, True, True) ])
+
+        def test_created_dir(self):
+            '''\
+            Directories created in place are pending, and left to auto_add
+            '''
+            self.handler(_Event(watch.pyinotify.IN_CREATE, '/media/show',
+                                dir=True))
+            self.assertEquals(self.pending.keys(), [ '/media/show' ])
+            self.assertEquals(self.watch_manager.watches, [ ])
+
+        def test_override(self):
+            '''\
+            A changed override file makes the path it applies to pending
+            '''
+            self.handler(_Event(watch.pyinotify.IN_CLOSE_WRITE,
+                                '/media/show/' + walker.OVERRIDE_FILE_NAME))
+            self.handler(_Event(watch.pyinotify.IN_CLOSE_WRITE,
+                                '/media/a.avi' + walker.OVERRIDE_FILE_NAME))
+            self.assertEquals(sorted(self.pending.keys()),
+                              [ '/media/a.avi', '/media/show' ])
+
+class test_settled(unittest.TestCase):
+    '''\
+    Checks which pending paths are handed over, without watching anything.
+    '''
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.handled = [ ]
+        self.watcher = watch.Watcher.__new__(watch.Watcher)
+        self.watcher.callback = self.handled.append
+        self.watcher.settle_seconds = 10
+        self.watcher.pending = { }
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_settled(self):
+        '''\
+        Nothing is handed over while anything is still changing, and paths
+        inside a pending directory are left to it
+        '''
+        show = os.path.join(self.dir, 'show')
+        os.makedirs(show)
+        open(os.path.join(show, 'e1.avi'), 'w').close()
+        open(os.path.join(self.dir, 'show.avi'), 'w').close()
+        self.watcher.pending.update({
+            show: 0,
+            os.path.join(show, 'e1.avi'): 0,
+            os.path.join(self.dir, 'show.avi'): 0,
+            os.path.join(self.dir, 'gone.avi'): 0,
+        })
+
+        pending = dict(self.watcher.pending)
+        self.watcher.pending[show] = watch.time.time()
+        self.watcher._handle_settled()
+        self.assertEquals(self.handled, [ ])
+
+        self.watcher.pending.update(pending)
+        self.watcher._handle_settled()
+        self.assertEquals(self.handled,
+                          [ show, os.path.join(self.dir, 'show.avi') ])
+        self.assertEquals(self.watcher.pending, { })
+
+if __name__ == '__main__':
+    unittest.main()
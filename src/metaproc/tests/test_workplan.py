@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+'''\
+Unit tests for the workplan module, and the way metaproc prints a plan.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+# Force parent directory onto path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metaproc
+import walker
+import workplan
+from confscope import ConfScope
+from settingscache import compile_regexp
+
+def _dir(path):
+    return walker.PathEntry(path, is_dir=True)
+
+def _file(path):
+    return walker.PathEntry(path, is_file=True)
+
+def _item(path, description=None, needs=('poster', ), group=None):
+    if description is None:
+        description = path.name
+    return workplan.WorkItem(path, { }, { }, description, list(needs), group)
+
+class test_workplan(unittest.TestCase):
+    def paths(self, work_plan, roots):
+        return [ str(i.path) for i in work_plan.get_work(roots) ]
+
+    def test_walk_order(self):
+        '''\
+        Work is in the order the tree is walked in: roots in the order they
+        are given, a directory before everything in it, and entries sorted
+        by path (with the trailing separator of directories)
+        '''
+        roots = [ '/media/tv/', '/media/movies/' ]
+        work_plan = workplan.WorkPlan()
+        for path in (_file('/media/movies/b.avi'), _dir('/media/tv/show/'),
+                     _file('/media/tv/show/season 1/e1.avi'),
+                     _dir('/media/movies/a/'), _file('/media/tv/show/x.avi'),
+                     _dir('/media/tv/show/season 1/'),
+                     _file('/media/tv/show.avi')):
+            work_plan.add(_item(path))
+        self.assertEquals(len(work_plan), 7)
+        self.assertEquals(self.paths(work_plan, roots), [
+            '/media/tv/show.avi',
+            '/media/tv/show/',
+            '/media/tv/show/season 1/',
+            '/media/tv/show/season 1/e1.avi',
+            '/media/tv/show/x.avi',
+            '/media/movies/a/',
+            '/media/movies/b.avi' ])
+
+    def test_groups(self):
+        '''\
+        Items in the same group are together, where the first of them would
+        be, and each path is only included once
+        '''
+        roots = [ '/media/' ]
+        work_plan = workplan.WorkPlan()
+        work_plan.add(_item(_file('/media/b/e1.avi'), group='b'))
+        work_plan.add(_item(_dir('/media/a/'), group='a'))
+        work_plan.add(_item(_dir('/media/b/'), group='b'))
+        work_plan.add(_item(_file('/media/c.avi')))
+        work_plan.add(_item(_file('/media/z/e1.avi'), group='a'))
+        work_plan.add(_item(_file('/media/b/e1.avi'), group='b'))
+        self.assertEquals(self.paths(work_plan, roots), [
+            '/media/a/', '/media/z/e1.avi',
+            '/media/b/', '/media/b/e1.avi',
+            '/media/c.avi' ])
+
+    def test_join_words(self):
+        '''\
+        Items say what they need in a sentence
+        '''
+        self.assertEquals(workplan.join_words([ ]), '')
+        self.assertEquals(workplan.join_words([ 'a' ]), 'a')
+        self.assertEquals(workplan.join_words([ 'a', 'b', 'c' ]), 'a, b and c')
+        self.assertEquals(str(_item(_dir('/media/a/'), 'series A',
+                                    [ 'poster', 'banner' ])),
+                          'series A needs poster and banner')
+
+class test_plan_order(unittest.TestCase):
+    '''\
+    Plans a temporary tree, and checks the work is in the same order the tree
+    was walked in.
+    '''
+    def setUp(self):
+        self.dir = tempfile.mkdtemp() + os.path.sep
+        self.conf = ConfScope(None, {
+            'PATH_INCLUDE_REGEXPS': [ compile_regexp(r'.*\.avi$') ],
+            'PATH_EXCLUDE_REGEXPS': [ ],
+            'FACTS_FUNCTION': lambda path, conf, facts: None,
+            # a processor without plan or is_complete plans every path
+            'PROCESSOR': object(),
+        })
+        for name in ('tv/show/season 1/e1.avi', 'tv/show/season 10/e1.avi',
+                     'tv/show/season 2/e1.avi', 'tv/show.avi',
+                     'tv/show-2/e.avi', 'tv/Show/e.avi', 'movies/a b.avi',
+                     'movies/a/a.avi'):
+            path = os.path.join(self.dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        self.roots = [ os.path.join(self.dir, 'tv', ''),
+                       os.path.join(self.dir, 'movies', '') ]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def plan(self):
+        work_plan = workplan.WorkPlan()
+        for p in self.roots:
+            metaproc.plan_path(p, self.conf, { }, work_plan, is_root=True)
+        return work_plan
+
+    def test_walk_order(self):
+        '''\
+        The work for a walked tree is in the order it was planned in
+        '''
+        work_plan = self.plan()
+        self.assertEquals(len(work_plan), 15)
+        self.assertEquals(work_plan.get_work(self.roots), work_plan.items)
+
+        # the order doesn't depend on the order the work was found in
+        work_plan.items.reverse()
+        self.assertEquals(work_plan.get_work(self.roots),
+                          list(reversed(work_plan.items)))
+
+    def test_print_plan(self):
+        '''\
+        The plan is printed in the order it would be carried out in, with a
+        heading for each directory
+        '''
+        work_plan = self.plan()
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            metaproc.print_plan(work_plan, self.roots)
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(output.getvalue().replace(self.dir, '/'),
+            '/tv/Show/\n'
+            '\tShow needs processing\n'
+            '\te.avi\n'
+            '\t\te.avi needs processing\n'
+            '/tv/show-2/\n'
+            '\tshow-2 needs processing\n'
+            '\te.avi\n'
+            '\t\te.avi needs processing\n'
+            '/tv/\n'
+            '\tshow.avi\n'
+            '\t\tshow.avi needs processing\n'
+            '/tv/show/\n'
+            '\tshow needs processing\n'
+            '/tv/show/season 1/\n'
+            '\tseason 1 needs processing\n'
+            '\te1.avi\n'
+            '\t\te1.avi needs processing\n'
+            '/tv/show/season 10/\n'
+            '\tseason 10 needs processing\n'
+            '\te1.avi\n'
+            '\t\te1.avi needs processing\n'
+            '/tv/show/season 2/\n'
+            '\tseason 2 needs processing\n'
+            '\te1.avi\n'
+            '\t\te1.avi needs processing\n'
+            '/movies/\n'
+            '\ta b.avi\n'
+            '\t\ta b.avi needs processing\n'
+            '/movies/a/\n'
+            '\ta needs processing\n'
+            '\ta.avi\n'
+            '\t\ta.avi needs processing\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,751 @@
+##
+# HTTP transport for metaproc.
+#
+# All HTTP requests (tvdb_api, tmdb and image downloads) go through a single
+# Transport, which keeps a pool of persistent (keep-alive) connections to each
+# host. A run that downloads thousands of images therefore reuses a handful of
+# connections instead of opening a new one for each request.
+#
+# The Transport is plugged into urllib2 using PooledHTTPHandler, so anything
+# that takes a urllib2 opener can use it; see build_opener.
+#
+# Requests that fail because of a connection error, a timeout or a temporary
+# server error are retried a few times, waiting a random time up to an
+# exponentially growing limit in between, as long as the request's deadline
+# hasn't passed. Each host also has a circuit breaker (see CircuitBreaker): once
+# enough requests to a host have failed in a row, requests to it fail straight
+# away for a while, rather than each waiting for its own timeouts.
+#
+# Requests to each host are also limited to a number a second (with bursts
+# allowed; see TokenBucket), and the number made at once is adjusted to what
+# the host copes with (see AdaptiveConcurrency), so metaproc doesn't get itself
+# throttled by sending too much at once.
+##
+
+import sys
+import time
+import random
+import socket
+import httplib
+import urllib2
+from threading import Lock, Condition
+
+# the defaults, which can be changed using the HTTP_* settings (see configure)
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_REQUEST_DEADLINE = 120
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET = 30
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_RATE_BURST = 20
+DEFAULT_MAX_CONCURRENCY = 16
+
+# the longest wait between retries, however many there have been
+MAX_RETRY_DELAY = 30
+
+# a request is taken as a sign the host is struggling (see AdaptiveConcurrency)
+# if it takes LATENCY_TOLERANCE times as long to be answered as the quickest
+# request lately, and at least MIN_SLOW_LATENCY seconds. The quickest request
+# lately is the quickest in the current and the last LATENCY_WINDOW seconds.
+LATENCY_TOLERANCE = 2.0
+MIN_SLOW_LATENCY = 0.25
+LATENCY_WINDOW = 60
+
+# only requests that can safely be sent twice are retried
+IDEMPOTENT_METHODS = ( 'GET', 'HEAD' )
+
+# the errors and response statuses that mean a request might work if it is
+# tried again
+RETRY_ERRORS = (socket.error, httplib.HTTPException)
+RETRY_STATUSES = ( 429, 500, 502, 503, 504 )
+
+# errors meaning a kept-alive connection was closed by the server while it was
+# idle; the request is retried once on a new connection.
+STALE_CONNECTION_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest,
+                           socket.error)
+
+class CircuitOpenError(httplib.HTTPException):
+    '''\
+    Raised instead of making a request to a host whose circuit breaker is open.
+    '''
+    pass
+
+class CircuitBreaker(object):
+    '''\
+    Tracks whether requests to a host are working. The breaker is closed (and
+    requests are made) until max_failures tries in a row have failed (counting
+    each retry of a request), when it opens; requests then fail straight away
+    with CircuitOpenError for reset_seconds. After that the breaker is half
+    open: a single request (the probe) is let through to see whether the host
+    has recovered (others still fail straight away), which closes the breaker
+    if it works and opens it again if not. Requests that were let through
+    before the breaker opened don't change it once it has opened; only the
+    probe does.
+    '''
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half open'
+
+    def __init__(self, host, max_failures, reset_seconds):
+        self.host = host
+        self.max_failures = max_failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    def before_request(self):
+        '''\
+        Raises CircuitOpenError if a request can't be made to the host now.
+        Otherwise returns True if the request is the probe, or False if not;
+        this is passed to record_success or record_failure, one of which must
+        be called for every request allowed.
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN:
+                retry_in = self.opened_at + self.reset_seconds - time.time()
+                if retry_in > 0:
+                    raise CircuitOpenError('%s has failed %d times in a row; '
+                        'not trying again for %.0fs' % (self.host,
+                        self.failures, retry_in))
+                self.state = self.HALF_OPEN
+            if self._probing:
+                raise CircuitOpenError('%s has failed %d times in a row; '
+                    'waiting to see if it has recovered' % (self.host,
+                    self.failures))
+            # this request is the one that finds out if the host has recovered
+            self._probing = True
+            return True
+
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    def record_success(self, probe):
+        with self._lock:
+            if probe:
+                self.state = self.CLOSED
+                self._probing = False
+            elif self.state != self.CLOSED:
+                # a request from before the breaker opened
+                return
+            self.failures = 0
+
+    def record_failure(self, probe):
+        with self._lock:
+            if probe:
+                self._probing = False
+            elif self.state != self.CLOSED:
+                # a request from before the breaker opened
+                return
+            self.failures += 1
+            if probe or self.failures >= self.max_failures:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+class TokenBucket(object):
+    '''\
+    Limits the rate of requests to a host to rate a second on average, while
+    allowing bursts of up to burst requests at once. If rate is None, there is
+    no limit.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst or 1, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self._lock = Lock()
+
+    def take(self, deadline=None):
+        '''\
+        Waits until a request can be made. Raises socket.timeout if that would
+        be after the given deadline.
+        '''
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # take the token now, even if it hasn't been added yet; requests
+            # waiting for tokens are then let through in turn
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, 0)
+            if deadline is not None and now + wait > deadline:
+                self.tokens += 1
+                raise socket.timeout('the request took too long')
+
+        if wait:
+            time.sleep(wait)
+
+class AdaptiveConcurrency(object):
+    '''\
+    Limits the number of requests being made to a host at once, and adjusts
+    the limit to what the host copes with (AIMD). A request counts until the
+    whole response has been read. The limit goes up by one for each limit's
+    worth of requests that succeed quickly, up to maximum. It is halved (down
+    to one) when a request fails, or takes LATENCY_TOLERANCE times as long to
+    be answered as the quickest request lately. How long a request takes is
+    measured up to its response headers, as a large body (or a caller that
+    does something slow between reads) says nothing about how busy the host
+    is. Only a request started after the limit was last halved can halve it
+    again, so a burst of failures at the same moment only counts once.
+    '''
+    def __init__(self, initial, maximum):
+        self.maximum = max(maximum or 1, 1)
+        self.limit = float(min(max(initial or 1, 1), self.maximum))
+        self.in_flight = 0
+        self.decreased_at = 0
+        # the quickest latency in this LATENCY_WINDOW and the one before
+        self.window_start = time.time()
+        self.window_min_latency = None
+        self.last_min_latency = None
+        self._condition = Condition()
+
+    def acquire(self, deadline=None):
+        '''\
+        Waits until a request can be made, and returns the time it started,
+        which is passed to release once it is done. Raises socket.timeout if
+        the deadline passes while waiting.
+        '''
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                # Condition.wait can't be interrupted with Ctrl-C unless it has
+                # a timeout
+                timeout = 1
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        raise socket.timeout('the request took too long')
+                    timeout = min(timeout, 1)
+                self._condition.wait(timeout)
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, started, succeeded, answered=None):
+        '''\
+        Records that the request started at the given time is done. succeeded
+        is None if nothing was learned about the host from it, e.g. because
+        the request wasn't made after all or its response was abandoned.
+        answered is the time the response headers arrived, if there was a
+        response; the request's latency runs until then.
+        '''
+        now = time.time()
+        latency = (answered or now) - started
+        with self._condition:
+            self.in_flight -= 1
+
+            if succeeded:
+                # only the quickest latency lately counts, so the limit can
+                # still grow if the host gets slower for good
+                if now - self.window_start > LATENCY_WINDOW:
+                    self.last_min_latency = self.window_min_latency
+                    self.window_min_latency = None
+                    self.window_start = now
+                if self.window_min_latency is None or \
+                    latency < self.window_min_latency:
+                    self.window_min_latency = latency
+                min_latency = self.window_min_latency
+                if self.last_min_latency is not None:
+                    min_latency = min(min_latency, self.last_min_latency)
+                slow = latency > max(min_latency * LATENCY_TOLERANCE,
+                                     MIN_SLOW_LATENCY)
+
+            if succeeded and not slow:
+                self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            elif succeeded is not None and started >= self.decreased_at:
+                self.limit = max(self.limit / 2, 1.0)
+                self.decreased_at = now
+
+            self._condition.notify_all()
+
+class ConnectionPool(object):
+    '''\
+    The idle connections to a single host. Up to max_size idle connections are
+    kept; more connections can be in use at once, but the extra ones are closed
+    when they are released. The pool also holds the CircuitBreaker, TokenBucket
+    and AdaptiveConcurrency for the host.
+    '''
+    def __init__(self, scheme, host, max_size, connect_timeout, read_timeout,
+                 breaker, rate_limit, concurrency):
+        self.scheme = scheme
+        self.host = host
+        self.max_size = max_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        self._idle = [ ]
+        self._lock = Lock()
+
+    def get(self, timeout=None):
+        '''\
+        Returns a (connection, reused) tuple, where reused is True if the
+        connection has been used before. If a timeout is given, neither
+        connecting nor reading from the connection can take longer than it.
+        '''
+        with self._lock:
+            conn = self._idle and self._idle.pop() or None
+        reused = conn is not None
+
+        if conn is None:
+            connect_timeout = self.connect_timeout
+            if timeout is not None:
+                connect_timeout = min(connect_timeout, timeout)
+            if self.scheme == 'https':
+                conn = httplib.HTTPSConnection(self.host,
+                                               timeout=connect_timeout)
+            else:
+                conn = httplib.HTTPConnection(self.host,
+                                              timeout=connect_timeout)
+            conn.connect()
+
+        # the connect timeout is used for connecting only
+        read_timeout = self.read_timeout
+        if timeout is not None:
+            read_timeout = min(read_timeout, timeout)
+        conn.sock.settimeout(read_timeout)
+        return conn, reused
+
+    def put(self, conn):
+        '''\
+        Returns a connection to the pool once a response has been completely
+        read from it.
+        '''
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = [ ]
+        for conn in idle:
+            conn.close()
+
+class _DeadlineSocket(object):
+    '''\
+    Wraps the socket a response is read from, so no read from it waits past
+    the request's deadline; reads fail with socket.timeout once it has passed.
+    '''
+    def __init__(self, sock, deadline, read_timeout):
+        self._sock = sock
+        self._deadline = deadline
+        self._read_timeout = read_timeout
+
+    def _set_timeout(self):
+        timeout = self._deadline - time.time()
+        if timeout <= 0:
+            raise socket.timeout('the request took too long')
+        self._sock.settimeout(min(self._read_timeout, timeout))
+
+    def recv(self, *args):
+        self._set_timeout()
+        return self._sock.recv(*args)
+
+    def recv_into(self, *args):
+        self._set_timeout()
+        return self._sock.recv_into(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+class PooledResponse(object):
+    '''\
+    A file-like wrapper around a httplib.HTTPResponse, which gives the
+    connection back to the pool once the whole body has been read. Closing it
+    before then closes the connection instead, as it can't be reused.
+
+    If a deadline is given, reading the body fails with socket.timeout once it
+    has passed, as the rest of the request would have.
+
+    The request started at the given time (see AdaptiveConcurrency.acquire)
+    is released from the pool's concurrency limit once the body has been read,
+    or reading it fails. Error responses are released straight away instead,
+    as their bodies are seldom read. Either way, its latency is taken from when
+    the response was created, i.e. when its headers arrived.
+    '''
+    def __init__(self, response, conn, pool, deadline=None, started=None):
+        self._pool = pool
+        self._started = started
+        self._answered = time.time()
+        self._response = response
+        self._conn = conn
+        if deadline is not None and response.fp is not None:
+            response.fp._sock = _DeadlineSocket(response.fp._sock, deadline,
+                                                pool.read_timeout)
+        if response.status >= 400:
+            self._release(response.status not in RETRY_STATUSES)
+        self._check_done()
+
+    def read(self, amt=None):
+        try:
+            return self._response.read(amt)
+        except:
+            # the connection is left part way through the response
+            self._release(False)
+            self.close()
+            raise
+        finally:
+            self._check_done()
+
+    def readline(self):
+        # HTTPResponse doesn't do readline, so do it the slow way; this is only
+        # used for small responses (if at all).
+        chars = [ ]
+        while True:
+            c = self.read(1)
+            if not c:
+                break
+            chars.append(c)
+            if c == '\n':
+                break
+        return ''.join(chars)
+
+    def readlines(self, sizehint=0):
+        return self.read().splitlines(True)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        # closed before the whole body was read, so it's not known how long
+        # the rest would have taken
+        self._release(None)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._response.close()
+
+    def __del__(self):
+        # responses that are neither read nor closed mustn't keep their place
+        # in the concurrency limit for good
+        self._release(None)
+
+    def _release(self, succeeded):
+        if self._started is not None:
+            started = self._started
+            self._started = None
+            self._pool.concurrency.release(started, succeeded, self._answered)
+
+    def _check_done(self):
+        if self._conn is None:
+            return
+        if self._response.length == 0 and not self._response.isclosed():
+            # e.g. a HEAD request or a 304 Not Modified
+            self._response.read()
+        if self._response.isclosed():
+            self._release(True)
+            conn = self._conn
+            self._conn = None
+            if self._response.will_close:
+                conn.close()
+            else:
+                self._pool.put(conn)
+
+class Transport(object):
+    '''\
+    Makes HTTP requests using a ConnectionPool (with its CircuitBreaker,
+    TokenBucket and AdaptiveConcurrency) for each host.
+
+    Requests using IDEMPOTENT_METHODS that fail with one of the RETRY_ERRORS or
+    RETRY_STATUSES are tried up to retries more times. Before retry n, a random
+    time of up to retry_backoff * 2 ** (n - 1) seconds is waited (or as long as
+    the server's Retry-After header asks). No request takes longer than
+    request_deadline seconds, however many tries that is; this includes
+    reading the body of the response, which fails with socket.timeout once the
+    deadline has passed (but isn't retried).
+
+    Requests to each host are limited to rate_limit a second, in bursts of up
+    to rate_burst, unless host_rate_limits (a dict of host name to a
+    (rate_limit, rate_burst) tuple) says otherwise. Up to max_concurrency
+    requests are made to a host at once, if the host copes.
+    '''
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 request_deadline=DEFAULT_REQUEST_DEADLINE,
+                 breaker_failures=DEFAULT_BREAKER_FAILURES,
+                 breaker_reset=DEFAULT_BREAKER_RESET,
+                 rate_limit=DEFAULT_RATE_LIMIT,
+                 rate_burst=DEFAULT_RATE_BURST,
+                 host_rate_limits=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.request_deadline = request_deadline
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.host_rate_limits = host_rate_limits
+        self.max_concurrency = max_concurrency
+        self._pools = { }
+        self._lock = Lock()
+
+    def configure(self, **settings):
+        '''\
+        Changes the settings given as keyword arguments, which are named as
+        they are for the constructor. Existing idle connections are closed and
+        the circuit breakers and limits of each host start again, so the new
+        settings apply to every connection from now on.
+        '''
+        for name, value in settings.items():
+            if name.startswith('_') or not hasattr(self, name):
+                raise TypeError('%s is not a transport setting' % name)
+            setattr(self, name, value)
+        self.close()
+
+    def get_rate_limit(self, host):
+        '''\
+        Returns the (rate_limit, rate_burst) for the given host (which may
+        include a port).
+        '''
+        host_rate_limits = dict((name.lower(), limit) for name, limit in
+                                (self.host_rate_limits or { }).items())
+        host = host.lower()
+        for name in (host, host.split(':')[0]):
+            if name in host_rate_limits:
+                return host_rate_limits[name]
+        return self.rate_limit, self.rate_burst
+
+    def get_pool(self, scheme, host):
+        key = (scheme, host.lower())
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                breaker = CircuitBreaker(host, self.breaker_failures,
+                                         self.breaker_reset)
+                rate_limit = TokenBucket(*self.get_rate_limit(host))
+                concurrency = AdaptiveConcurrency(self.pool_size,
+                                                  self.max_concurrency)
+                pool = ConnectionPool(scheme, host, self.pool_size,
+                                      self.connect_timeout, self.read_timeout,
+                                      breaker, rate_limit, concurrency)
+                self._pools[key] = pool
+            return pool
+
+    def get_retry_delay(self, tries, response=None):
+        '''\
+        Returns the number of seconds to wait before trying a request again
+        after it has failed the given number of times, with response being the
+        last response (if there was one).
+        '''
+        limit = min(self.retry_backoff * 2 ** (tries - 1), MAX_RETRY_DELAY)
+        # a random wait, so requests that failed together aren't all retried
+        # at the same moment
+        delay = random.uniform(0, limit)
+        if response is not None:
+            try:
+                retry_after = int(response.getheader('Retry-After') or 0)
+            except ValueError:
+                # e.g. a date, which isn't worth the trouble
+                retry_after = 0
+            delay = max(delay, min(retry_after, MAX_RETRY_DELAY))
+        return delay
+
+    def request(self, scheme, host, method, selector, body=None, headers=None):
+        '''\
+        Makes a request, retrying it if need be, and returns the
+        (httplib.HTTPResponse, PooledResponse) for it; the PooledResponse is
+        used to read the body. If every try fails, the error from the last one
+        is raised, or the last response (with one of the RETRY_STATUSES) is
+        returned.
+        '''
+        pool = self.get_pool(scheme, host)
+        headers = dict(headers or { })
+        headers.setdefault('Connection', 'keep-alive')
+
+        deadline = None
+        if self.request_deadline:
+            deadline = time.time() + self.request_deadline
+        retries = 0
+        if method in IDEMPOTENT_METHODS:
+            retries = self.retries
+
+        tries = 0
+        while True:
+            response, fp, error = self._try(pool, method, selector, body,
+                                            headers, deadline)
+            if error is None and response.status not in RETRY_STATUSES:
+                return response, fp
+
+            tries += 1
+            delay = self.get_retry_delay(tries, response)
+            if tries > retries or not pool.breaker.is_closed() or \
+                (deadline is not None and time.time() + delay >= deadline):
+                if response is None:
+                    raise error[0], error[1], error[2]
+                return response, fp
+
+            if fp is not None:
+                fp.close()
+            time.sleep(delay)
+
+    def _try(self, pool, method, selector, body, headers, deadline):
+        '''\
+        Makes a single try of a request, once the rate limit, concurrency limit
+        and circuit breaker of the host allow it, and tells them how it went
+        (the concurrency limit is told by the PooledResponse once the body has
+        been read, unless the try failed before there was a response).
+        Returns (httplib.HTTPResponse, PooledResponse, None), or
+        (None, None, exc_info) if the try failed with one of the RETRY_ERRORS.
+        '''
+        pool.rate_limit.take(deadline)
+        started = pool.concurrency.acquire(deadline)
+        try:
+            probe = pool.breaker.before_request()
+        except:
+            # no request was made, so there is nothing to learn from this
+            pool.concurrency.release(started, None)
+            raise
+
+        failed = True
+        fp = None
+        try:
+            try:
+                response, fp = self._request(pool, method, selector, body,
+                                             headers, deadline, started)
+            except RETRY_ERRORS:
+                return None, None, sys.exc_info()
+            failed = response.status in RETRY_STATUSES
+            return response, fp, None
+        finally:
+            if fp is None:
+                pool.concurrency.release(started, False)
+            if failed:
+                pool.breaker.record_failure(probe)
+            else:
+                pool.breaker.record_success(probe)
+
+    def _request(self, pool, method, selector, body, headers, deadline,
+                 started=None):
+        '''\
+        Makes a single try of a request, on a connection from the given pool.
+        started is passed on to the PooledResponse.
+        '''
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise socket.timeout('the request took too long')
+            conn, reused = pool.get(timeout)
+            try:
+                conn.request(method, selector, body, headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                # only retry if the connection might have just gone stale;
+                # a new connection failing is a real error.
+                if reused:
+                    continue
+                raise
+            except:
+                conn.close()
+                raise
+
+            return response, PooledResponse(response, conn, pool, deadline,
+                                            started)
+
+    def close(self):
+        '''\
+        Closes all the idle connections.
+        '''
+        with self._lock:
+            pools = self._pools.values()
+            self._pools = { }
+        for pool in pools:
+            pool.close()
+
+class PooledHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    '''\
+    A urllib2 handler for HTTP and HTTPS requests that uses a Transport instead
+    of a new connection for each request.
+    '''
+    # run before the standard HTTP handlers
+    handler_order = urllib2.HTTPHandler.handler_order - 1
+
+    def __init__(self, transport):
+        urllib2.HTTPHandler.__init__(self)
+        self.transport = transport
+
+    def http_open(self, req):
+        return self._open(req, 'http')
+
+    def https_open(self, req):
+        return self._open(req, 'https')
+
+    def _open(self, req, scheme):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        # the same header handling urllib2's own handlers do
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict([ (k, v) for k, v in req.headers.items()
+                              if k not in headers ]))
+        headers = dict([ (name.title(), val) for name, val in headers.items() ])
+
+        try:
+            response, fp = self.transport.request(scheme, host,
+                                                  req.get_method(),
+                                                  req.get_selector(),
+                                                  req.get_data(), headers)
+        except (socket.error, httplib.HTTPException), e:
+            raise urllib2.URLError(e)
+
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+# the transport shared by everything in metaproc
+default_transport = Transport()
+
+# the Transport settings, and the setting in the settings file for each
+SETTING_NAMES = (
+    ('pool_size', 'HTTP_POOL_SIZE'),
+    ('connect_timeout', 'HTTP_CONNECT_TIMEOUT'),
+    ('read_timeout', 'HTTP_READ_TIMEOUT'),
+    ('retries', 'HTTP_RETRIES'),
+    ('retry_backoff', 'HTTP_RETRY_BACKOFF'),
+    ('request_deadline', 'HTTP_REQUEST_DEADLINE'),
+    ('breaker_failures', 'HTTP_BREAKER_FAILURES'),
+    ('breaker_reset', 'HTTP_BREAKER_RESET'),
+    ('rate_limit', 'HTTP_RATE_LIMIT'),
+    ('rate_burst', 'HTTP_RATE_BURST'),
+    ('host_rate_limits', 'HTTP_HOST_RATE_LIMITS'),
+    ('max_concurrency', 'HTTP_MAX_CONCURRENCY'),
+)
+
+def build_opener(*handlers):
+    '''\
+    Returns a urllib2 opener that uses the shared transport, along with any
+    other handlers given (e.g. a caching handler).
+    '''
+    return urllib2.build_opener(PooledHTTPHandler(default_transport), *handlers)
+
+def configure(conf):
+    '''\
+    Applies the HTTP_* settings to the shared transport.
+    '''
+    settings = { }
+    for name, setting in SETTING_NAMES:
+        if setting in conf:
+            settings[name] = conf[setting]
+    default_transport.configure(**settings)
@@ -0,0 +1,186 @@
+##
+# Directory walking helpers for metaproc.
+#
+# Each directory is listed once, and the file type and stat info obtained while
+# listing it are carried along with each path, so the facts function and the
+# processor don't need to go back to the filesystem to find out what a path is.
+##
+
+import os
+import stat
+
+# os.scandir is only available in Python 3.5+; the scandir module from PyPI
+# provides the same thing for older versions. If neither are available, fall
+# back to os.listdir and a single stat per entry.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+OVERRIDE_FILE_NAME = '.metaproc-override'
+
+class PathEntry(str):
+    '''\
+    A path which also carries the file type and stat info that was retrieved
+    when its parent directory was listed.
+
+    This is a str subclass, so it can be used anywhere a path string was used
+    before (facts functions and processors that are not aware of it will
+    continue to work). Like the paths returned by get_files_list, directories
+    have a trailing path separator.
+    '''
+    def __new__(cls, path, is_dir=False, is_file=False, stat_result=None,
+                dir_entry=None, has_override=False):
+        entry = str.__new__(cls, path)
+        entry._is_dir = is_dir
+        entry._is_file = is_file
+        entry._stat_result = stat_result
+        entry._dir_entry = dir_entry
+        # whether a per-file override (<name>.metaproc-override) was seen
+        # next to this path when the parent directory was listed.
+        entry.has_override = has_override
+        return entry
+
+    @property
+    def name(self):
+        '''\
+        The file name of this path, without any trailing path separator.
+        '''
+        return os.path.basename(self.rstrip(os.path.sep))
+
+    def is_dir(self):
+        return self._is_dir
+
+    def is_file(self):
+        return self._is_file
+
+    def stat(self):
+        '''\
+        Returns the stat result for this path, following symlinks. The result is
+        cached, so the filesystem is hit at most once per entry.
+        '''
+        if self._stat_result is None:
+            if self._dir_entry is not None:
+                self._stat_result = self._dir_entry.stat()
+            else:
+                self._stat_result = os.stat(self)
+        return self._stat_result
+
+class DirListing(list):
+    '''\
+    A list of the PathEntry objects in a directory, sorted by path. The
+    directory override file is not included in the list; whether it exists is
+    stored in the has_override attribute instead.
+    '''
+    def __init__(self, entries=(), names=(), has_override=False):
+        list.__init__(self, entries)
+        self.names = frozenset(names)
+        self.has_override = has_override
+
+def make_entry(path):
+    '''\
+    Returns a PathEntry for the given path. This costs one stat call, so it
+    should only be used for paths that did not come from scan_dir (e.g. the
+    directories in DIRS_TO_PROCESS or a path given on the command line).
+    '''
+    if isinstance(path, PathEntry):
+        return path
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return PathEntry(path)
+
+    is_dir = stat.S_ISDIR(st.st_mode)
+    if is_dir and not path.endswith(os.path.sep):
+        path += os.path.sep
+
+    has_override = not is_dir and \
+        os.path.exists(path + OVERRIDE_FILE_NAME)
+
+    return PathEntry(path, is_dir=is_dir, is_file=stat.S_ISREG(st.st_mode),
+                     stat_result=st, has_override=has_override)
+
+def scan_dir(path):
+    '''\
+    Lists the directory at the given path exactly once and returns a DirListing
+    of absolute PathEntry objects. Directories have a trailing path separator
+    added.
+    '''
+    entries = [ ]
+    names = [ ]
+
+    if scandir is not None:
+        it = scandir(path)
+        try:
+            for d in it:
+                names.append(d.name)
+                if d.name == OVERRIDE_FILE_NAME:
+                    continue
+                try:
+                    is_dir = d.is_dir()
+                    is_file = not is_dir and d.is_file()
+                except OSError:
+                    # broken symlinks and the like
+                    is_dir = is_file = False
+                p = os.path.join(path, d.name)
+                if is_dir:
+                    p += os.path.sep
+                entries.append(PathEntry(p, is_dir=is_dir, is_file=is_file,
+                                         dir_entry=d))
+        finally:
+            # the scandir iterator only gained close() in Python 3.6
+            if hasattr(it, 'close'):
+                it.close()
+    else:
+        for name in os.listdir(path):
+            names.append(name)
+            if name == OVERRIDE_FILE_NAME:
+                continue
+            p = os.path.join(path, name)
+            try:
+                st = os.stat(p)
+                is_dir = stat.S_ISDIR(st.st_mode)
+                is_file = stat.S_ISREG(st.st_mode)
+            except OSError:
+                st = None
+                is_dir = is_file = False
+            if is_dir:
+                p += os.path.sep
+            entries.append(PathEntry(p, is_dir=is_dir, is_file=is_file,
+                                     stat_result=st))
+
+    # per-file overrides are known from the listing, so there is no need to
+    # check for them one by one later.
+    names = frozenset(names)
+    for e in entries:
+        if not e.is_dir() and (e.name + OVERRIDE_FILE_NAME) in names:
+            e.has_override = True
+
+    # sort the entries so processing works in an orderly fashion, instead of a
+    # seemingly random order.
+    entries.sort()
+
+    return DirListing(entries, names,
+                      has_override=OVERRIDE_FILE_NAME in names)
+
+def path_is_dir(path):
+    '''\
+    Returns True if the path is a directory, using the cached info if the path
+    is a PathEntry.
+    '''
+    if isinstance(path, PathEntry):
+        return path.is_dir()
+    return os.path.isdir(path)
+
+def path_is_file(path):
+    '''\
+    Returns True if the path is a regular file, using the cached info if the
+    path is a PathEntry.
+    '''
+    if isinstance(path, PathEntry):
+        return path.is_file()
+    return os.path.isfile(path)
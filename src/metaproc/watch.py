@@ -0,0 +1,120 @@
+##
+# Filesystem watching for metaproc's --watch mode.
+#
+# This uses inotify (via the pyinotify module), so it only works on Linux.
+# pyinotify is an optional dependency; it is only needed for --watch.
+##
+
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+import walker
+
+# files that are still being written to only generate IN_CREATE; wait for them
+# to be closed instead. Directories don't get closed, so IN_CREATE is used for
+# those (see _EventHandler).
+WATCH_MASK = 0
+if pyinotify is not None:
+    WATCH_MASK = pyinotify.IN_CREATE | pyinotify.IN_CLOSE_WRITE | \
+                 pyinotify.IN_MOVED_TO
+
+class _EventHandler(object):
+    '''\
+    Collects the paths from inotify events, along with the time they were last
+    seen. Directories moved in are watched too.
+    '''
+    def __init__(self, pending, watch_manager):
+        self.pending = pending
+        self.watch_manager = watch_manager
+
+    def __call__(self, event):
+        if event.mask & pyinotify.IN_CREATE and not event.dir:
+            # wait for the IN_CLOSE_WRITE for files
+            return
+
+        if event.mask & pyinotify.IN_MOVED_TO and event.dir:
+            # auto_add only covers directories created in place; one moved in
+            # (e.g. a finished download) needs watching along with everything
+            # already inside it
+            self.watch_manager.add_watch(event.pathname, WATCH_MASK, rec=True,
+                                         auto_add=True)
+
+        path = event.pathname
+        name = os.path.basename(path)
+
+        # a changed override file means the directory or file it applies to
+        # needs to be looked at again
+        if name == walker.OVERRIDE_FILE_NAME:
+            path = os.path.dirname(path)
+        elif name.endswith(walker.OVERRIDE_FILE_NAME):
+            path = path[:-len(walker.OVERRIDE_FILE_NAME)]
+
+        self.pending[path] = time.time()
+
+class Watcher(object):
+    '''\
+    Watches the given directories and everything below them, and calls
+    callback(path) for each path that has been created or moved in.
+
+    Paths are only handed over once they have been left alone for
+    settle_seconds, so a download client that is still writing, or a batch of
+    files being moved in, is handled once rather than for every event. If a
+    directory and something inside it are both pending, only the directory is
+    handed over.
+    '''
+    def __init__(self, dirs, callback, settle_seconds=10):
+        if pyinotify is None:
+            raise ImportError('The pyinotify module is needed to watch directories.')
+
+        self.callback = callback
+        self.settle_seconds = settle_seconds
+        self.pending = { }
+
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager,
+                                           _EventHandler(self.pending,
+                                                         self.watch_manager))
+        for d in dirs:
+            # auto_add adds watches for new subdirectories as they are created
+            self.watch_manager.add_watch(d, WATCH_MASK, rec=True, auto_add=True)
+
+    def run(self):
+        '''\
+        Watches for changes until interrupted.
+        '''
+        try:
+            while True:
+                # wake up at least once a second to check for settled paths
+                if self.notifier.check_events(1000):
+                    self.notifier.read_events()
+                    self.notifier.process_events()
+                self._handle_settled()
+        finally:
+            self.notifier.stop()
+
+    def _handle_settled(self):
+        if not self.pending:
+            return
+
+        # hold everything back while anything is still changing; a directory
+        # being copied in would otherwise be handed over half-finished.
+        now = time.time()
+        if now - max(self.pending.values()) < self.settle_seconds:
+            return
+
+        paths = sorted(self.pending.keys())
+        self.pending.clear()
+
+        # paths are sorted, so a directory comes before anything inside it
+        handled = [ ]
+        for p in paths:
+            if [ h for h in handled if p.startswith(h + os.path.sep) ]:
+                continue
+            handled.append(p.rstrip(os.path.sep))
+            if os.path.exists(p):
+                self.callback(p)
@@ -0,0 +1,114 @@
+##
+# Work plans for metaproc.
+#
+# Processing happens in two phases. First the tree is walked and the processor
+# is asked what is missing for each path, without fetching anything; this
+# builds up a WorkPlan. The plan can then be printed (--dry-run) or carried out,
+# in which case the work is grouped (e.g. by series) so related fetches happen
+# together.
+##
+
+import os
+from threading import Lock
+
+class WorkItem(object):
+    '''\
+    Something that needs doing for a path. description says what the path is
+    (e.g. "series Entourage") and needs lists what is missing for it (e.g.
+    "poster"). Items with the same group (e.g. the same series) are carried out
+    together.
+
+    The conf and facts are the ones the path was planned with, so the work can
+    be carried out without walking the tree again.
+    '''
+    __slots__ = ('path', 'conf', 'facts', 'description', 'needs', 'group')
+
+    def __init__(self, path, conf, facts, description, needs, group=None):
+        self.path = path
+        self.conf = conf
+        self.facts = facts
+        self.description = description
+        self.needs = needs
+        self.group = group
+
+    def __str__(self):
+        return '%s needs %s' % (self.description, join_words(self.needs))
+
+    def __repr__(self):
+        return '<WorkItem %s: %s>' % (self.path, self)
+
+class WorkPlan(object):
+    '''\
+    The work found while walking the tree. Items can be added from more than
+    one thread.
+    '''
+    def __init__(self):
+        self.items = [ ]
+        self._lock = Lock()
+
+    def add(self, item):
+        with self._lock:
+            self.items.append(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_work(self, roots):
+        '''\
+        Returns the items in the order they should be carried out: items in
+        the same group are together, and otherwise items are in the order the
+        tree would be walked in (roots is the list of directories the tree was
+        walked from, i.e. DIRS_TO_PROCESS). Each path is only included once.
+        '''
+        with self._lock:
+            items = sorted(self.items, key=lambda i: get_walk_key(i.path, roots))
+
+        groups = [ ]
+        group_items = { }
+        seen = set()
+        for item in items:
+            if item.path in seen:
+                continue
+            seen.add(item.path)
+
+            # items without a group are on their own
+            key = item.group
+            if key is None:
+                key = ('path', item.path)
+            if key not in group_items:
+                groups.append(key)
+                group_items[key] = [ ]
+            group_items[key].append(item)
+
+        work = [ ]
+        for key in groups:
+            work.extend(group_items[key])
+        return work
+
+def get_walk_key(path, roots):
+    '''\
+    Returns a key that sorts paths in the order they are walked in: a directory
+    comes before everything in it, and the entries of a directory are in the
+    same order as in its listing (see walker.scan_dir).
+    '''
+    root_index = len(roots)
+    for i, r in enumerate(roots):
+        if path.startswith(r):
+            root_index = i
+            break
+
+    parts = path.rstrip(os.path.sep).split(os.path.sep)
+    key = [ p + os.path.sep for p in parts[:-1] ]
+    if path.endswith(os.path.sep):
+        key.append(parts[-1] + os.path.sep)
+    else:
+        key.append(parts[-1])
+    return (root_index, key)
+
+def join_words(words):
+    '''\
+    Joins the given words into a list for a sentence, e.g. "a, b and c".
+    '''
+    if len(words) < 2:
+        return ''.join(words)
+    return '%s and %s' % (', '.join(words[:-1]), words[-1])